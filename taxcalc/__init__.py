@@ -1,6 +1,10 @@
 """
 Specify what is available to import from the taxcalc package.
 """
+# the version is specified before the modules are imported so that the
+# kernel cache (see the decorators.py module) can include it in its keys
+__version__ = '0.0.0'
+
 from taxcalc.calculator import *
 from taxcalc.consumption import *
 from taxcalc.growfactors import *
@@ -8,8 +12,7 @@ from taxcalc.growdiff import *
 from taxcalc.parameters import *
 from taxcalc.policy import *
 from taxcalc.records import *
+from taxcalc.resultcache import *
 from taxcalc.taxcalcio import *
 from taxcalc.utils import *
 from taxcalc.cli import *
-
-__version__ = '0.0.0'
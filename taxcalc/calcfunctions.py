@@ -18,11 +18,11 @@ in a reform that introduces chained-CPI indexing).
 # pylint: disable=too-many-locals
 
 import math
-import copy
 import numpy as np
-from taxcalc.decorators import iterate_jit, JIT
+from taxcalc.decorators import iterate_jit, JIT, timed
 
 
+@timed
 def BenefitPrograms(calc):
     """
     Calculate total government cost and consumption value of benefits
@@ -1706,33 +1706,26 @@ def Taxes(income, MARS, tbrk_base,
             rate8 * max(0., income - brk7))
 
 
+@timed
 def ComputeBenefit(calc, ID_switch):
     """
     Calculates the value of the benefits accrued from itemizing.
     """
     # compute income tax liability with no itemized deductions allowed for
     # the types of itemized deductions covered under the BenefitSurtax
-    no_ID_calc = copy.deepcopy(calc)
-    if ID_switch[0]:
-        no_ID_calc.policy_param('ID_Medical_hc', 1.)
-    if ID_switch[1]:
-        no_ID_calc.policy_param('ID_StateLocalTax_hc', 1.)
-    if ID_switch[2]:
-        no_ID_calc.policy_param('ID_RealEstate_hc', 1.)
-    if ID_switch[3]:
-        no_ID_calc.policy_param('ID_Casualty_hc', 1.)
-    if ID_switch[4]:
-        no_ID_calc.policy_param('ID_Miscellaneous_hc', 1.)
-    if ID_switch[5]:
-        no_ID_calc.policy_param('ID_InterestPaid_hc', 1.)
-    if ID_switch[6]:
-        no_ID_calc.policy_param('ID_Charity_hc', 1.)
-    no_ID_calc._calc_one_year()  # pylint: disable=protected-access
-    diff_iitax = no_ID_calc.array('iitax') - calc.array('iitax')
+    hc_params = ['ID_Medical_hc', 'ID_StateLocalTax_hc', 'ID_RealEstate_hc',
+                 'ID_Casualty_hc', 'ID_Miscellaneous_hc',
+                 'ID_InterestPaid_hc', 'ID_Charity_hc']
+    no_ID_params = {pname: 1. for pname, switch in zip(hc_params, ID_switch)
+                    if switch}
+    # pylint: disable=protected-access
+    no_ID_iitax = calc._counterfactual_iitax(no_ID_params)
+    diff_iitax = no_ID_iitax - calc.array('iitax')
     benefit = np.where(diff_iitax > 0., diff_iitax, 0.)
     return benefit
 
 
+@timed
 def BenefitSurtax(calc):
     """
     Computes itemized-deduction-benefit surtax and adds the surtax amount
@@ -1754,6 +1747,7 @@ def BenefitSurtax(calc):
         calc.incarray('surtax', ben_surtax)
 
 
+@timed
 def BenefitLimitation(calc):
     """
     Limits the benefits of select itemized deductions to a fraction of
@@ -10,9 +10,14 @@ Tax-Calculator federal income and payroll tax Calculator class.
 import os
 import re
 import copy
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import numpy as np
 import pandas as pd
+from taxcalc import calcfunctions
 from taxcalc.calcfunctions import (TaxInc, SchXYZTax, GainsTax, AGIsurtax,
                                    NetInvIncTax, AMT, EI_PayrollTax, Adj,
                                    DependentCare, ALD_InvInc_ec_base, CapGains,
@@ -26,9 +31,13 @@ from taxcalc.calcfunctions import (TaxInc, SchXYZTax, GainsTax, AGIsurtax,
                                    BenefitSurtax, BenefitLimitation,
                                    FairShareTax, LumpSumTax, BenefitPrograms,
                                    ExpandIncome, AfterTaxIncome)
+from taxcalc.decorators import (make_fused_function, make_batched_function,
+                                kernel_threads, kernel_timings,
+                                record_timing)
 from taxcalc.policy import Policy
 from taxcalc.records import Records
 from taxcalc.consumption import Consumption
+from taxcalc.resultcache import ResultCache, calc_all_fingerprint
 from taxcalc.growdiff import GrowDiff
 from taxcalc.growfactors import GrowFactors
 from taxcalc.utils import (json_to_dict,
@@ -42,6 +51,31 @@ from taxcalc.utils import (json_to_dict,
 # import pdb
 
 
+# calculated itemized-deduction component variables
+ITEMDED_COMPONENT_VARIABLES = ['c17000', 'c18300', 'c19200',
+                               'c19700', 'c20500', 'c20800']
+
+# total income variables that include each mtr variable that is a part
+MTR_TOTAL_VARIABLES = {'e00200p': 'e00200', 'e00200s': 'e00200',
+                       'e00900p': 'e00900', 'e00650': 'e00600',
+                       'e26270': 'e02000'}
+
+# tax-calculation functions called by the Calculator._calc_one_year method
+# before, during, and after the choice between the standard deduction and
+# itemized deductions
+PRE_DEDUCTION_CHOICE_FUNCTIONS = [EI_PayrollTax, DependentCare, Adj,
+                                  ALD_InvInc_ec_base, CapGains, SSBenefits,
+                                  UBI, AGI, ItemDedCap, ItemDed,
+                                  AdditionalMedicareTax, StdDed]
+TAXINC_TO_AMT_FUNCTIONS = [TaxInc, SchXYZTax, GainsTax,
+                           AGIsurtax, NetInvIncTax, AMT]
+POST_DEDUCTION_CHOICE_FUNCTIONS = [F2441, EITC, PersonalTaxCredit,
+                                   AmOppCreditParts, SchR,
+                                   EducationTaxCredit, CharityCredit,
+                                   ChildDepTaxCredit, NonrefundableCredits,
+                                   AdditionalCTC, C1040, CTC_new, IITAX]
+
+
 class Calculator():
     """
     Constructor for the Calculator class.
@@ -71,6 +105,38 @@ class Calculator():
         consumption values specified implying consumption value is equal to
         government cost of providing the in-kind benefits
 
+    fused: boolean
+        specifies whether or not the _calc_one_year method does all its
+        calculations for a filing unit before moving on to the next filing
+        unit (see the make_fused_function in the decorators.py module),
+        which reads each filing unit's data from memory far fewer times
+        than calling each tax-calculation function for all filing units;
+        the results are the same either way; default value is false.
+
+    num_threads: integer or None
+        specifies number of threads across which the calc_all method splits
+        the loop over filing units in each tax-calculation function (see
+        the kernel_threads function in the decorators.py module); the
+        results are the same for any number of threads; default is None,
+        which implies the number of threads is specified by the
+        TAXCALC_NUM_THREADS environment variable, or is one when that
+        environment variable is not set.
+
+    timing: boolean
+        specifies whether or not the calc_all and calc_scenarios methods
+        record the number of calls, the number of records processed, and
+        the wall time of each tax-calculation function they call (see the
+        timings method); default value is false, which implies no
+        recording is done.
+
+    cache: ResultCache class object or None
+        specifies where the calc_all method looks for the results of an
+        earlier calc_all call with the same inputs (see the fingerprint
+        method), which it copies instead of doing the calculations, and
+        where it stores its results when none are found; the object is
+        not copied, so it can be shared by many Calculator objects;
+        default value is None, which implies no caching is done.
+
     Raises
     ------
     ValueError:
@@ -95,7 +161,8 @@ class Calculator():
     # pylint: disable=too-many-public-methods
 
     def __init__(self, policy=None, records=None, verbose=False,
-                 sync_years=True, consumption=None):
+                 sync_years=True, consumption=None, fused=False,
+                 num_threads=None, timing=False, cache=None):
         # pylint: disable=too-many-arguments,too-many-branches
         if isinstance(policy, Policy):
             self.__policy = copy.deepcopy(policy)
@@ -115,6 +182,11 @@ class Calculator():
             raise ValueError('consumption must be None or Consumption object')
         if self.__consumption.current_year < self.__policy.current_year:
             self.__consumption.set_year(self.__policy.current_year)
+        if num_threads is not None:
+            if not isinstance(num_threads, int) or num_threads < 1:
+                raise ValueError('num_threads must be None or positive int')
+        if cache is not None and not isinstance(cache, ResultCache):
+            raise ValueError('cache must be None or ResultCache object')
         if verbose:
             if self.__records.IGNORED_VARS:
                 print('Your data include the following unused ' +
@@ -137,6 +209,16 @@ class Calculator():
         assert self.__policy.current_year == self.__records.current_year
         assert self.__policy.current_year == self.__consumption.current_year
         self.__stored_records = None
+        self.__saved = None
+        self.__saved_year = None
+        self.__counterfactuals = dict()
+        self.__fused = fused
+        self.__num_threads = num_threads
+        self.__cache = cache
+        if timing:
+            self.__timings = dict()
+        else:
+            self.__timings = None
 
     def increment_year(self):
         """
@@ -161,19 +243,256 @@ class Calculator():
             self.increment_year()
         assert self.current_year == year
 
-    def calc_all(self, zero_out_calc_vars=False):
+    def calc_all(self, zero_out_calc_vars=False, outputs=None):
         """
-        Call all tax-calculation functions for the current_year.
+        Call all tax-calculation functions for the current_year, or when
+        this Calculator object has a cache containing the results for the
+        same inputs, copy those results.
+
+        Parameters
+        ----------
+        zero_out_calc_vars: boolean
+            specifies whether or not the calculated variables that change
+            during the calculations are set to zero before the calculations
+            are done; default value is false.
+
+        outputs: list of strings or None
+            names of the Records variables that are needed after the call,
+            where only the tax-calculation functions on which the values
+            of those variables depend are called (see the output_stages
+            function in this module), so the other calculated variables
+            may not have their calc_all values; default value is None,
+            which implies all tax-calculation functions are called.
+
+        Raises
+        ------
+        ValueError:
+            if an outputs name is not a Records variable.
+
+        Returns
+        -------
+        nothing
         """
         # conducts static analysis of Calculator object for current_year
-        BenefitPrograms(self)
-        self._calc_one_year(zero_out_calc_vars)
-        BenefitSurtax(self)
-        BenefitLimitation(self)
-        FairShareTax(self.__policy, self.__records)
-        LumpSumTax(self.__policy, self.__records)
-        ExpandIncome(self.__policy, self.__records)
-        AfterTaxIncome(self.__policy, self.__records)
+        if outputs is not None:
+            for name in outputs:
+                if not (name in Records.USABLE_READ_VARS or
+                        name in Records.CALCULATED_VARS):
+                    msg = '{} is not a Records variable'
+                    raise ValueError(msg.format(name))
+        fingerprint = None
+        if self.__cache is not None:
+            start_time = time.perf_counter()
+            fingerprint = self.fingerprint()
+            cached = self.__cache.get(fingerprint)
+            if cached is not None:
+                for varname, value in cached.items():
+                    setattr(self.__records, varname, value.copy())
+                self.__counterfactuals = dict()
+                self.__saved = None
+                if self.__timings is not None:
+                    record_timing(self.__timings, 'cached_calc_all',
+                                  self.array_len, start_time)
+                return
+        with kernel_threads(self.__num_threads), \
+                kernel_timings(self.__timings):
+            start_time = time.perf_counter()
+            self.__counterfactuals = dict()
+            if outputs is not None:
+                if zero_out_calc_vars:
+                    self.__records.zero_out_changing_calculated_vars()
+                for idx in output_stages(outputs):
+                    func = CALC_ALL_STAGES[idx][1]
+                    if hasattr(func, 'calc_func'):
+                        func(self.__policy, self.__records)
+                    else:
+                        func(self)
+                if self.__timings is not None:
+                    record_timing(self.__timings, 'calc_all',
+                                  self.array_len, start_time)
+                self.__saved = None
+                return
+            BenefitPrograms(self)
+            self._calc_one_year(zero_out_calc_vars)
+            BenefitSurtax(self)
+            BenefitLimitation(self)
+            FairShareTax(self.__policy, self.__records)
+            LumpSumTax(self.__policy, self.__records)
+            ExpandIncome(self.__policy, self.__records)
+            AfterTaxIncome(self.__policy, self.__records)
+            if self.__timings is not None:
+                record_timing(self.__timings, 'calc_all', self.array_len,
+                              start_time)
+        self.__saved = None
+        if fingerprint is not None:
+            self.__cache.put(fingerprint,
+                             {varname: self.array(varname)
+                              for varname in Records.CALCULATED_VARS})
+
+    def fingerprint(self):
+        """
+        Return hexadecimal string that is a hash of the inputs to the
+        calc_all method in the current_year: the Records read variables,
+        the Policy parameter values, and the Consumption parameter values
+        (see the calc_all_fingerprint function in the resultcache.py
+        module).  Calculator objects with the same fingerprint get the
+        same results from calc_all.
+        """
+        return calc_all_fingerprint(self.__policy, self.__records,
+                                    self.__consumption)
+
+    def recalc(self, changed_params):
+        """
+        Redo the calc_all calculations for the current_year after changes
+        in the values of the named policy parameters, consumption
+        parameters, or Records variables, calling only the
+        tax-calculation functions whose results depend on those changes
+        (see the recalc_stages function in this module), which gives the
+        same results as calling calc_all, but much faster when few
+        functions depend on the changes (for example, in a loop that
+        adjusts one policy parameter).  The first recalc call after a
+        calc_all call or a change in current_year calls all the functions
+        and saves the values of the variables that are changed by more
+        than one function (which uses extra memory), so that later recalc
+        calls can restore those values instead of calling the functions
+        that computed them.
+
+        Parameters
+        ----------
+        changed_params : list of strings
+            names of every parameter or variable whose value has changed
+            since the last recalc call, where a policy parameter name may
+            have a leading underscore
+
+        Raises
+        ------
+        ValueError:
+            if a name is not a policy parameter, consumption parameter,
+            or Records variable.
+
+        Returns
+        -------
+        nothing
+        """
+        changed = set()
+        for name in changed_params:
+            name = name[1:] if name.startswith('_') else name
+            if not (hasattr(self.__policy, name) or
+                    hasattr(self.__consumption, name) or
+                    name in Records.USABLE_READ_VARS or
+                    name in Records.CALCULATED_VARS):
+                msg = '{} is not a parameter or Records variable'
+                raise ValueError(msg.format(name))
+            changed.add(name)
+        if self.__saved is None or self.__saved_year != self.current_year:
+            self.__saved = dict()
+            self.__saved_year = self.current_year
+            stages = recalc_stages(None)
+        else:
+            stages = recalc_stages(changed)
+        with kernel_threads(self.__num_threads), \
+                kernel_timings(self.__timings):
+            start_time = time.perf_counter()
+            self.__counterfactuals = dict()
+            for idx, restored in stages:
+                # a calculated variable with no writer is restored to its
+                # initial value of zero, so the results are the same as
+                # those of calc_all for a Calculator object whose
+                # calculated variables have not yet been calculated
+                for name, widx in restored:
+                    if widx is None:
+                        if name in Records.CALCULATED_VARS:
+                            self.array(name).fill(0)
+                    else:
+                        np.copyto(self.__records.writable_array(name),
+                                  self.__saved[(name, widx)])
+                func = CALC_ALL_STAGES[idx][1]
+                if hasattr(func, 'calc_func'):
+                    func(self.__policy, self.__records)
+                else:
+                    func(self)
+                for name in SAVED_VARIABLES[idx]:
+                    self.__saved[(name, idx)] = self.array(name).copy()
+            if self.__timings is not None:
+                record_timing(self.__timings, 'recalc', self.array_len,
+                              start_time)
+
+    def timings(self):
+        """
+        Return Pandas DataFrame containing, for each function called by
+        the calc_all and calc_scenarios methods since this Calculator
+        object was constructed, the number of calls, the total number of
+        records processed, and the total wall time in seconds, with one
+        row for each function indexed by function name and sorted from
+        the most to the least time-consuming function.  The wall time of
+        a function includes the time of the functions it calls (for
+        example, BenefitSurtax includes ComputeBenefit, which in turn
+        includes the tax-calculation functions it calls).
+        The DataFrame is empty unless the Calculator object was
+        constructed with timing=True.
+        """
+        timings = self.__timings if self.__timings is not None else dict()
+        tdf = pd.DataFrame.from_dict(timings, orient='index',
+                                     columns=['calls', 'records', 'seconds'])
+        return tdf.sort_values('seconds', ascending=False)
+
+    BENEFIT_REPEAL_PARAMS = ['BEN_housing_repeal', 'BEN_ssi_repeal',
+                             'BEN_snap_repeal', 'BEN_tanf_repeal',
+                             'BEN_vet_repeal', 'BEN_wic_repeal',
+                             'BEN_mcare_repeal', 'BEN_mcaid_repeal',
+                             'BEN_oasdi_repeal', 'BEN_ui_repeal',
+                             'BEN_other_repeal']
+
+    def calc_scenarios(self, policies, variable_list):
+        """
+        Conduct the calc_all calculations for the current_year under each
+        of the policies, doing the calculations for all the policies in one
+        pass through the filing units, which is much faster than using a
+        separate Calculator object for each policy when there are many
+        policies (for example, a grid of values for one parameter).
+        This method leaves the calculated variables in the embedded Records
+        object unchanged, except for those calculated by BenefitPrograms.
+
+        Parameters
+        ----------
+        policies : list of Policy objects
+            each of which is used for the current_year (after being copied
+            when its current_year is not the current_year); the
+            benefit-program repeal parameters must have the same values as
+            in the embedded Policy object, and the itemized-deduction
+            benefit surtax and benefit limitation must not be active
+
+        variable_list : list of Records variable names
+            whose values are returned for each policy
+
+        Returns
+        -------
+        dictionary containing for each variable in variable_list a numpy
+        ndarray with one row for each policy and one column for each
+        filing unit
+        """
+        if not isinstance(policies, list) or not policies:
+            raise ValueError('policies must be a non-empty list')
+        scenario_policies = list()
+        for pol in policies:
+            if not isinstance(pol, Policy):
+                raise ValueError('each policy must be a Policy object')
+            if pol.current_year != self.current_year:
+                pol = copy.deepcopy(pol)
+                pol.set_year(self.current_year)
+            for pname in Calculator.BENEFIT_REPEAL_PARAMS:
+                if getattr(pol, pname) != self.policy_param(pname):
+                    msg = '{} differs from embedded Policy object value'
+                    raise ValueError(msg.format(pname))
+            if pol.ID_BenefitSurtax_crt != 1. or pol.ID_BenefitCap_rt != 1.:
+                msg = ('ID_BenefitSurtax or ID_BenefitCap is active, '
+                       'so use separate Calculator objects')
+                raise ValueError(msg)
+            scenario_policies.append(pol)
+        with kernel_timings(self.__timings):
+            BenefitPrograms(self)
+            return batched_function(variable_list)(scenario_policies,
+                                                   self.__records)
 
     def weighted_total(self, variable_name):
         """
@@ -270,8 +589,7 @@ class Calculator():
         that was saved in the last call to the store_records() method.
         """
         assert isinstance(self.__stored_records, Records)
-        self.__records = copy.deepcopy(self.__stored_records)
-        del self.__stored_records
+        self.__records = self.__stored_records
         self.__stored_records = None
 
     @property
@@ -328,7 +646,7 @@ class Calculator():
         """
         return self.__records.data_year
 
-    def diagnostic_table(self, num_years):
+    def diagnostic_table(self, num_years, num_workers=1):
         """
         Generate multi-year diagnostic table containing aggregate statistics;
         this method leaves the Calculator object unchanged.
@@ -340,6 +658,13 @@ class Calculator():
             with the Calculator object's current_year (must be at least
             one and no more than what would exceed Policy end_year)
 
+        num_workers : Integer
+            number of threads that at the same time each compute the
+            diagnostic table column for a different year using a copy of
+            this Calculator object advanced to that year; the default value
+            of one computes the columns one year after another using one
+            copy of this Calculator object
+
         Returns
         -------
         Pandas DataFrame object containing the multi-year diagnostic table
@@ -347,17 +672,39 @@ class Calculator():
         assert num_years >= 1
         max_num_years = self.__policy.end_year - self.__policy.current_year + 1
         assert num_years <= max_num_years
-        calc = copy.deepcopy(self)
-        yearlist = list()
-        varlist = list()
-        for iyr in range(1, num_years + 1):
+        if not isinstance(num_workers, int) or num_workers < 1:
+            raise ValueError('num_workers must be a positive integer')
+
+        def year_column(calc):
+            """
+            Return diagnostic table column for the current_year of calc.
+            """
             calc.calc_all()
-            yearlist.append(calc.current_year)
-            varlist.append(calc.dataframe(DIST_VARIABLES))
-            if iyr < num_years:
-                calc.increment_year()
-        del calc
-        return create_diagnostic_table(varlist, yearlist)
+            return create_diagnostic_table([calc.dataframe(DIST_VARIABLES)],
+                                           [calc.current_year])
+
+        def advanced_year_column(num_increments):
+            """
+            Return diagnostic table column for the year that is the
+            specified number of years after the current_year.
+            """
+            calc = copy.deepcopy(self)
+            calc.advance_to_year(self.current_year + num_increments)
+            return year_column(calc)
+
+        if num_workers > 1 and num_years > 1:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                columns = list(executor.map(advanced_year_column,
+                                            range(num_years)))
+        else:
+            calc = copy.deepcopy(self)
+            columns = list()
+            for iyr in range(1, num_years + 1):
+                columns.append(year_column(calc))
+                if iyr < num_years:
+                    calc.increment_year()
+            del calc
+        return pd.concat(columns, axis=1)
 
     def distribution_tables(self, calc, groupby, scaling=True):
         """
@@ -593,8 +940,7 @@ class Calculator():
         'e19800',  Charity cash contributions;
         'e20100',  Charity non-cash contributions.
         """
-        # pylint: disable=too-many-arguments,too-many-statements
-        # pylint: disable=too-many-locals,too-many-branches
+        # pylint: disable=too-many-arguments
         assert not zero_out_calculated_vars or not calc_all_already_called
         # check validity of variable_str parameter
         if variable_str not in Calculator.MTR_VALID_VARIABLES:
@@ -604,95 +950,134 @@ class Calculator():
         finite_diff = 0.01  # a one-cent difference
         if negative_finite_diff:
             finite_diff *= -1.0
-        # remember records object in order to restore it after mtr computations
-        self.store_records()
-        # extract variable array(s) from embedded records object
-        variable = self.array(variable_str)
-        if variable_str == 'e00200p':
-            earnings_var = self.array('e00200')
-        elif variable_str == 'e00200s':
-            earnings_var = self.array('e00200')
-        elif variable_str == 'e00900p':
-            seincome_var = self.array('e00900')
-        elif variable_str == 'e00650':
-            divincome_var = self.array('e00600')
-        elif variable_str == 'e26270':
-            schEincome_var = self.array('e02000')
-        # calculate level of taxes after a marginal increase in income
-        self.array(variable_str, variable + finite_diff)
-        if variable_str == 'e00200p':
-            self.array('e00200', earnings_var + finite_diff)
-        elif variable_str == 'e00200s':
-            self.array('e00200', earnings_var + finite_diff)
-        elif variable_str == 'e00900p':
-            self.array('e00900', seincome_var + finite_diff)
-        elif variable_str == 'e00650':
-            self.array('e00600', divincome_var + finite_diff)
-        elif variable_str == 'e26270':
-            self.array('e02000', schEincome_var + finite_diff)
-        if self.__consumption.has_response():
-            self.__consumption.response(self.__records, finite_diff)
-        self.calc_all(zero_out_calc_vars=zero_out_calculated_vars)
-        payrolltax_chng = self.array('payrolltax')
-        incometax_chng = self.array('iitax')
-        combined_taxes_chng = incometax_chng + payrolltax_chng
-        # calculate base level of taxes after restoring records object
-        self.restore_records()
-        if not calc_all_already_called or zero_out_calculated_vars:
+        rows = self._mtr_rows(variable_str)
+        if rows is None:
+            # remember records object in order to restore it after mtr
+            # computations
+            self.store_records()
+            # calculate level of taxes after a marginal increase in income
+            for varname, value in self._mtr_inputs(variable_str,
+                                                   finite_diff).items():
+                self.array(varname, value)
+            if self.__consumption.has_response():
+                self.__consumption.response(self.__records, finite_diff)
             self.calc_all(zero_out_calc_vars=zero_out_calculated_vars)
-        payrolltax_base = self.array('payrolltax')
-        incometax_base = self.array('iitax')
-        combined_taxes_base = incometax_base + payrolltax_base
-        # compute marginal changes in combined tax liability
-        payrolltax_diff = payrolltax_chng - payrolltax_base
-        incometax_diff = incometax_chng - incometax_base
-        combined_diff = combined_taxes_chng - combined_taxes_base
-        # specify optional adjustment for employer (er) OASDI+HI payroll taxes
-        mtr_on_earnings = variable_str in ('e00200p', 'e00200s')
-        if wrt_full_compensation and mtr_on_earnings:
-            # pylint: disable=assignment-from-no-return
-            oasdi_taxed = np.logical_or(
-                variable < self.policy_param('SS_Earnings_c'),
-                variable >= self.policy_param('SS_Earnings_thd')
-            )
-            adj = np.where(oasdi_taxed,
-                           0.5 * (self.policy_param('FICA_ss_trt') +
-                                  self.policy_param('FICA_mc_trt')),
-                           0.5 * self.policy_param('FICA_mc_trt'))
+            payrolltax_chng = self.array('payrolltax')
+            incometax_chng = self.array('iitax')
+            # calculate base level of taxes after restoring records object
+            self.restore_records()
         else:
-            adj = 0.0
-        # compute marginal tax rates
-        mtr_payrolltax = payrolltax_diff / (finite_diff * (1.0 + adj))
-        mtr_incometax = incometax_diff / (finite_diff * (1.0 + adj))
-        mtr_combined = combined_diff / (finite_diff * (1.0 + adj))
-        # if variable_str is e00200s, set MTR to NaN for units without a spouse
-        if variable_str == 'e00200s':
-            mars = self.array('MARS')
-            mtr_payrolltax = np.where(mars == 2, mtr_payrolltax, np.nan)
-            mtr_incometax = np.where(mars == 2, mtr_incometax, np.nan)
-            mtr_combined = np.where(mars == 2, mtr_combined, np.nan)
-        # delete intermediate variables
-        del variable
-        if variable_str in ('e00200p', 'e00200s'):
-            del earnings_var
-        elif variable_str == 'e00900p':
-            del seincome_var
-        elif variable_str == 'e00650':
-            del divincome_var
-        elif variable_str == 'e26270':
-            del schEincome_var
-        del payrolltax_chng
-        del incometax_chng
-        del combined_taxes_chng
-        del payrolltax_base
-        del incometax_base
-        del combined_taxes_base
-        del payrolltax_diff
-        del incometax_diff
-        del combined_diff
-        del adj
+            # calculate level of taxes after a marginal increase in income
+            # for only the filing units that have marginal tax rates
+            calc = self._changed_calculator(
+                self._mtr_inputs(variable_str, finite_diff), rows=rows)
+            if calc.__consumption.has_response():
+                calc.__consumption.response(calc.__records, finite_diff)
+            calc.calc_all(zero_out_calc_vars=zero_out_calculated_vars)
+            payrolltax_chng = calc.array('payrolltax')
+            incometax_chng = calc.array('iitax')
+        if not calc_all_already_called or zero_out_calculated_vars:
+            self.calc_all(zero_out_calc_vars=zero_out_calculated_vars)
+        if rows is not None:
+            payrolltax_chng = self._mtr_scatter('payrolltax', rows,
+                                                payrolltax_chng)
+            incometax_chng = self._mtr_scatter('iitax', rows, incometax_chng)
         # return the three marginal tax rate arrays
-        return (mtr_payrolltax, mtr_incometax, mtr_combined)
+        return self._mtr_rates(variable_str, finite_diff,
+                               wrt_full_compensation,
+                               payrolltax_chng, incometax_chng)
+
+    def mtrs(self, variable_list,
+             negative_finite_diff=False,
+             calc_all_already_called=False,
+             wrt_full_compensation=True,
+             num_workers=1):
+        """
+        Calculates the marginal payroll, individual income, and combined
+        tax rates for every tax filing unit with respect to each variable
+        in variable_list, giving the same rates as the mtr method, but
+        doing the base calculations only once and, for each variable,
+        copying only the Records variables that the calculations change
+        rather than the whole Records object.  The Calculator object is
+        left in exactly the same state as it would be in after a
+        calc_all() call.
+
+        Parameters
+        ----------
+        variable_list: list of strings
+            each of which is a valid mtr variable_str value (see the
+            documentation of the mtr method).
+
+        negative_finite_diff: boolean
+            see documentation of the mtr method.
+
+        calc_all_already_called: boolean
+            see documentation of the mtr method.
+
+        wrt_full_compensation: boolean
+            see documentation of the mtr method.
+
+        num_workers: integer
+            specifies the number of threads that do the calculations for
+            the increased values of the variables in variable_list at the
+            same time; default value is one.
+
+        Returns
+        -------
+        A dictionary containing for each variable in variable_list the
+        tuple of numpy arrays returned by the mtr method.
+        """
+        # pylint: disable=too-many-arguments
+        if not isinstance(variable_list, list):
+            raise ValueError('variable_list must be a list')
+        for variable_str in variable_list:
+            if variable_str not in Calculator.MTR_VALID_VARIABLES:
+                msg = 'mtrs variable_list item "{}" is not valid'
+                raise ValueError(msg.format(variable_str))
+        if not isinstance(num_workers, int) or num_workers < 1:
+            raise ValueError('num_workers must be a positive integer')
+        start_time = time.perf_counter()
+        finite_diff = 0.01  # a one-cent difference
+        if negative_finite_diff:
+            finite_diff *= -1.0
+
+        def changed_taxes(variable_str):
+            """
+            Return payroll and income taxes after a marginal increase in
+            the variable_str variable.
+            """
+            calc = self._changed_calculator(
+                self._mtr_inputs(variable_str, finite_diff),
+                rows=self._mtr_rows(variable_str))
+            if calc.__consumption.has_response():
+                calc.__consumption.response(calc.__records, finite_diff)
+            calc.calc_all()
+            return (calc.array('payrolltax'), calc.array('iitax'))
+
+        variables = list(set(variable_list))
+        if num_workers > 1 and len(variables) > 1:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                taxes = list(executor.map(changed_taxes, variables))
+        else:
+            taxes = [changed_taxes(variable_str)
+                     for variable_str in variables]
+        if not calc_all_already_called:
+            self.calc_all()
+        mtrs = dict()
+        for variable_str, (payrolltax_chng, incometax_chng) in zip(variables,
+                                                                   taxes):
+            rows = self._mtr_rows(variable_str)
+            if rows is not None:
+                payrolltax_chng = self._mtr_scatter('payrolltax', rows,
+                                                    payrolltax_chng)
+                incometax_chng = self._mtr_scatter('iitax', rows,
+                                                   incometax_chng)
+            mtrs[variable_str] = self._mtr_rates(
+                variable_str, finite_diff, wrt_full_compensation,
+                payrolltax_chng, incometax_chng)
+        if self.__timings is not None:
+            record_timing(self.__timings, 'mtrs', self.array_len, start_time)
+        return mtrs
 
     def mtr_graph(self, calc,
                   mars='ALL',
@@ -1365,16 +1750,178 @@ class Calculator():
 
     # ----- begin private methods of Calculator class -----
 
-    def _taxinc_to_amt(self):
+    def _deduction_choice(self):
+        """
+        Calculate taxes with the standard deduction and with itemized
+        deductions, and then again with whichever of the two produces lower
+        taxes, for each filing unit in one pass through the filing units
+        (see the deduction_choice_steps function).
+        """
+        deduction_choice_function()(self.__policy, self.__records)
+
+    def _mtr_inputs(self, variable_str, finite_diff):
         """
-        Call TaxInc through AMT functions.
+        Return dictionary containing the values of the Records variables
+        that are increased by finite_diff when computing marginal tax rates
+        with respect to the variable_str variable.
         """
-        TaxInc(self.__policy, self.__records)
-        SchXYZTax(self.__policy, self.__records)
-        GainsTax(self.__policy, self.__records)
-        AGIsurtax(self.__policy, self.__records)
-        NetInvIncTax(self.__policy, self.__records)
-        AMT(self.__policy, self.__records)
+        inputs = {variable_str: self.array(variable_str) + finite_diff}
+        total_str = MTR_TOTAL_VARIABLES.get(variable_str)
+        if total_str is not None:
+            inputs[total_str] = self.array(total_str) + finite_diff
+        return inputs
+
+    def _mtr_rows(self, variable_str):
+        """
+        Return array of the indexes of the filing units that have marginal
+        tax rates with respect to the variable_str variable (see the
+        _mtr_rates method), or None when every filing unit has them, so
+        that the taxes after a marginal increase in the variable need to
+        be calculated only for those filing units.
+        """
+        if variable_str == 'e00200s':
+            return np.flatnonzero(self.array('MARS') == 2)
+        return None
+
+    def _mtr_scatter(self, variable_name, rows, values):
+        """
+        Return copy of the variable_name array with the elements whose
+        indexes are in the rows array replaced by the values array, which
+        contains the values calculated for only those filing units.
+        """
+        array = self.array(variable_name).copy()
+        array[rows] = values
+        return array
+
+    def _mtr_rates(self, variable_str, finite_diff, wrt_full_compensation,
+                   payrolltax_chng, incometax_chng):
+        """
+        Return tuple of marginal payroll, individual income, and combined
+        tax rate arrays computed from the taxes after a marginal increase in
+        the variable_str variable and the taxes in the embedded Records
+        object.
+        """
+        # pylint: disable=too-many-arguments
+        variable = self.array(variable_str)
+        # compute marginal changes in combined tax liability
+        payrolltax_base = self.array('payrolltax')
+        incometax_base = self.array('iitax')
+        payrolltax_diff = payrolltax_chng - payrolltax_base
+        incometax_diff = incometax_chng - incometax_base
+        combined_diff = ((incometax_chng + payrolltax_chng) -
+                         (incometax_base + payrolltax_base))
+        # specify optional adjustment for employer (er) OASDI+HI payroll taxes
+        mtr_on_earnings = variable_str in ('e00200p', 'e00200s')
+        if wrt_full_compensation and mtr_on_earnings:
+            # pylint: disable=assignment-from-no-return
+            oasdi_taxed = np.logical_or(
+                variable < self.policy_param('SS_Earnings_c'),
+                variable >= self.policy_param('SS_Earnings_thd')
+            )
+            adj = np.where(oasdi_taxed,
+                           0.5 * (self.policy_param('FICA_ss_trt') +
+                                  self.policy_param('FICA_mc_trt')),
+                           0.5 * self.policy_param('FICA_mc_trt'))
+        else:
+            adj = 0.0
+        # compute marginal tax rates
+        mtr_payrolltax = payrolltax_diff / (finite_diff * (1.0 + adj))
+        mtr_incometax = incometax_diff / (finite_diff * (1.0 + adj))
+        mtr_combined = combined_diff / (finite_diff * (1.0 + adj))
+        # if variable_str is e00200s, set MTR to NaN for units without a spouse
+        if variable_str == 'e00200s':
+            mars = self.array('MARS')
+            mtr_payrolltax = np.where(mars == 2, mtr_payrolltax, np.nan)
+            mtr_incometax = np.where(mars == 2, mtr_incometax, np.nan)
+            mtr_combined = np.where(mars == 2, mtr_combined, np.nan)
+        return (mtr_payrolltax, mtr_incometax, mtr_combined)
+
+    def _changed_calculator(self, inputs, params=None, rows=None):
+        """
+        Return Calculator object that shares the embedded Policy and
+        Consumption objects with this Calculator object and has a copy of
+        the embedded Records object (which shares the unchanged read
+        variables with the embedded Records object) containing the Records
+        variable values in the inputs dictionary.  When params is not None,
+        the returned object has a shallow copy of the embedded Policy object
+        containing the current-year policy parameter values in the params
+        dictionary.  When rows is not None, the returned object contains
+        only the filing units whose indexes are in the rows array (see the
+        Records.row_subset method) and the inputs arrays contain values for
+        all filing units.  The returned object does no timing or caching.
+        """
+        calc = copy.copy(self)
+        if rows is None:
+            calc.__records = copy.deepcopy(self.__records)
+        else:
+            calc.__records = self.__records.row_subset(rows)
+            inputs = {varname: value[rows]
+                      for varname, value in inputs.items()}
+        for varname, value in inputs.items():
+            setattr(calc.__records, varname, value)
+        if params is not None:
+            calc.__policy = copy.copy(self.__policy)
+            for pname, value in params.items():
+                setattr(calc.__policy, pname, value)
+        calc.__stored_records = None
+        calc.__saved = None
+        calc.__saved_year = None
+        calc.__counterfactuals = dict()
+        calc.__timings = None
+        calc.__cache = None
+        return calc
+
+    def _counterfactual_iitax(self, params):
+        """
+        Return iitax array calculated by the _calc_one_year method with the
+        current-year policy parameter values in the params dictionary, using
+        a Calculator object that shares all the unchanged inputs with this
+        object (see the _changed_calculator method).  The array is reused
+        by later calls with the same params until the next calc_all or
+        recalc call, because the iitax values do not depend on the taxes
+        added by the BenefitSurtax and BenefitLimitation functions.
+        """
+        key = tuple(sorted(params.items()))
+        if key not in self.__counterfactuals:
+            calc = self._changed_calculator(dict(), params)
+            calc._calc_one_year()
+            self.__counterfactuals[key] = calc.array('iitax')
+        return self.__counterfactuals[key]
+
+    def _paired_calculator(self, policy):
+        """
+        Return Calculator object that has the same options as this
+        Calculator object, a copy of the policy object, a copy of the
+        embedded Consumption object, and a copy of the embedded Records
+        object that shares the read variables with the embedded Records
+        object (see the _share_records method).
+        """
+        calc = copy.copy(self)
+        calc.__policy = copy.deepcopy(policy)
+        calc.__consumption = copy.deepcopy(self.__consumption)
+        if calc.__timings is not None:
+            calc.__timings = dict()
+        calc._share_records(self)
+        return calc
+
+    def _share_records(self, calc):
+        """
+        Replace the embedded Records object by a copy of the Records object
+        embedded in calc, which shares the read variables with the copied
+        object (see the Records class), and set the embedded Policy and
+        Consumption objects to the calc current_year.
+        """
+        year = calc.current_year
+        if self.__policy.current_year > year:
+            raise ValueError('policy current_year is later than '
+                             'records current_year')
+        self.__records = copy.deepcopy(calc.__records)
+        self.__policy.set_year(year)
+        self.__consumption.set_year(year)
+        self.__stored_records = None
+        self.__saved = None
+        self.__saved_year = None
+        self.__counterfactuals = dict()
 
     def _calc_one_year(self, zero_out_calc_vars=False):
         """
@@ -1383,6 +1930,9 @@ class Calculator():
         # pylint: disable=too-many-statements
         if zero_out_calc_vars:
             self.__records.zero_out_changing_calculated_vars()
+        if self.__fused:
+            fused_one_year_function()(self.__policy, self.__records)
+            return
         # pdb.set_trace()
         EI_PayrollTax(self.__policy, self.__records)
         DependentCare(self.__policy, self.__records)
@@ -1396,52 +1946,7 @@ class Calculator():
         ItemDed(self.__policy, self.__records)
         AdditionalMedicareTax(self.__policy, self.__records)
         StdDed(self.__policy, self.__records)
-        # Store calculated standard deduction, calculate
-        # taxes with standard deduction, store AMT + Regular Tax
-        std = self.array('standard').copy()
-        item = self.array('c04470').copy()
-        item_no_limit = self.array('c21060').copy()
-        item_phaseout = self.array('c21040').copy()
-        item_component_variable_names = ['c17000', 'c18300', 'c19200',
-                                         'c19700', 'c20500', 'c20800']
-        item_cvar = dict()
-        for cvname in item_component_variable_names:
-            item_cvar[cvname] = self.array(cvname).copy()
-        self.zeroarray('c04470')
-        self.zeroarray('c21060')
-        self.zeroarray('c21040')
-        for cvname in item_component_variable_names:
-            self.zeroarray(cvname)
-        self._taxinc_to_amt()
-        std_taxes = self.array('c05800').copy()
-        # Set standard deduction to zero, calculate taxes w/o
-        # standard deduction, and store AMT + Regular Tax
-        self.zeroarray('standard')
-        self.array('c21060', item_no_limit)
-        self.array('c21040', item_phaseout)
-        self.array('c04470', item)
-        self._taxinc_to_amt()
-        item_taxes = self.array('c05800').copy()
-        # Replace standard deduction with zero so the filing unit
-        # would always be better off itemizing
-        self.array('standard', np.where(item_taxes < std_taxes,
-                                        0., std))
-        self.array('c04470', np.where(item_taxes < std_taxes,
-                                      item, 0.))
-        self.array('c21060', np.where(item_taxes < std_taxes,
-                                      item_no_limit, 0.))
-        self.array('c21040', np.where(item_taxes < std_taxes,
-                                      item_phaseout, 0.))
-        for cvname in item_component_variable_names:
-            self.array(cvname, np.where(item_taxes < std_taxes,
-                                        item_cvar[cvname], 0.))
-        del std
-        del item
-        del item_no_limit
-        del item_phaseout
-        del item_cvar
-        # Calculate taxes with optimal itemized deduction
-        self._taxinc_to_amt()
+        self._deduction_choice()
         F2441(self.__policy, self.__records)
         EITC(self.__policy, self.__records)
         PersonalTaxCredit(self.__policy, self.__records)
@@ -1591,3 +2096,582 @@ class Calculator():
                     year_key_dict[year] = dict()
                 year_key_dict[year][param] = val
         return year_key_dict
+
+
+class CalculatorPair():
+    """
+    Constructor for the CalculatorPair class, which contains a baseline
+    Calculator object and a reform Calculator object for the same records
+    data, where the two Calculator objects share one set of the Records
+    read variables (which is extrapolated to later years only once) and
+    each owns only its calculated variables.  This uses about half the
+    memory of two Calculator objects constructed separately.
+
+    Parameters
+    ----------
+    baseline_policy: Policy class object
+        specifies the baseline policy and is copied for internal use
+
+    reform_policy: Policy class object
+        specifies the reform policy and is copied for internal use; its
+        current_year must be the same as that of baseline_policy
+
+    records: Records class object
+        this argument must be specified and object is copied for internal use
+
+    consumption: Consumption class object or None
+        specifies consumption assumptions used by both Calculator objects
+
+    verbose: boolean
+        specifies whether or not to write to stdout the data-loaded and
+        data-extrapolated progress reports; default value is false.
+
+    sync_years: boolean
+        specifies whether or not to synchronize policy year and records year;
+        default value is true.
+
+    kwargs: dictionary
+        other Calculator constructor arguments (such as fused, num_threads,
+        timing, and cache) used by both Calculator objects
+
+    Raises
+    ------
+    ValueError:
+        if parameters are not the appropriate type or the policy objects
+        have different current years.
+
+    Returns
+    -------
+    class instance: CalculatorPair
+
+    Notes
+    -----
+    The baseline and reform Calculator objects are the baseline and reform
+    attributes of the CalculatorPair object.  Changing a read variable in
+    one of them (for example, with its array method) does not change the
+    other, because the changed variable is no longer shared.
+    """
+
+    def __init__(self, baseline_policy=None, reform_policy=None,
+                 records=None, consumption=None, verbose=False,
+                 sync_years=True, **kwargs):
+        # pylint: disable=too-many-arguments
+        if not (isinstance(baseline_policy, Policy) and
+                isinstance(reform_policy, Policy)):
+            raise ValueError('must specify baseline_policy and '
+                             'reform_policy as Policy objects')
+        if reform_policy.current_year != baseline_policy.current_year:
+            raise ValueError('baseline_policy and reform_policy must have '
+                             'the same current_year')
+        self.baseline = Calculator(policy=baseline_policy, records=records,
+                                   verbose=verbose, sync_years=sync_years,
+                                   consumption=consumption, **kwargs)
+        # pylint: disable=protected-access
+        self.reform = self.baseline._paired_calculator(reform_policy)
+
+    @property
+    def current_year(self):
+        """
+        CalculatorPair class current calendar year property.
+        """
+        return self.baseline.current_year
+
+    def increment_year(self):
+        """
+        Advance both Calculator objects to next year, extrapolating the
+        shared records data only once.
+        """
+        self.baseline.increment_year()
+        # pylint: disable=protected-access
+        self.reform._share_records(self.baseline)
+
+    def advance_to_year(self, year):
+        """
+        Advance both Calculator objects to the specified year, which must
+        be at least the current year.
+        """
+        if year < self.current_year:
+            raise ValueError('New current year must be ' +
+                             'greater than or equal to current year!')
+        while self.current_year < year:
+            self.increment_year()
+
+    def calc_all(self, zero_out_calc_vars=False, outputs=None):
+        """
+        Call the calc_all method of both Calculator objects.
+        """
+        self.baseline.calc_all(zero_out_calc_vars=zero_out_calc_vars,
+                               outputs=outputs)
+        self.reform.calc_all(zero_out_calc_vars=zero_out_calc_vars,
+                             outputs=outputs)
+
+    def distribution_tables(self, groupby, scaling=True):
+        """
+        Return baseline and reform distribution tables as a pair of Pandas
+        dataframes (see the Calculator.distribution_tables method).
+        """
+        return self.baseline.distribution_tables(self.reform, groupby,
+                                                 scaling=scaling)
+
+    def difference_table(self, groupby, tax_to_diff):
+        """
+        Return reform-minus-baseline difference table as a Pandas
+        dataframe (see the Calculator.difference_table method).
+        """
+        return self.baseline.difference_table(self.reform, groupby,
+                                              tax_to_diff)
+
+
+def precompile(background=False):
+    """
+    Compile all the jitted functions used by the Calculator.calc_all method
+    for the argument types of the Records variables and Policy parameters
+    (see the compile_typed_functions function) and by conducting a tax
+    calculation for a tiny sample of filing units, which also stores
+    compiled versions of those functions in the on-disk
+    cache (see the kernel_cache_dir function in the decorators.py module)
+    so that later Python processes do not have to compile them again.
+
+    Parameters
+    ----------
+    background: boolean
+        if True, do the compilation in a daemon thread so that the caller
+        can do other work (such as reading input data into a Records
+        object) while the compilation is being done; default is False.
+
+    Returns
+    -------
+    threading.Thread object that is doing the compilation when background
+    is True, which can be joined by the caller; otherwise None.
+    """
+    if background:
+        thread = threading.Thread(target=precompile, name='taxcalc-precompile')
+        thread.daemon = True
+        thread.start()
+        return thread
+    compile_typed_functions()
+    # a single-filer and a joint-filer filing unit with some income
+    data = pd.DataFrame({'RECID': [1, 2], 'MARS': [1, 2],
+                         'e00200': [40000., 80000.],
+                         'e00200p': [40000., 50000.],
+                         'e00200s': [0., 30000.]})
+    recs = Records(data=data, start_year=Policy.JSON_START_YEAR,
+                   gfactors=None, weights=None)
+    calc = Calculator(policy=Policy(), records=recs)
+    calc.calc_all()
+    return None
+
+
+SWEEP_RECORDS = dict()
+
+
+def sweep(reforms, records, years, outputs, num_workers=None):
+    """
+    Conduct the calc_all calculations for each policy reform in each year
+    and return the weighted totals of the outputs variables, using a pool
+    of worker processes.  The records data are aged once for each year
+    (sharing the unchanged variables between years, see the Records class
+    documentation) and the aged Records objects are given to each worker
+    process once, rather than once per reform.  On platforms where worker
+    processes are started by forking (such as Linux) the workers share the
+    memory holding the records data with the calling process.
+
+    Parameters
+    ----------
+    reforms: list
+        each item of which is either a dictionary suitable as input into
+        the Policy.implement_reform method or a string that is a JSON
+        reform filename, URL or text (see read_json_param_objects)
+
+    records: Records class object
+        whose current_year is no later than the earliest of the years
+
+    years: list of integers
+        calendar years for which the calculations are conducted
+
+    outputs: list of strings
+        names of the Records variables whose weighted totals are returned
+
+    num_workers: integer or None
+        number of worker processes, where one means the calculations are
+        conducted in the calling process; default value of None means the
+        number of CPUs in the computer
+
+    Returns
+    -------
+    Pandas DataFrame containing one row for each reform and year (indexed
+    by the reform's position in the reforms list and the year) and one
+    column for each of the outputs variables
+    """
+    # pylint: disable=global-statement
+    if not isinstance(reforms, list) or not isinstance(years, list):
+        raise ValueError('reforms and years must be lists')
+    if not isinstance(records, Records):
+        raise ValueError('records must be a Records object')
+    if not years or min(years) < records.current_year:
+        raise ValueError('years must be no earlier than records current_year')
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    policy_reforms = list()
+    for reform in reforms:
+        if isinstance(reform, str):
+            reform = Calculator.read_json_param_objects(reform, None)['policy']
+        policy_reforms.append(reform)
+    # age the records data once for each year
+    recs = copy.deepcopy(records)
+    records_by_year = dict()
+    for year in sorted(set(years)):
+        while recs.current_year < year:
+            recs.increment_year()
+        records_by_year[year] = copy.deepcopy(recs)
+    del recs
+    tasks = [(ridx, reform, year, outputs)
+             for ridx, reform in enumerate(policy_reforms)
+             for year in years]
+    if num_workers == 1 or len(tasks) == 1:
+        global SWEEP_RECORDS
+        SWEEP_RECORDS = records_by_year
+        try:
+            results = [sweep_task(task) for task in tasks]
+        finally:
+            SWEEP_RECORDS = dict()
+    else:
+        with multiprocessing.Pool(processes=num_workers,
+                                  initializer=sweep_worker_init,
+                                  initargs=(records_by_year,)) as pool:
+            results = pool.map(sweep_task, tasks)
+    index = pd.MultiIndex.from_tuples([(ridx, year)
+                                       for ridx, _, year, _ in tasks],
+                                      names=['reform', 'year'])
+    return pd.DataFrame(data=results, index=index, columns=outputs)
+
+
+def sweep_worker_init(records_by_year):
+    """
+    Store the aged Records objects used by the sweep_task function in a
+    sweep worker process.
+    """
+    # pylint: disable=global-statement
+    global SWEEP_RECORDS
+    SWEEP_RECORDS = records_by_year
+
+
+def sweep_task(task):
+    """
+    Return list of weighted totals of the outputs variables after the
+    calc_all calculations for the reform in the year, where task is the
+    (reform_index, reform, year, outputs) tuple.
+    """
+    _, reform, year, outputs = task
+    pol = Policy()
+    pol.implement_reform(reform)
+    pol.set_year(year)
+    calc = Calculator(policy=pol, records=SWEEP_RECORDS[year])
+    calc.calc_all()
+    return [calc.weighted_total(vname) for vname in outputs]
+
+
+def compile_typed_functions():
+    """
+    Compile each function in the calcfunctions.py module that is decorated
+    by iterate_jit for the argument types specified in the
+    records_variables.json and policy_current_law.json files (see the
+    argument_types function in the decorators.py module), so that the
+    first calc_all call does not have to infer argument types and compile
+    (or load from the on-disk cache) each function.  This is done only by
+    the precompile function, never when this module is imported, so
+    importing taxcalc stays fast and a process that never calls calc_all
+    compiles nothing.
+    """
+    for obj in vars(calcfunctions).values():
+        if hasattr(obj, 'compile_typed'):
+            obj.compile_typed()
+
+
+FUSED_ONE_YEAR_FUNCTION = None
+
+
+def fused_one_year_function():
+    """
+    Return function that does the same calculations as the unfused
+    Calculator._calc_one_year method, including the choice between the
+    standard deduction and itemized deductions, one filing unit at a time.
+    The function is made when it is first needed and then reused.
+    """
+    # pylint: disable=global-statement
+    global FUSED_ONE_YEAR_FUNCTION
+    if FUSED_ONE_YEAR_FUNCTION is None:
+        FUSED_ONE_YEAR_FUNCTION = make_fused_function(one_year_steps(),
+                                                      name='fused_one_year')
+    return FUSED_ONE_YEAR_FUNCTION
+
+
+DEDUCTION_CHOICE_FUNCTION = None
+
+
+def deduction_choice_function():
+    """
+    Return function that does the deduction_choice_steps for each filing
+    unit, which means the three sets of TaxInc through AMT calculations
+    are done in one pass through the filing units without copying any
+    arrays.  The function is made when it is first needed and then reused.
+    """
+    # pylint: disable=global-statement
+    global DEDUCTION_CHOICE_FUNCTION
+    if DEDUCTION_CHOICE_FUNCTION is None:
+        DEDUCTION_CHOICE_FUNCTION = make_fused_function(
+            deduction_choice_steps(), name='deduction_choice')
+    return DEDUCTION_CHOICE_FUNCTION
+
+
+def deduction_choice_steps():
+    """
+    Return list of steps done for each filing unit to choose between the
+    standard deduction and itemized deductions (see the make_fused_function
+    function in the decorators.py module): taxes are calculated with the
+    standard deduction and with itemized deductions, and then again with
+    whichever of the two produces lower taxes.
+    """
+    taxinc_to_amt = TAXINC_TO_AMT_FUNCTIONS
+    cvnames = ITEMDED_COMPONENT_VARIABLES
+    # store calculated standard deduction and itemized deductions,
+    # then calculate taxes with standard deduction
+    steps = ['std_ded = standard[i]',
+             'item_ded = c04470[i]',
+             'item_no_limit = c21060[i]',
+             'item_phaseout = c21040[i]']
+    steps.extend(['{0}_item = {0}[i]'.format(cvn) for cvn in cvnames])
+    steps.extend(['{}[i] = 0.'.format(vname) for vname in
+                  ['c04470', 'c21060', 'c21040'] + cvnames])
+    steps.extend(taxinc_to_amt)
+    steps.append('std_taxes = c05800[i]')
+    # set standard deduction to zero and calculate taxes with
+    # itemized deductions (but with zero itemized component amounts)
+    steps.extend(['standard[i] = 0.',
+                  'c21060[i] = item_no_limit',
+                  'c21040[i] = item_phaseout',
+                  'c04470[i] = item_ded'])
+    steps.extend(taxinc_to_amt)
+    steps.append('itemize = c05800[i] < std_taxes')
+    # keep the deduction that produces the lower taxes
+    steps.extend(['standard[i] = 0. if itemize else std_ded',
+                  'c04470[i] = item_ded if itemize else 0.',
+                  'c21060[i] = item_no_limit if itemize else 0.',
+                  'c21040[i] = item_phaseout if itemize else 0.'])
+    steps.extend(['{0}[i] = {0}_item if itemize else 0.'.format(cvn)
+                  for cvn in cvnames])
+    # calculate taxes with optimal itemized deduction
+    steps.extend(taxinc_to_amt)
+    return steps
+
+
+def one_year_steps():
+    """
+    Return list of steps done for each filing unit by the function returned
+    from the fused_one_year_function (see the make_fused_function function
+    in the decorators.py module).
+    """
+    return (PRE_DEDUCTION_CHOICE_FUNCTIONS + deduction_choice_steps() +
+            POST_DEDUCTION_CHOICE_FUNCTIONS)
+
+
+BATCHED_FUNCTIONS = dict()
+
+
+def batched_function(variable_list):
+    """
+    Return function that does the calc_all calculations (except those
+    done by BenefitPrograms, BenefitSurtax and BenefitLimitation) for
+    several policy scenarios in one pass through the filing units and that
+    returns the values of the variables in variable_list for each scenario
+    (see the make_batched_function in the decorators.py module).
+    The function is made when it is first needed and then reused.
+    """
+    key = tuple(variable_list)
+    if key not in BATCHED_FUNCTIONS:
+        steps = one_year_steps() + [FairShareTax, LumpSumTax,
+                                    ExpandIncome, AfterTaxIncome]
+        BATCHED_FUNCTIONS[key] = make_batched_function(steps,
+                                                       list(variable_list),
+                                                       name='batched_calc_all')
+    return BATCHED_FUNCTIONS[key]
+
+
+def calc_all_stages():
+    """
+    Return list of the stages of the Calculator.calc_all calculations in
+    the order they are done, where each stage is a tuple containing the
+    stage name, the function that does the stage (either a function
+    decorated by iterate_jit, which is called with the Policy and Records
+    objects, or a function called with the Calculator object), the set of
+    names of the parameters and variables the stage reads, and the set of
+    names of the variables the stage writes.  This list describes the
+    dependency graph used by the recalc_stages function.
+    """
+    # pylint: disable=protected-access
+    def kernel_stage(func):
+        """
+        Return stage for func, which is decorated by iterate_jit.
+        """
+        return (func.calc_func.__name__, func,
+                frozenset(func.in_args), frozenset(func.out_args))
+
+    def sequence_inputs(funcs):
+        """
+        Return set of names read by funcs before being written by funcs.
+        """
+        inputs = set()
+        written = set()
+        for func in funcs:
+            inputs |= set(func.in_args) - written
+            written |= set(func.out_args)
+        return inputs
+
+    benefits = ['housing_ben', 'ssi_ben', 'snap_ben', 'tanf_ben',
+                'vet_ben', 'wic_ben', 'mcare_ben', 'mcaid_ben',
+                'e02400', 'e02300', 'other_ben']
+    benefit_values = ['BEN_{}_value'.format(ben) for ben in
+                      ['housing', 'snap', 'tanf', 'vet', 'wic',
+                       'mcare', 'mcaid', 'other']]
+    stages = [('BenefitPrograms', BenefitPrograms,
+               frozenset(benefits + benefit_values +
+                         Calculator.BENEFIT_REPEAL_PARAMS),
+               frozenset(benefits + ['benefit_cost_total',
+                                     'benefit_value_total']))]
+    stages.extend([kernel_stage(func)
+                   for func in PRE_DEDUCTION_CHOICE_FUNCTIONS])
+    choice_vars = (['standard', 'c04470', 'c21060', 'c21040'] +
+                   ITEMDED_COMPONENT_VARIABLES)
+    stages.append(('_deduction_choice', Calculator._deduction_choice,
+                   frozenset(sequence_inputs(TAXINC_TO_AMT_FUNCTIONS) |
+                             set(choice_vars)),
+                   frozenset(set().union(*[func.out_args for func in
+                                           TAXINC_TO_AMT_FUNCTIONS]) |
+                             set(choice_vars))))
+    stages.extend([kernel_stage(func)
+                   for func in POST_DEDUCTION_CHOICE_FUNCTIONS])
+    # when active, BenefitSurtax and BenefitLimitation redo the
+    # _calc_one_year calculations in ComputeBenefit, so they read all the
+    # inputs of the stages done so far
+    one_year_inputs = set()
+    for stage in stages[1:]:
+        one_year_inputs |= stage[2]
+    tax_vars = ['iitax', 'combined', 'surtax']
+    surtax_inputs = ['ID_BenefitSurtax_crt', 'ID_BenefitSurtax_Switch',
+                     'ID_BenefitSurtax_em', 'ID_BenefitSurtax_trt',
+                     'c00100', 'MARS']
+    stages.append(('BenefitSurtax', BenefitSurtax,
+                   frozenset(one_year_inputs | set(surtax_inputs + tax_vars)),
+                   frozenset(tax_vars)))
+    cap_inputs = ['ID_BenefitCap_rt', 'ID_BenefitCap_Switch',
+                  'ID_StateLocalTax_hc', 'ID_RealEstate_hc',
+                  'e18400_capped', 'e18500_capped']
+    stages.append(('BenefitLimitation', BenefitLimitation,
+                   frozenset(one_year_inputs | set(cap_inputs + tax_vars) |
+                             set(ITEMDED_COMPONENT_VARIABLES)),
+                   frozenset(tax_vars)))
+    stages.extend([kernel_stage(func) for func in
+                   [FairShareTax, LumpSumTax, ExpandIncome, AfterTaxIncome]])
+    return stages
+
+
+CALC_ALL_STAGES = calc_all_stages()
+
+
+def restored_variables():
+    """
+    Return list containing, for each CALC_ALL_STAGES stage, a list of the
+    (name, writer) pairs of the variables the stage reads that are written
+    again by it or by a later stage, so that after the calc_all
+    calculations such a variable no longer has the value the stage read,
+    where writer is the index of the last earlier stage writing the value
+    the stage read, or None when no earlier stage writes the variable
+    (so the stage read its initial value).
+    """
+    writers = dict()
+    for idx, stage in enumerate(CALC_ALL_STAGES):
+        for name in stage[3]:
+            writers.setdefault(name, list()).append(idx)
+    restored = list()
+    for idx, stage in enumerate(CALC_ALL_STAGES):
+        pairs = list()
+        for name in sorted(stage[2]):
+            idxs = writers.get(name, [])
+            earlier = [widx for widx in idxs if widx < idx]
+            if idxs and idxs[-1] >= idx:
+                pairs.append((name, earlier[-1] if earlier else None))
+        restored.append(pairs)
+    return restored
+
+
+RESTORED_VARIABLES = restored_variables()
+
+# names of variables whose values are saved after each stage (see the
+# Calculator.recalc method)
+SAVED_VARIABLES = [sorted(set(name for pairs in RESTORED_VARIABLES
+                              for name, widx in pairs if widx == idx))
+                   for idx in range(len(CALC_ALL_STAGES))]
+
+RECALC_STAGES = dict()
+
+
+def recalc_stages(changed):
+    """
+    Return list of (index, restored) pairs for the CALC_ALL_STAGES stages
+    that must be redone, in the order they must be redone, to account for
+    changes in the values of the parameters and variables whose names are
+    in the changed set (or for all stages when changed is None), where
+    restored is the list of (name, writer) pairs of variables whose values
+    must be restored before the stage is redone because the writer stage
+    is not redone (see the restored_variables function).
+    A stage is redone when it reads or writes a name that is changed,
+    that is written by an earlier redone stage, or that is restored before
+    an earlier redone stage (so that the later stages writing a restored
+    variable are redone).
+    """
+    key = None if changed is None else frozenset(changed)
+    if key in RECALC_STAGES:
+        return RECALC_STAGES[key]
+    dirty = set() if key is None else set(key)
+    redone = set()
+    stages = list()
+    for idx, (_, _, inputs, outputs) in enumerate(CALC_ALL_STAGES):
+        if (key is not None and
+                dirty.isdisjoint(inputs) and dirty.isdisjoint(outputs)):
+            continue
+        restored = [(name, widx) for name, widx in RESTORED_VARIABLES[idx]
+                    if widx not in redone]
+        dirty.update(name for name, _ in restored)
+        dirty |= outputs
+        redone.add(idx)
+        stages.append((idx, restored))
+    RECALC_STAGES[key] = stages
+    return stages
+
+
+OUTPUT_STAGES = dict()
+
+
+def output_stages(outputs):
+    """
+    Return list of the indexes, in increasing order, of the CALC_ALL_STAGES
+    stages on which the values of the variables whose names are in the
+    outputs list depend, so calling only those stages gives those
+    variables the same values as calling all the stages.
+    A stage is called when it writes a name that is in outputs or that is
+    read by a later called stage.
+    """
+    key = frozenset(outputs)
+    if key in OUTPUT_STAGES:
+        return OUTPUT_STAGES[key]
+    needed = set(key)
+    stages = list()
+    for idx in reversed(range(len(CALC_ALL_STAGES))):
+        _, _, inputs, written = CALC_ALL_STAGES[idx]
+        if needed.isdisjoint(written):
+            continue
+        needed |= inputs
+        stages.append(idx)
+    stages.reverse()
+    OUTPUT_STAGES[key] = stages
+    return stages
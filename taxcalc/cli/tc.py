@@ -33,7 +33,7 @@ def cli_tc_main():
         ('          '
          '[--dump] [--dvars DVARS] [--sqldb] [--outdir OUTDIR]\n'),
         ('          '
-         '[--test] [--version]'))
+         '[--test] [--warmup] [--version]'))
     parser = argparse.ArgumentParser(
         prog='',
         usage=usage_str,
@@ -46,7 +46,11 @@ def cli_tc_main():
     parser.add_argument('INPUT', nargs='?',
                         help=('INPUT is name of CSV-formatted file that '
                               'contains for each filing unit variables used '
-                              'to compute taxes for TAXYEAR. Specifying '
+                              'to compute taxes for TAXYEAR, or of a '
+                              'Parquet, Feather, or Arrow IPC file (with a '
+                              '.parquet, .feather, or .arrow suffix) that '
+                              'contains those variables, which requires the '
+                              'pyarrow package. Specifying '
                               '"cps.csv" uses CPS input files included in '
                               'the taxcalc package.'),
                         default='')
@@ -125,6 +129,13 @@ def cli_tc_main():
                               'and quits.'),
                         default=False,
                         action="store_true")
+    parser.add_argument('--warmup',
+                        help=('optional flag that compiles the functions '
+                              'used in tax calculations, stores them in the '
+                              'on-disk cache so that later tc runs start '
+                              'faster, and quits.'),
+                        default=False,
+                        action="store_true")
     parser.add_argument('--version',
                         help=('optional flag that writes Tax-Calculator '
                               'release version to stdout and quits.'),
@@ -135,6 +146,10 @@ def cli_tc_main():
     if args.version:
         sys.stdout.write('Tax-Calculator {}\n'.format(tc.__version__))
         return 0
+    # compile functions used in tax calculations and quit if --warmup
+    if args.warmup:
+        tc.precompile()
+        return 0
     # write test input and expected output files if --test option specified
     if args.test:
         _write_expected_test_output()
@@ -152,7 +167,9 @@ def cli_tc_main():
         sys.stderr.write(tcio.errmsg)
         sys.stderr.write('USAGE: tc --help\n')
         return 1
-    aging = inputfn.endswith('puf.csv') or inputfn.endswith('cps.csv')
+    aging = tcio.puf_input_data or tcio.cps_input_data
+    # compile functions used in tax calculations while reading input data
+    compiler = tc.precompile(background=True)
     tcio.init(input_data=inputfn, tax_year=taxyear,
               baseline=args.baseline,
               reform=args.reform, assump=args.assump,
@@ -178,6 +195,7 @@ def cli_tc_main():
             sys.stderr.write('USAGE: tc --help\n')
             return 1
     # conduct tax analysis
+    compiler.join()
     tcio.analyze(writing_output_file=True,
                  output_tables=args.tables,
                  output_graphs=args.graphs,
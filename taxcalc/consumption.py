@@ -120,7 +120,7 @@ class Consumption(Parameters):
         if not isinstance(records, Records):
             raise ValueError('records is not a Records object')
         for var in Consumption.RESPONSE_VARS:
-            records_var = getattr(records, var)
+            records_var = records.writable_array(var)
             mpc_var = getattr(self, 'MPC_{}'.format(var))
             records_var[:] += mpc_var * income_change
 
@@ -8,10 +8,22 @@ of Tax-Calculator functions in the calcfunctions.py module.
 
 import os
 import io
+import re
+import sys
 import ast
+import time
+import functools
+import hashlib
+import threading
+import contextlib
 import inspect
+import importlib.util
 import numba
+import numpy as np
+import pandas as pd
 from taxcalc.policy import Policy
+from taxcalc.records import Records
+from taxcalc.utils import cache_subdir
 
 
 DO_JIT = True
@@ -35,6 +47,7 @@ def id_wrapper(*dec_args, **dec_kwargs):  # pylint: disable=unused-argument
             wrapped_f function nested in wrap function.
             """
             return fnc(*args, **kwargs)
+        wrapped_f.py_func = fnc
         return wrapped_f
     return wrap
 
@@ -45,6 +58,337 @@ else:
     JIT = numba.jit
 
 
+DO_VECTORIZE = True
+# When functions are not being jitted, the calc-style functions are
+# translated into functions that do array-at-a-time NumPy operations on
+# all records (see the Vectorizer class), which are much faster than
+# calling the calc-style functions for one record at a time in Python.
+# Calc-style functions that cannot be translated are called one record at
+# a time.  To step through calc-style functions with the Python debugger
+# when not jitting, change the line immediately above this comment to
+# "DO_VECTORIZE = False" or set the NOTAXCALCVECTORIZE environment variable.
+
+
+def vectorizing(do_jit=DO_JIT):
+    """
+    Return True if functions are not being jitted (because do_jit is False
+    or because JIT is id_wrapper) and calc-style functions are being
+    translated into array-at-a-time functions.
+    """
+    jitting = do_jit and JIT is not id_wrapper
+    return (not jitting and DO_VECTORIZE is True and
+            'NOTAXCALCVECTORIZE' not in os.environ)
+
+
+DO_CACHE = True
+# Compiled versions of the jitted functions are stored on disk so that
+# later Python processes can load them rather than compile them again.
+# Caching can be turned off by changing the line immediately above this
+# comment to "DO_CACHE = False" or by setting the NOTAXCALCCACHE
+# environment variable.  The TAXCALC_CACHE_DIR environment variable
+# specifies the directory holding the generated apply-style functions,
+# which by default is a taxcalc directory in the user's cache directory.
+
+
+def kernel_cache_dir():
+    """
+    Return name of writable directory that holds the generated apply-style
+    function modules and their compiled versions, or return None when
+    on-disk caching is not being done.
+    """
+    if DO_CACHE is False or JIT is id_wrapper:
+        return None
+    return cache_subdir('kernels')
+
+
+NUM_THREADS_ENV_VAR = 'TAXCALC_NUM_THREADS'
+# When the TAXCALC_NUM_THREADS environment variable is set to an integer
+# greater than one, the record loops in the jitted functions are split
+# across that many threads unless the caller specifies otherwise (see the
+# kernel_threads context manager below).
+
+KERNEL_THREADS = threading.local()
+
+
+def default_num_threads():
+    """
+    Return number of threads specified by the TAXCALC_NUM_THREADS
+    environment variable, or one if that variable is not set.
+    """
+    value = os.environ.get(NUM_THREADS_ENV_VAR, '1')
+    try:
+        num_threads = int(value)
+    except ValueError:
+        msg = '{} environment variable value {} is not an integer'
+        raise ValueError(msg.format(NUM_THREADS_ENV_VAR, value))
+    if num_threads < 1:
+        msg = '{} environment variable value {} is less than one'
+        raise ValueError(msg.format(NUM_THREADS_ENV_VAR, value))
+    return num_threads
+
+
+def parallel_kernels():
+    """
+    Return True if the calling thread is inside a kernel_threads context
+    that splits record loops across more than one thread.
+    """
+    return getattr(KERNEL_THREADS, 'parallel', False)
+
+
+@contextlib.contextmanager
+def kernel_threads(num_threads=None):
+    """
+    Context manager within which the record loops in the functions made by
+    the iterate_jit decorator and by the make_fused_function function are
+    split across num_threads threads.  When num_threads is None, the
+    number of threads is specified by the default_num_threads function.
+    The number of threads is limited to the number numba was started
+    with, and loops are not split when jitting is not being done.
+    Because each record is calculated independently, the results do not
+    depend on the number of threads.
+    """
+    if num_threads is None:
+        num_threads = default_num_threads()
+    if num_threads < 1:
+        raise ValueError('num_threads must be at least one')
+    if JIT is id_wrapper:
+        num_threads = 1
+    num_threads = min(num_threads, numba.config.NUMBA_NUM_THREADS)
+    prior_parallel = parallel_kernels()
+    KERNEL_THREADS.parallel = num_threads > 1
+    if num_threads == 1:
+        # leave numba's threading layer unlaunched so that the process
+        # can still be forked safely (see the sweep function)
+        try:
+            yield
+        finally:
+            KERNEL_THREADS.parallel = prior_parallel
+        return
+    prior_num_threads = numba.get_num_threads()
+    numba.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        KERNEL_THREADS.parallel = prior_parallel
+        numba.set_num_threads(prior_num_threads)
+
+
+KERNEL_TIMINGS = threading.local()
+
+
+@contextlib.contextmanager
+def kernel_timings(registry):
+    """
+    Context manager within which each call of a function made by the
+    iterate_jit decorator, the make_fused_function function, or the
+    make_batched_function function, and each call of a function decorated
+    by the timed decorator, is recorded in the registry dictionary, which
+    maps a function name to a list containing the number of calls, the
+    total number of records processed by those calls, and the total wall
+    time (in seconds) of those calls.  The wall time of a function
+    includes the time of the functions it calls.  When registry is None,
+    calls are not recorded, which is also the case outside of any
+    kernel_timings context.
+    """
+    prior_registry = getattr(KERNEL_TIMINGS, 'registry', None)
+    KERNEL_TIMINGS.registry = registry
+    try:
+        yield
+    finally:
+        KERNEL_TIMINGS.registry = prior_registry
+
+
+def record_timing(registry, name, num_records, start_time):
+    """
+    Record in registry one call of the named function that processed
+    num_records records and started at start_time (as returned by
+    time.perf_counter).
+    """
+    seconds = time.perf_counter() - start_time
+    entry = registry.get(name)
+    if entry is None:
+        registry[name] = [1, num_records, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += num_records
+        entry[2] += seconds
+
+
+def timed(func):
+    """
+    Decorator for a function, whose first argument is an object with an
+    array_len property (for example, a Calculator object), that records
+    each call of the function in the kernel_timings registry (if any).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        """
+        wrapper function nested in timed decorator.
+        """
+        registry = getattr(KERNEL_TIMINGS, 'registry', None)
+        if registry is None:
+            return func(*args, **kwargs)
+        start_time = time.perf_counter()
+        ans = func(*args, **kwargs)
+        record_timing(registry, func.__name__, args[0].array_len,
+                      start_time)
+        return ans
+    return wrapper
+
+
+ARGUMENT_TYPES = dict()
+
+
+def argument_types():
+    """
+    Return dictionary mapping the name of each Records variable and each
+    Policy parameter (without its leading underscore) to the numba type
+    of the value passed for it to an apply-style function, as specified
+    by the type of each variable in the records_variables.json file and
+    by the value_type and col_var of each parameter in the
+    policy_current_law.json file.  The dictionary is made when it is
+    first needed and then reused.
+    """
+    if ARGUMENT_TYPES:
+        return ARGUMENT_TYPES
+    var_types = {'int': numba.types.int32,
+                 'float': numba.types.float64,
+                 'unchanging_float': numba.types.float64}
+    vardict = Records.read_var_info()
+    for section in ('read', 'calc'):
+        for name, info in vardict[section].items():
+            ARGUMENT_TYPES[name] = var_types[info['type']][::1]
+    param_types = {'real': numba.types.float64,
+                   'boolean': numba.types.boolean,
+                   'integer': numba.types.int16}
+    policy = Policy(only_reading_defaults=True)
+    for name, info in policy._vals.items():  # pylint: disable=protected-access
+        if info['value_type'] not in param_types:
+            continue
+        param_type = param_types[info['value_type']]
+        if info['col_var']:
+            param_type = param_type[::1]
+        ARGUMENT_TYPES[name[1:]] = param_type
+    return ARGUMENT_TYPES
+
+
+def argument_signature(args, outputs=()):
+    """
+    Return tuple of numba types of the args of an apply-style function
+    (see the argument_types function), where the array arguments not in
+    the outputs list are read-only (see the kernel_argument function), or
+    return None when the type of an argument is not specified.
+    """
+    types = argument_types()
+    if not all(arg in types for arg in args):
+        return None
+    signature = list()
+    for arg in args:
+        argtype = types[arg]
+        if isinstance(argtype, numba.types.Array) and arg not in outputs:
+            argtype = argtype.copy(readonly=True)
+        signature.append(argtype)
+    return tuple(signature)
+
+
+def kernel_argument(value, output=False):
+    """
+    Return value as it is passed to an apply-style function: the array of
+    a Pandas Series, a read-only view of an array that is not an output
+    (so that an input is never copied and jitted functions are always
+    called with the argument types they are compiled for whether or not
+    the input array is writable), or otherwise value itself.
+    """
+    if isinstance(value, pd.Series):
+        value = value.values
+    if output or not isinstance(value, np.ndarray) or \
+            not value.flags.writeable:
+        return value
+    view = value.view()
+    view.flags.writeable = False
+    return view
+
+
+def writable_output(obj, name):
+    """
+    Replace the read-only array of the name attribute of obj, which a
+    function made by the iterate_jit decorator is about to change, with
+    a writable copy (using the writable_array method of obj when it has
+    one), so the array is copied only the first time it is changed.
+    """
+    value = getattr(obj, name)
+    if isinstance(value, np.ndarray) and not value.flags.writeable:
+        if hasattr(obj, 'writable_array'):
+            obj.writable_array(name)
+        else:
+            setattr(obj, name, value.copy())
+
+
+def cacheable(func):
+    """
+    Return True if numba can store compiled versions of func on disk,
+    which requires that func is defined in a Python source file.
+    """
+    try:
+        srcfile = inspect.getsourcefile(func)
+    except TypeError:
+        return False
+    return srcfile is not None and os.path.isfile(srcfile)
+
+
+def load_generated_module(source, name, funcs, cache_dir, jit_options):
+    """
+    Write generated function source code string, source, that calls the
+    calc-style functions in the funcs list to a module file in cache_dir
+    and return the imported module.  The module file name begins with
+    name and contains a hash of the source code, the source code of the
+    whole modules that define the funcs (which contain the jitted
+    functions the funcs call), the jit_options dictionary, and the
+    taxcalc, Python and numba versions, so the compiled versions numba
+    stores alongside the module file are never used after any of those
+    change.
+    """
+    key = hashlib.sha256()
+    parts = [source]
+    for modname in sorted(set(func.__module__ for func in funcs)):
+        parts.extend([modname, inspect.getsource(sys.modules[modname])])
+    parts.extend([repr(sorted(jit_options.items())),
+                  getattr(sys.modules.get('taxcalc'), '__version__', ''),
+                  sys.version, numba.__version__])
+    for part in parts:
+        key.update(part.encode('utf-8'))
+    modname = 'taxcalc_{}_{}'.format(name, key.hexdigest()[:16])
+    if modname in sys.modules:
+        return sys.modules[modname]
+    path = os.path.join(cache_dir, modname + '.py')
+    if not os.path.isfile(path):
+        # write to a temporary file and rename it so that concurrent
+        # processes never see a partially written module file
+        tmppath = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmppath, 'w') as mfile:
+            for func in funcs:
+                mfile.write('# generated by taxcalc from {}.{}\n'.format(
+                    func.__module__, func.__name__))
+            mfile.write(source)
+        os.replace(tmppath, path)
+    spec = importlib.util.spec_from_file_location(modname, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # numba finds the module by name when loading a compiled version
+    sys.modules[modname] = module
+    return module
+
+
+def load_apply_module(apfunc, func, cache_dir, jit_options):
+    """
+    Write apply-style function source code string, apfunc, for the
+    calc-style function, func, to a module file in cache_dir and return
+    the imported module (see the load_generated_module function).
+    """
+    return load_generated_module(apfunc, 'ap_' + func.__name__, [func],
+                                 cache_dir, jit_options)
+
+
 class GetReturnNode(ast.NodeVisitor):
     """
     A NodeVisitor to get the return tuple names from a calc-style function.
@@ -58,7 +402,322 @@ class GetReturnNode(ast.NodeVisitor):
         return [node.value.id]
 
 
-def create_apply_function_string(sigout, sigin, parameters):
+class VectorizeError(Exception):
+    """
+    Raised when a calc-style function uses Python code that the
+    Vectorizer class cannot translate into array-at-a-time NumPy code.
+    """
+
+
+class Vectorizer():
+    """
+    Translates a calc-style function, which calculates the values for one
+    record, into a function that calculates the values for all records in
+    one pass using array-at-a-time NumPy operations.  The statements in the
+    body of an if statement are executed for all records and their results
+    are kept only for the records that satisfy the if condition (using
+    numpy.where).  Functions that call other jitted functions are
+    translated along with the functions they call.
+    """
+
+    # Python built-in and math-module functions and their NumPy versions
+    FUNCTIONS = {'max': 'np.maximum', 'min': 'np.minimum', 'abs': 'np.abs',
+                 'round': 'np.round', 'math.ceil': 'np.ceil',
+                 'math.floor': 'np.floor'}
+    BINOPS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+              ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**'}
+    CMPOPS = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=',
+              ast.Gt: '>', ast.GtE: '>='}
+
+    def __init__(self, func=None):
+        self.func = func
+        self.lines = list()
+        self.defined = set()
+        self.called = dict()
+        self.num_masks = 0
+
+    def line_string(self, line, names):
+        """
+        Return array-at-a-time version of one line of code in a fused
+        function (see the create_fused_function_string function), in which
+        the names of record arrays are indexed by i.
+        """
+        self.defined = set(names)
+        self.lines = list()
+        self.statements(ast.parse(line).body, None, 1)
+        return '\n'.join(self.lines)
+
+    def function_string(self):
+        """
+        Return string containing definition of the vectorized function,
+        which has the same name and arguments as the calc-style function.
+        """
+        fdef = function_definition(self.func)
+        args = [arg.arg for arg in fdef.args.args]
+        self.defined = set(args)
+        body = fdef.body
+        if not body or not isinstance(body[-1], ast.Return):
+            raise VectorizeError('function does not end with return')
+        self.lines = list()
+        self.statements(body[:-1], None, 2)
+        self.lines.append('        return {}'.format(
+            self.expression(body[-1].value)))
+        return ''.join(['def {}({}):\n'.format(fdef.name, ', '.join(args)),
+                        '    with np.errstate(all="ignore"):\n',
+                        '\n'.join(self.lines), '\n'])
+
+    def statements(self, stmts, mask, level):
+        """
+        Translate list of statements executed for records where mask is
+        True (or for all records if mask is None).
+        """
+        indent = '    ' * level
+        for stmt in stmts:
+            if isinstance(stmt, ast.Pass):
+                continue
+            if isinstance(stmt, ast.Expr) and isinstance(stmt.value,
+                                                         CONSTANT_NODES):
+                continue  # docstring
+            if isinstance(stmt, ast.Assign):
+                if len(stmt.targets) != 1:
+                    raise VectorizeError('multiple assignment')
+                value = self.expression(stmt.value)
+                if isinstance(stmt.value, ast.Name):
+                    value = 'np.copy({})'.format(value)
+                self.assign(stmt.targets[0], value, mask, indent)
+            elif isinstance(stmt, ast.AugAssign):
+                target = self.target(stmt.target)
+                value = '{} {} ({})'.format(
+                    target, self.operator(self.BINOPS, stmt.op),
+                    self.expression(stmt.value))
+                self.assign(stmt.target, value, mask, indent)
+            elif isinstance(stmt, ast.If):
+                self.num_masks += 1
+                cond = '_cond{}'.format(self.num_masks)
+                self.lines.append('{}{} = {}'.format(
+                    indent, cond, self.expression(stmt.test)))
+                if mask is None:
+                    body_mask = cond
+                    else_mask = 'np.logical_not({})'.format(cond)
+                else:
+                    body_mask = 'np.logical_and({}, {})'.format(mask, cond)
+                    else_mask = 'np.logical_and({}, np.logical_not({}))'
+                    else_mask = else_mask.format(mask, cond)
+                self.masked_statements(stmt.body, body_mask, level)
+                if stmt.orelse:
+                    self.masked_statements(stmt.orelse, else_mask, level)
+            else:
+                raise VectorizeError(type(stmt).__name__ + ' statement')
+
+    def masked_statements(self, stmts, mask_expr, level):
+        """
+        Store mask_expr in a new mask variable and translate stmts.
+        """
+        self.num_masks += 1
+        mask = '_mask{}'.format(self.num_masks)
+        self.lines.append('{}{} = {}'.format('    ' * level, mask, mask_expr))
+        self.statements(stmts, mask, level)
+
+    def target(self, node):
+        """
+        Return name of variable being assigned.
+        """
+        if self.record_element(node):
+            return node.value.id + '[:]'
+        if not isinstance(node, ast.Name):
+            raise VectorizeError('assignment to ' + type(node).__name__)
+        return node.id
+
+    def assign(self, node, value, mask, indent):
+        """
+        Add line assigning value to target node for records where mask is
+        True, with the variable being zero for other records when it has
+        not been assigned before.
+        """
+        name = self.target(node)
+        if mask is not None and self.record_element(node):
+            raise VectorizeError('masked assignment to record array')
+        if mask is not None:
+            prior = name if name in self.defined else '0.'
+            value = 'np.where({}, {}, {})'.format(mask, value, prior)
+        self.defined.add(name)
+        self.lines.append('{}{} = {}'.format(indent, name, value))
+
+    @staticmethod
+    def record_element(node):
+        """
+        Return True if node is a record array indexed by i in a line of
+        code in a fused function.
+        """
+        if not isinstance(node, ast.Subscript):
+            return False
+        index = node.slice
+        if isinstance(index, getattr(ast, 'Index', ())):
+            index = index.value
+        return (isinstance(index, ast.Name) and index.id == 'i' and
+                isinstance(node.value, ast.Name))
+
+    def operator(self, operators, node):
+        """
+        Return string for operator node.
+        """
+        try:
+            return operators[type(node)]
+        except KeyError:
+            raise VectorizeError(type(node).__name__ + ' operator')
+
+    def expression(self, node):
+        """
+        Return string containing array-at-a-time version of node.
+        """
+        # pylint: disable=too-many-return-statements,too-many-branches
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, CONSTANT_NODES):
+            return repr(node.value if hasattr(node, 'value') else node.n)
+        if isinstance(node, ast.Tuple):
+            return '({},)'.format(', '.join(self.expression(elt)
+                                            for elt in node.elts))
+        if isinstance(node, ast.BinOp):
+            return '({} {} {})'.format(self.expression(node.left),
+                                       self.operator(self.BINOPS, node.op),
+                                       self.expression(node.right))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.expression(node.operand)
+            if isinstance(node.op, ast.Not):
+                return 'np.logical_not({})'.format(operand)
+            if isinstance(node.op, ast.USub):
+                return '(-{})'.format(operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            raise VectorizeError(type(node.op).__name__ + ' operator')
+        if isinstance(node, ast.BoolOp):
+            func = ('np.logical_and' if isinstance(node.op, ast.And)
+                    else 'np.logical_or')
+            result = self.expression(node.values[0])
+            for value in node.values[1:]:
+                result = '{}({}, {})'.format(func, result,
+                                             self.expression(value))
+            return result
+        if isinstance(node, ast.Compare):
+            return self.comparison(node)
+        if isinstance(node, ast.IfExp):
+            return 'np.where({}, {}, {})'.format(self.expression(node.test),
+                                                 self.expression(node.body),
+                                                 self.expression(node.orelse))
+        if self.func is None and self.record_element(node):
+            return 'np.copy({})'.format(node.value.id)
+        if isinstance(node, ast.Subscript):
+            index = node.slice
+            if isinstance(index, getattr(ast, 'Index', ())):
+                index = index.value
+            if isinstance(index, ast.Slice):
+                raise VectorizeError('slice')
+            return '{}[{}]'.format(self.expression(node.value),
+                                   self.expression(index))
+        if isinstance(node, ast.Call):
+            return self.call(node)
+        raise VectorizeError(type(node).__name__ + ' expression')
+
+    def comparison(self, node):
+        """
+        Return string for (possibly chained) comparison node.
+        """
+        parts = list()
+        left = self.expression(node.left)
+        for oper, comparator in zip(node.ops, node.comparators):
+            right = self.expression(comparator)
+            if isinstance(oper, (ast.In, ast.NotIn)):
+                part = 'np.isin({}, {})'.format(left, right)
+                if isinstance(oper, ast.NotIn):
+                    part = 'np.logical_not({})'.format(part)
+            else:
+                part = '({} {} {})'.format(left,
+                                           self.operator(self.CMPOPS, oper),
+                                           right)
+            parts.append(part)
+            left = right
+        result = parts[0]
+        for part in parts[1:]:
+            result = 'np.logical_and({}, {})'.format(result, part)
+        return result
+
+    def call(self, node):
+        """
+        Return string for function call node.
+        """
+        if node.keywords:
+            raise VectorizeError('keyword arguments')
+        args = [self.expression(arg) for arg in node.args]
+        if isinstance(node.func, ast.Attribute):
+            if not isinstance(node.func.value, ast.Name):
+                raise VectorizeError('call of nested attribute')
+            fname = '{}.{}'.format(node.func.value.id, node.func.attr)
+        elif isinstance(node.func, ast.Name):
+            fname = node.func.id
+        else:
+            raise VectorizeError('call of ' + type(node.func).__name__)
+        if fname in ('max', 'min'):
+            if len(args) < 2:
+                raise VectorizeError(fname + ' of one argument')
+            result = args[0]
+            for arg in args[1:]:
+                result = '{}({}, {})'.format(self.FUNCTIONS[fname],
+                                             result, arg)
+            return result
+        if fname in self.FUNCTIONS:
+            return '{}({})'.format(self.FUNCTIONS[fname], ', '.join(args))
+        # call of another jitted function, which is translated as well
+        if self.func is None:
+            raise VectorizeError('call of ' + fname)
+        called = self.func.__globals__.get(fname)
+        py_func = getattr(called, 'py_func', None)
+        if py_func is None:
+            raise VectorizeError('call of ' + fname)
+        self.called[fname] = vectorized_function(py_func)
+        return '{}({})'.format(fname, ', '.join(args))
+
+
+def function_definition(func):
+    """
+    Return ast.FunctionDef node of the definition of func.
+    """
+    src = inspect.getsource(func)
+    lines = src.splitlines()
+    # remove decorator lines and any indentation of the def statement
+    while lines and lines[0].lstrip().startswith('@'):
+        lines.pop(0)
+    indent = len(lines[0]) - len(lines[0].lstrip())
+    src = '\n'.join(line[indent:] for line in lines)
+    return ast.parse(src).body[0]
+
+
+CONSTANT_NODES = tuple(getattr(ast, name)
+                       for name in ('Constant', 'Num', 'NameConstant')
+                       if hasattr(ast, name))
+
+VECTORIZED_FUNCTIONS = dict()
+
+
+def vectorized_function(func):
+    """
+    Return array-at-a-time version of calc-style function, func, made by
+    the Vectorizer class, or raise VectorizeError if func cannot be
+    translated.
+    """
+    if func not in VECTORIZED_FUNCTIONS:
+        vectorizer = Vectorizer(func)
+        vfunc = vectorizer.function_string()
+        fglobals = dict(vectorizer.called, np=np)
+        fakeglobals = {}
+        eval(compile(vfunc, '<string>', 'exec'),  # pylint: disable=eval-used
+             fglobals, fakeglobals)
+        VECTORIZED_FUNCTIONS[func] = fakeglobals[func.__name__]
+    return VECTORIZED_FUNCTIONS[func]
+
+
+def create_apply_function_string(sigout, sigin, parameters,
+                                 parallel=False):
     """
     Create a string for a function of the form::
 
@@ -80,17 +739,21 @@ def create_apply_function_string(sigout, sigin, parameters):
                 variables (as opposed to column records). This influences
                 how we construct the apply-style function
 
+    parallel: Bool, if True, loop over records with prange rather than
+              range, so numba can split the loop across threads
+
     Returns
     -------
     a String representing the function
     """
     fstr = io.StringIO()
+    loop = "prange" if parallel else "range"
     total_len = len(sigout) + len(sigin)
     out_args = ["x_" + str(i) for i in range(0, len(sigout))]
     in_args = ["x_" + str(i) for i in range(len(sigout), total_len)]
 
     fstr.write("def ap_func({0}):\n".format(",".join(out_args + in_args)))
-    fstr.write("  for i in range(len(x_0)):\n")
+    fstr.write("  for i in {0}(len(x_0)):\n".format(loop))
     out_index = [x + "[i]" for x in out_args]
     in_index = []
     for arg, _var in zip(in_args, sigin):
@@ -157,8 +820,41 @@ def create_toplevel_function_string(args_out, args_in, pm_or_pf):
     return fstr.getvalue()
 
 
+def create_vectorized_apply_function_string(sigout, sigin):
+    """
+    Create a string for a function of the form::
+
+       def ap_func(x_0, x_1, x_2, ...):
+           x_0[:], ... = vectorized_f(x_j, ...)
+           return x_0, ...
+
+    which is used instead of the function made by the
+    create_apply_function_string function when vectorized_f is the
+    array-at-a-time version of the calc-style function.
+
+    Parameters
+    ----------
+    sigout: iterable of the out arguments
+
+    sigin: iterable of the in arguments
+
+    Returns
+    -------
+    a String representing the function
+    """
+    fstr = io.StringIO()
+    total_len = len(sigout) + len(sigin)
+    out_args = ["x_" + str(i) for i in range(0, len(sigout))]
+    in_args = ["x_" + str(i) for i in range(len(sigout), total_len)]
+    fstr.write("def ap_func({0}):\n".format(",".join(out_args + in_args)))
+    fstr.write("  " + ",".join(x + "[:]" for x in out_args) + " = ")
+    fstr.write("vectorized_f(" + ",".join(in_args) + ")\n")
+    fstr.write("  return " + ",".join(out_args) + "\n")
+    return fstr.getvalue()
+
+
 def make_apply_function(func, out_args, in_args, parameters,
-                        do_jit=DO_JIT, **kwargs):
+                        do_jit=DO_JIT, parallel=False, **kwargs):
     """
     Takes a calc-style function and creates the necessary Python code for
     an apply-style function. Will also jit the function if desired.
@@ -175,24 +871,554 @@ def make_apply_function(func, out_args, in_args, parameters,
                 variables (as opposed to column records).  This influences
                 how we construct the apply-style function.
 
-    do_jit: Bool, if True, jit the resulting apply-style function
+    do_jit: Bool, if True, jit the resulting apply-style function and,
+            when the kernel_cache_dir function returns a directory,
+            store compiled versions of it on disk; if not jitting, the
+            apply-style function calls the array-at-a-time version of func
+            when the vectorizing function returns True
+
+    parallel: Bool, if True and do_jit is True, the apply-style function
+              splits its record loop across the threads numba is using
 
     Returns
     -------
     apply-style function
     """
-    if do_jit:
+    cache_dir = kernel_cache_dir() if do_jit else None
+    cache_kwargs = dict(kwargs, cache=True)
+    if cache_dir is not None and cacheable(func):
+        jitted_f = JIT(**cache_kwargs)(func)
+    elif do_jit:
         jitted_f = JIT(**kwargs)(func)
+        cache_dir = None
     else:
         jitted_f = func
-    apfunc = create_apply_function_string(out_args, in_args, parameters)
+    parallel = parallel and do_jit
+    if parallel:
+        kwargs = dict(kwargs, parallel=True)
+        cache_kwargs = dict(cache_kwargs, parallel=True)
+    # the jitted record loop releases the GIL, so that several threads can
+    # do calculations for different Records objects at the same time
+    kwargs = dict(kwargs, nogil=True)
+    cache_kwargs = dict(cache_kwargs, nogil=True)
+    apfunc = create_apply_function_string(out_args, in_args, parameters,
+                                          parallel)
+    if cache_dir is not None:
+        try:
+            module = load_apply_module(apfunc, func, cache_dir,
+                                       cache_kwargs)
+        except OSError:
+            pass
+        else:
+            module.jitted_f = jitted_f
+            module.prange = numba.prange
+            return JIT(**cache_kwargs)(module.ap_func)
     func_code = compile(apfunc, "<string>", "exec")
     fakeglobals = {}
     eval(func_code,  # pylint: disable=eval-used
-         {"jitted_f": jitted_f}, fakeglobals)
+         {"jitted_f": jitted_f, "prange": numba.prange}, fakeglobals)
+    ap_func = fakeglobals['ap_func']
     if do_jit:
-        return JIT(**kwargs)(fakeglobals['ap_func'])
-    return fakeglobals['ap_func']
+        ap_func = JIT(**kwargs)(ap_func)
+    if vectorizing(do_jit):
+        return make_vectorized_apply_function(func, out_args, in_args,
+                                              ap_func)
+    return ap_func
+
+
+def make_vectorized_apply_function(func, out_args, in_args, ap_func):
+    """
+    Return apply-style function that calls the array-at-a-time version of
+    the calc-style function, func, or that calls ap_func if func cannot be
+    translated into an array-at-a-time function.  The translation is done
+    when the apply-style function is first called, because func may call
+    jitted functions that are defined after func is defined.
+    """
+    apply_fns = list()
+
+    def vectorized_apply(*args):
+        """
+        Call array-at-a-time apply-style function.
+        """
+        if not apply_fns:
+            try:
+                vectorized_f = vectorized_function(func)
+            except VectorizeError:
+                apply_fns.append(ap_func)
+            else:
+                apfunc = create_vectorized_apply_function_string(out_args,
+                                                                 in_args)
+                func_code = compile(apfunc, "<string>", "exec")
+                fakeglobals = {}
+                eval(func_code,  # pylint: disable=eval-used
+                     {"vectorized_f": vectorized_f}, fakeglobals)
+                apply_fns.append(fakeglobals['ap_func'])
+        return apply_fns[0](*args)
+
+    return vectorized_apply
+
+
+def create_fused_function_string(args, steps, parameters, parallel=False):
+    """
+    Create a string for a function of the form::
+
+       def fused_func(v_0, v_1, v_2, ...):
+           for i in range(len(v_0)):
+               v_0[i], ... = calc_f0(v_j[i], ...)
+               v_1[i], ... = calc_f1(v_k[i], ...)
+               ...
+           return
+
+    that applies a sequence of jitted calc-style functions to each record
+    in turn, so all the calculations for one record are done before any
+    calculations for the next record.
+
+    Parameters
+    ----------
+    args: list of the names of the fused function arguments
+
+    steps: list of the steps done for each record, where each step is
+           either a (name, out_args, in_args) tuple, which denotes a call
+           of the jitted calc-style function with that name, or a string,
+           which is a line of code that is added to the loop body
+
+    parameters: iterable of which of the args are parameter variables
+                (as opposed to column records)
+
+    parallel: Bool, if True, loop over records with prange rather than
+              range, so numba can split the loop across threads
+
+    Returns
+    -------
+    a String representing the function
+    """
+    records = [arg for arg in args if arg not in parameters]
+    loop = "prange" if parallel else "range"
+    fstr = io.StringIO()
+    fstr.write("def fused_func({0}):\n".format(",".join(args)))
+    fstr.write("  for i in {0}(len({1})):\n".format(loop, records[0]))
+    for step in steps:
+        if isinstance(step, str):
+            fstr.write("    " + step + "\n")
+            continue
+        name, out_args, in_args = step
+        out_index = [arg + "[i]" for arg in out_args]
+        in_index = []
+        for arg in in_args:
+            in_index.append(arg + "[i]" if arg not in parameters else arg)
+        fstr.write("    " + ",".join(out_index) + " = ")
+        fstr.write(name + "(" + ",".join(in_index) + ")\n")
+    fstr.write("  return\n")
+    return fstr.getvalue()
+
+
+def create_vectorized_fused_function_string(args, steps):
+    """
+    Create a string for a function of the form::
+
+       def fused_func(v_0, v_1, v_2, ...):
+           v_0[:], ... = calc_f0(v_j, ...)
+           v_1[:], ... = calc_f1(v_k, ...)
+           ...
+           return
+
+    which is used instead of the function made by the
+    create_fused_function_string function when each calc_f is the
+    array-at-a-time version of a calc-style function.  The args and steps
+    are the same as for the create_fused_function_string function, with
+    each line of code being translated into array-at-a-time code.
+
+    Returns
+    -------
+    a String representing the function
+    """
+    fstr = io.StringIO()
+    fstr.write("def fused_func({0}):\n".format(",".join(args)))
+    for step in steps:
+        if isinstance(step, str):
+            fstr.write(Vectorizer().line_string(step, args) + "\n")
+            continue
+        name, out_args, in_args = step
+        fstr.write("    " + ",".join(arg + "[:]" for arg in out_args))
+        fstr.write(" = " + name + "(" + ",".join(in_args) + ")\n")
+    fstr.write("    return\n")
+    return fstr.getvalue()
+
+
+def fused_function_plan(steps):
+    """
+    Return information about the list of steps done for each record by a
+    fused function (see the make_fused_function function), which is a
+    tuple containing the list of argument names, the set of parameter
+    names, the list of calls and lines of code used by the
+    create_fused_function_string function, the list of calc-style
+    functions, and the dictionary of jit options.
+    """
+    args = list()
+    parameters = set()
+    calls = list()
+    funcs = list()
+    jit_options = dict()
+    for step in steps:
+        if isinstance(step, str):
+            for arg in re.findall(r'\b(\w+)\[i\]', step):
+                if arg not in args:
+                    args.append(arg)
+            calls.append(step)
+            continue
+        for arg in step.out_args + step.in_args:
+            if arg not in args:
+                args.append(arg)
+        parameters.update(step.parameters)
+        jit_options.update(step.jit_options)
+        calls.append((step.calc_func.__name__, step.out_args, step.in_args))
+        if step.calc_func not in funcs:
+            funcs.append(step.calc_func)
+    names = [func.__name__ for func in funcs]
+    if set(names) & set(args):
+        raise ValueError('fused function names clash with argument names')
+    return args, parameters, calls, funcs, jit_options
+
+
+def jitted_functions(funcs, do_jit, jit_options):
+    """
+    Return dictionary of the jitted versions of the calc-style functions
+    in the funcs list indexed by function name, along with numba.prange,
+    for use as the globals of a generated function that calls them.
+    """
+    jitted = dict(prange=numba.prange)
+    for func in funcs:
+        jitted[func.__name__] = JIT(**jit_options)(func) if do_jit else func
+    return jitted
+
+
+def compile_generated_function(source, name, funcs, jitted,
+                               do_jit, jit_options):
+    """
+    Return the function defined in the source code string, where the
+    function has the specified name and calls the jitted versions of the
+    calc-style functions in the funcs list, which are in the jitted
+    dictionary.  When do_jit is True, the returned function is jitted
+    (only when it is first called) and, when jit_options contains the
+    cache option, its source code is written to the kernel cache
+    directory so compiled versions of it can be stored on disk.
+    """
+    if do_jit and jit_options.get('cache'):
+        try:
+            module = load_generated_module(source, name, funcs,
+                                           kernel_cache_dir(), jit_options)
+        except (OSError, TypeError):
+            pass
+        else:
+            for fname, jitted_f in jitted.items():
+                setattr(module, fname, jitted_f)
+            return JIT(**jit_options)(getattr(module, name + '_func'))
+    options = dict(jit_options)
+    options.pop('cache', None)
+    func_code = compile(source, "<string>", "exec")
+    fakeglobals = {}
+    eval(func_code, jitted, fakeglobals)  # pylint: disable=eval-used
+    if do_jit:
+        return JIT(**options)(fakeglobals[name + '_func'])
+    return fakeglobals[name + '_func']
+
+
+def kernel_jit_options(funcs, do_jit, jit_options):
+    """
+    Return copy of jit_options that contains the cache option when
+    compiled versions of the functions generated for the calc-style
+    functions in the funcs list can be stored on disk, and that contains
+    the nogil option when jitting.
+    """
+    options = dict(jit_options)
+    if do_jit:
+        options['nogil'] = True
+    if (do_jit and kernel_cache_dir() is not None and
+            all(cacheable(func) for func in funcs)):
+        options['cache'] = True
+    return options
+
+
+def make_fused_function(steps, do_jit=DO_JIT, name='fused'):
+    """
+    Takes a list of calc-style functions decorated by iterate_jit and
+    lines of code, and creates a function that does all the calculations
+    for each record before moving on to the next record, which means each
+    record's data is read from memory once rather than once per function.
+
+    Parameters
+    ----------
+    steps: list of steps done for each record, where each step is either
+           a function decorated by iterate_jit or a string that is a line
+           of code using record variables indexed by i (for example,
+           "c04470[i] = 0.") and local variables
+
+    do_jit: Bool, if True, jit the resulting fused function and, when the
+            kernel_cache_dir function returns a directory, store compiled
+            versions of it on disk; if not jitting, the fused function
+            does array-at-a-time calculations when the vectorizing
+            function returns True
+
+    name: string used to record calls of the fused function in the
+          kernel_timings registry
+
+    Returns
+    -------
+    function that is called with the same two arguments (for example,
+    Policy and Records objects) as the functions decorated by iterate_jit
+    and that returns None; it splits its record loop across threads when
+    called inside a kernel_threads context that uses more than one thread
+    """
+    args, parameters, calls, funcs, jit_options = fused_function_plan(steps)
+    record_args = [arg for arg in args if arg not in parameters]
+    fused_func = None
+    if vectorizing(do_jit):
+        fused_func = make_vectorized_fused_function(args, calls, funcs)
+    jit_options = kernel_jit_options(funcs, do_jit, jit_options)
+    jitted = jitted_functions(funcs, do_jit, jit_options)
+    if fused_func is None:
+        fused = create_fused_function_string(args, calls, parameters)
+        fused_func = compile_generated_function(fused, 'fused', funcs,
+                                                jitted, do_jit, jit_options)
+    if do_jit and JIT is not id_wrapper:
+        fused = create_fused_function_string(args, calls, parameters,
+                                             parallel=True)
+        fused_parallel_func = compile_generated_function(
+            fused, 'fused', funcs, jitted, do_jit,
+            dict(jit_options, parallel=True))
+    else:
+        fused_parallel_func = fused_func
+
+    def high_level_fn(pm, pf):
+        """
+        Call fused_func with the arguments held by the pm and pf objects.
+        """
+        registry = getattr(KERNEL_TIMINGS, 'registry', None)
+        if registry is not None:
+            start_time = time.perf_counter()
+        arrays = list()
+        for arg in args:
+            obj = pm if hasattr(pm, arg) else pf
+            val = getattr(obj, arg)
+            arrays.append(val.values if isinstance(val, pd.Series) else val)
+        if parallel_kernels():
+            fused_parallel_func(*arrays)
+        else:
+            fused_func(*arrays)
+        if registry is not None:
+            num_records = len(arrays[args.index(record_args[0])])
+            record_timing(registry, name, num_records, start_time)
+
+    return high_level_fn
+
+
+def make_vectorized_fused_function(args, calls, funcs):
+    """
+    Return array-at-a-time version of the fused function with the
+    specified args and calls (see the create_vectorized_fused_function
+    function), or return None if any of the calc-style functions in the
+    funcs list or any of the lines of code cannot be translated.
+    """
+    try:
+        fused = create_vectorized_fused_function_string(args, calls)
+        vectorized = {func.__name__: vectorized_function(func)
+                      for func in funcs}
+    except VectorizeError:
+        return None
+    vectorized['np'] = np
+    func_code = compile(fused, "<string>", "exec")
+    fakeglobals = {}
+    eval(func_code, vectorized, fakeglobals)  # pylint: disable=eval-used
+    return fakeglobals['fused_func']
+
+
+def create_batched_function_string(args, steps, parameters, outputs):
+    """
+    Create a string for a function of the form::
+
+       def batched_func(v_0, v_1, ..., s_v_0, ..., out_v_0, ...):
+           for i in range(len(v_0)):
+               for k in range(len(s_v_0)):
+                   s_v_0[k] = v_0[i]
+                   ...
+                   s_v_0[k], ... = calc_f0(v_j[i], p_0[k], ...)
+                   ...
+                   out_v_0[k, i] = s_v_0[k]
+           return
+
+    that does the same calculations as the function made by the
+    create_fused_function_string function for each of K scenarios, where
+    each parameter argument has a leading scenario axis of length K.  The
+    calculated variables (that is, the out arguments of the calc-style
+    functions) for scenario k are held in element k of the s_ arrays,
+    which have length K and the same dtype as the record arrays, and
+    which are set to the record array values before the calculations
+    for each scenario.  The values of the output variables are written
+    to the out_ arrays, which have shape (K, number of records).
+
+    Parameters
+    ----------
+    args: list of the names of the fused function arguments
+
+    steps: list of the steps done for each record as described in the
+           create_fused_function_string function
+
+    parameters: iterable of which of the args are parameter variables
+                (as opposed to column records)
+
+    outputs: list of the names of the args whose values are written to
+             the out_ arrays
+
+    Returns
+    -------
+    a String representing the function
+    """
+    calculated = list()
+    for step in steps:
+        if not isinstance(step, str):
+            calculated.extend(arg for arg in step[1] if arg not in calculated)
+    records = [arg for arg in args if arg not in parameters]
+
+    def ref(arg):
+        """
+        Return reference to arg for scenario k of record i.
+        """
+        if arg in parameters:
+            return arg + "[k]"
+        if arg in calculated:
+            return "s_" + arg + "[k]"
+        return arg + "[i]"
+
+    def line_ref(match):
+        """
+        Return reference to a record array indexed by i in a line of code.
+        """
+        if match.group(1) in calculated:
+            return ref(match.group(1))
+        return match.group(0)
+
+    fstr = io.StringIO()
+    fstr.write("def batched_func({0}):\n".format(",".join(
+        args + ["s_" + arg for arg in calculated] +
+        ["out_" + arg for arg in outputs])))
+    fstr.write("  for i in range(len({0})):\n".format(records[0]))
+    fstr.write("    for k in range(len(s_{0})):\n".format(calculated[0]))
+    for arg in calculated:
+        fstr.write("      s_{0}[k] = {0}[i]\n".format(arg))
+    for step in steps:
+        if isinstance(step, str):
+            fstr.write("      " + re.sub(r"\b(\w+)\[i\]", line_ref, step) +
+                       "\n")
+            continue
+        name, out_args, in_args = step
+        fstr.write("      " + ",".join(ref(arg) for arg in out_args) + " = ")
+        fstr.write(name + "(" + ",".join(ref(arg) for arg in in_args) +
+                   ")\n")
+    for arg in outputs:
+        fstr.write("      out_{0}[k, i] = {1}\n".format(arg, ref(arg)))
+    fstr.write("  return\n")
+    return fstr.getvalue()
+
+
+def make_batched_function(steps, outputs, do_jit=DO_JIT, name='batched'):
+    """
+    Takes the same list of steps as the make_fused_function function and
+    creates a function that does the fused calculations for each of K
+    policy scenarios (that is, K sets of parameter values), doing the
+    calculations for all scenarios for each record before moving on to
+    the next record, which means each record's data is read from memory
+    once for all K scenarios.
+
+    Parameters
+    ----------
+    steps: list of steps done for each record (see make_fused_function)
+
+    outputs: list of names of the variables whose values are returned
+
+    do_jit: Bool, if True, jit the resulting batched function and, when
+            the kernel_cache_dir function returns a directory, store
+            compiled versions of it on disk; if not jitting, the
+            calculations are done one scenario at a time with
+            array-at-a-time calculations when the vectorizing function
+            returns True
+
+    name: string used to record calls of the batched function in the
+          kernel_timings registry
+
+    Returns
+    -------
+    function that is called with two arguments, which are a list of K
+    objects holding parameter values (for example, Policy objects) and an
+    object holding record arrays (for example, a Records object), and
+    that returns a dictionary containing for each of the outputs an array
+    with shape (K, number of records); the function does not change the
+    arrays in its second argument
+    """
+    args, parameters, calls, funcs, jit_options = fused_function_plan(steps)
+    for arg in outputs:
+        if arg not in args:
+            raise ValueError('output {} is not a fused argument'.format(arg))
+    calculated = list()
+    for call in calls:
+        if not isinstance(call, str):
+            calculated.extend(arg for arg in call[1] if arg not in calculated)
+    vectorized_func = None
+    if vectorizing(do_jit):
+        vectorized_func = make_vectorized_fused_function(args, calls, funcs)
+    if vectorized_func is None:
+        jit_options = kernel_jit_options(funcs, do_jit, jit_options)
+        jitted = jitted_functions(funcs, do_jit, jit_options)
+        batched = create_batched_function_string(args, calls, parameters,
+                                                 outputs)
+        batched_func = compile_generated_function(batched, 'batched', funcs,
+                                                  jitted, do_jit, jit_options)
+
+    def high_level_fn(pms, pf):
+        """
+        Call batched_func with the parameters held by each of the objects
+        in the pms list and the record arrays held by the pf object.
+        """
+        registry = getattr(KERNEL_TIMINGS, 'registry', None)
+        if registry is not None:
+            start_time = time.perf_counter()
+        num_scenarios = len(pms)
+        arrays = list()
+        for arg in args:
+            if hasattr(pms[0], arg):
+                val = np.array([getattr(pm, arg) for pm in pms])
+            else:
+                val = kernel_argument(getattr(pf, arg))
+            arrays.append(val)
+        results = dict()
+        for arg in outputs:
+            shape = (num_scenarios, len(arrays[args.index(arg)]))
+            results[arg] = np.zeros(shape,
+                                    dtype=arrays[args.index(arg)].dtype)
+        if vectorized_func is not None:
+            for kdx in range(num_scenarios):
+                scenario_arrays = list()
+                for arg, val in zip(args, arrays):
+                    if arg in parameters:
+                        val = val[kdx]
+                    elif arg in calculated:
+                        val = val.copy()
+                    scenario_arrays.append(val)
+                vectorized_func(*scenario_arrays)
+                for arg in outputs:
+                    results[arg][kdx] = scenario_arrays[args.index(arg)]
+        else:
+            scratch = [np.zeros(num_scenarios,
+                                dtype=arrays[args.index(arg)].dtype)
+                       for arg in calculated]
+            batched_func(*(arrays + scratch +
+                           [results[arg] for arg in outputs]))
+        if registry is not None:
+            num_records = len(arrays[args.index(calculated[0])])
+            record_timing(registry, name, num_scenarios * num_records,
+                          start_time)
+        return results
+
+    return high_level_fn
 
 
 def apply_jit(dtype_sig_out, dtype_sig_in, parameters=None, **kwargs):
@@ -283,40 +1509,131 @@ def iterate_jit(parameters=None, **kwargs):
         if not all_out_args:
             raise ValueError("Can't find return statement in function!")
 
-        # Now create the apply-style possibly-jitted function
-        applied_jitted_f = make_apply_function(func,
-                                               list(reversed(all_out_args)),
-                                               in_args,
-                                               parameters=all_parameters,
-                                               do_jit=DO_JIT,
-                                               **kwargs_for_jit)
+        # Now create the apply-style possibly-jitted function, with the
+        # parallel version being created only when it is first needed
+        applied_jitted_fns = dict()
 
-        def wrapper(*args, **kwargs):
+        def applied_jitted_function(parallel):
             """
-            wrapper function nested in make_wrapper function nested
-            in iterate_jit decorator.
+            Return serial or parallel apply-style function.
+            """
+            if parallel not in applied_jitted_fns:
+                applied_jitted_fns[parallel] = make_apply_function(
+                    func, list(reversed(all_out_args)), in_args,
+                    parameters=all_parameters, do_jit=DO_JIT,
+                    parallel=parallel, **kwargs_for_jit)
+            return applied_jitted_fns[parallel]
+
+        applied_jitted_function(parallel=False)
+
+        def compile_typed(parallel=False):
+            """
+            Compile the jitted apply-style function for the argument types
+            specified in the Records and Policy metadata (see the
+            argument_types function), so that calls with arguments of
+            those types do not have to infer types and compile first.
+            Returns True if the function was compiled.
+            """
+            ap_func = applied_jitted_function(parallel)
+            signature = argument_signature(all_out_args + in_args,
+                                           all_out_args)
+            if signature is None or not hasattr(ap_func, 'compile'):
+                return False
+            ap_func.compile(signature)
+            return True
+
+        # Cache of high-level functions indexed by argument layout, where
+        # the layout is the pair of types of the two objects holding the
+        # function arguments (for example, Policy and Records) plus whether
+        # or not the record loop is split across threads.  The first
+        # call for a layout resolves which object holds each argument and
+        # generates the high-level function; later calls reuse it.
+        high_level_fns = dict()
+
+        def make_high_level_function(parallel, *args):
+            """
+            Resolve argument layout for args and return compiled hl_func.
             """
-            in_arrays = []
             pm_or_pf = []
             for farg in all_out_args + in_args:
                 if hasattr(args[0], farg):
-                    in_arrays.append(getattr(args[0], farg))
                     pm_or_pf.append("pm")
                 elif hasattr(args[1], farg):
-                    in_arrays.append(getattr(args[1], farg))
                     pm_or_pf.append("pf")
+                else:
+                    msg = '{} argument {} not found in either object'
+                    raise AttributeError(msg.format(func.__name__, farg))
             # Create the high level function
             high_level_func = create_toplevel_function_string(all_out_args,
                                                               list(in_args),
                                                               pm_or_pf)
             func_code = compile(high_level_func, "<string>", "exec")
+            applied_f = applied_jitted_function(parallel)
+            outputs = [arg in all_out_args for arg in all_out_args + in_args]
+            pf_out_args = [arg for arg, obj in zip(all_out_args, pm_or_pf)
+                           if obj == 'pf']
+
+            def call_applied_f(*fargs):
+                """
+                Call applied_f with fargs converted by kernel_argument.
+                """
+                return applied_f(*[kernel_argument(farg, output)
+                                   for farg, output in zip(fargs, outputs)])
+
             fakeglobals = {}
             eval(func_code,  # pylint: disable=eval-used
-                 {"applied_f": applied_jitted_f}, fakeglobals)
-            high_level_fn = fakeglobals['hl_func']
-            ans = high_level_fn(*args, **kwargs)
+                 {"applied_f": call_applied_f},
+                 fakeglobals)
+            hl_func = fakeglobals['hl_func']
+
+            def call_hl_func(pm, pf):
+                """
+                Call hl_func after making the output arrays writable.
+                """
+                for arg in pf_out_args:
+                    writable_output(pf, arg)
+                return hl_func(pm, pf)
+
+            return call_hl_func
+
+        def wrapper(*args, **kwargs):
+            """
+            wrapper function nested in make_wrapper function nested
+            in iterate_jit decorator.
+            """
+            registry = getattr(KERNEL_TIMINGS, 'registry', None)
+            if registry is None:
+                return call_high_level_function(*args, **kwargs)
+            start_time = time.perf_counter()
+            ans = call_high_level_function(*args, **kwargs)
+            record_timing(registry, func.__name__, len(ans), start_time)
             return ans
 
+        def call_high_level_function(*args, **kwargs):
+            """
+            Call high-level function for the argument layout of args.
+            """
+            parallel = parallel_kernels()
+            layout = (type(args[0]), type(args[1]), parallel)
+            high_level_fn = high_level_fns.get(layout)
+            if high_level_fn is not None:
+                try:
+                    return high_level_fn(*args, **kwargs)
+                except AttributeError:
+                    # objects of the same types hold different attributes,
+                    # so resolve the argument layout again
+                    pass
+            high_level_fn = make_high_level_function(parallel, *args)
+            high_level_fns[layout] = high_level_fn
+            return high_level_fn(*args, **kwargs)
+
+        # information used by the make_fused_function function
+        wrapper.calc_func = func
+        wrapper.out_args = list(all_out_args)
+        wrapper.in_args = list(in_args)
+        wrapper.parameters = all_parameters
+        wrapper.jit_options = kwargs_for_jit
+        wrapper.compile_typed = compile_typed
         return wrapper
 
     return make_wrapper
@@ -6,6 +6,13 @@ Tax-Calculator tax-filing-unit Records class.
 # pylint --disable=locally-disabled records.py
 
 import os
+import bz2
+import copy
+import gzip
+import json
+import lzma
+import shutil
+import hashlib
 import numpy as np
 import pandas as pd
 from taxcalc.growfactors import GrowFactors
@@ -19,7 +26,10 @@ class Records():
     Parameters
     ----------
     data: string or Pandas DataFrame
-        string describes CSV file in which records data reside;
+        string describes CSV file in which records data reside, or a
+        Parquet, Feather, or Arrow IPC file (with a .parquet, .feather, or
+        .arrow suffix) from which only the usable columns are read, which
+        requires the pyarrow package;
         DataFrame already contains records data;
         default value is the string 'puf.csv'
         NOTE: to use your own data for a specific year with Tax-Calculator,
@@ -58,10 +68,18 @@ class Records():
         any smoothing of "stair-step" provisions in income tax law;
         default value is false.
 
+    cache_dir: string or None
+        name of an existing directory in which the read-variable data
+        parsed from a data file are saved, so that later Records objects
+        constructed from the same unchanged file memory-map the saved data
+        rather than parsing the file again (see the Notes below);
+        default value is None, which implies no input caching is done.
+
     Raises
     ------
     ValueError:
         if data is not the appropriate type.
+        if cache_dir is not None or the name of an existing directory.
         if taxpayer and spouse variables do not add up to filing-unit total.
         if dividends is less than qualified dividends.
         if gfactors is not None or a GrowFactors class instance.
@@ -87,6 +105,37 @@ class Records():
 
     Use Records.cps_constructor() to get a Records object instantiated
     with CPS input data.
+
+    When cache_dir is specified, the cache entry for a data file is found
+    using the file's path, size, and modification time (so the file
+    contents are not read to find it), and it is replaced when the file
+    changes, so cache_dir never holds more than one entry for each data
+    file.  Deleting the cache_dir contents is always safe.
+
+    A copy of a Records object made by copy.deepcopy shares the arrays of
+    the read variables (and the sample weights and adjustment ratios) with
+    the original object until one of the two objects changes them, so
+    copying is fast and uses little memory.  The shared arrays are made
+    read-only in both objects, so changing one in place raises an error
+    rather than changing the other object.  The Records methods copy a
+    shared array before changing it, and code outside the Records class
+    that changes a read variable's array in place must get the array by
+    calling the writable_array method (or set the variable to a new array
+    using the Calculator.array method).
+
+    The arrays of the variables are rows of a few contiguous 2-D arrays
+    (called blocks), one for each of the float read variables, the
+    integer read variables, the float calculated variables, and the
+    integer calculated variables (see the BLOCK_VARS dictionary), so that
+    copying, zeroing, and pickling the variables is done with a few bulk
+    operations.  A variable that is set to a different array (rather than
+    changed in place) is no longer a row of its block.  The blocks of the
+    read variables contain only the variables in the input data, and the
+    array of each read variable not in the input data is a read-only
+    array of zeros shared by all such variables, which is replaced by a
+    copy when the writable_array method is called.  The block of the
+    calculated variables of each type is not allocated until one of its
+    variables is first used.
     """
     # suppress pylint warnings about unrecognized Records variables:
     # pylint: disable=no-member
@@ -98,6 +147,18 @@ class Records():
     PUFCSV_YEAR = 2011
     CPSCSV_YEAR = 2014
 
+    # suffixes of names of input files read by the _read_columnar_data
+    # method rather than as CSV files
+    COLUMNAR_FILE_SUFFIXES = ('.parquet', '.feather', '.arrow')
+
+    # version of the input cache contents (see the _input_cache_path
+    # method), which must be increased when the way input files are read
+    # changes
+    INPUT_CACHE_VERSION = 2
+
+    # number of rows of a CSV file parsed at a time by _read_csv_data
+    CSV_CHUNK_ROWS = 10000
+
     PUF_WEIGHTS_FILENAME = 'puf_weights.csv.gz'
     PUF_RATIOS_FILENAME = 'puf_ratios.csv'
     CPS_WEIGHTS_FILENAME = 'cps_weights.csv.gz'
@@ -111,12 +172,18 @@ class Records():
                  gfactors=GrowFactors(),
                  weights=PUF_WEIGHTS_FILENAME,
                  adjust_ratios=PUF_RATIOS_FILENAME,
-                 exact_calculations=False):
+                 exact_calculations=False,
+                 cache_dir=None):
         # pylint: disable=too-many-arguments,too-many-locals
         # pylint: disable=too-many-statements,too-many-branches
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            msg = 'cache_dir {} is not an existing directory'
+            raise ValueError(msg.format(cache_dir))
         self.__data_year = start_year
+        self.__shared_vars = set()
+        self.__shared_blocks = set()
         # read specified data
-        self._read_data(data, exact_calculations)
+        self._read_data(data, exact_calculations, cache_dir)
         # check that three sets of split-earnings variables have valid values
         msg = 'expression "{0} == {0}p + {0}s" is not true for every record'
         tol = 0.020001  # handles "%.2f" rounding errors
@@ -176,7 +243,7 @@ class Records():
         # specify current_year and FLPDYR values
         if isinstance(start_year, int):
             self.__current_year = start_year
-            self.FLPDYR.fill(start_year)
+            self.writable_array('FLPDYR').fill(start_year)
         else:
             msg = 'start_year is not an integer'
             raise ValueError(msg)
@@ -189,7 +256,8 @@ class Records():
     @staticmethod
     def cps_constructor(data=None,
                         exact_calculations=False,
-                        gfactors=GrowFactors()):
+                        gfactors=GrowFactors(),
+                        cache_dir=None):
         """
         Static method returns a Records object instantiated with CPS
         input data.  This works in a analogous way to Records(), which
@@ -207,7 +275,8 @@ class Records():
                        gfactors=gfactors,
                        weights=Records.CPS_WEIGHTS_FILENAME,
                        adjust_ratios=Records.CPS_RATIOS_FILENAME,
-                       start_year=Records.CPSCSV_YEAR)
+                       start_year=Records.CPSCSV_YEAR,
+                       cache_dir=cache_dir)
 
     @property
     def data_year(self):
@@ -230,6 +299,134 @@ class Records():
         """
         return self.__dim
 
+    def __deepcopy__(self, memo):
+        """
+        Return copy of this Records object that shares the arrays of the
+        read variables, and the sample weights and adjustment ratios, with
+        this object until one of the two objects changes them.
+        """
+        records = Records.__new__(Records)
+        memo[id(self)] = records
+        shared = set()
+        attached = self._attached_vars()
+        for name, value in self.__dict__.items():
+            if name in Records.USABLE_READ_VARS:
+                if isinstance(value, np.ndarray):
+                    shared.add(name)
+                    records.__dict__[name] = value
+                    continue
+            elif name in ('WT', 'ADJ', '_Records__zeros',
+                          '_Records__block_vars'):
+                records.__dict__[name] = value
+                continue
+            elif name in attached or name in ('_Records__blocks',
+                                              '_Records__views'):
+                continue
+            records.__dict__[name] = copy.deepcopy(value, memo)
+        # share the read-variable blocks and copy the other blocks
+        records.__blocks = dict()
+        records.__views = dict()
+        for blockname, block in self.__blocks.items():
+            if blockname in Records.READ_BLOCKS:
+                records.__blocks[blockname] = block
+                for varname in self.__block_vars[blockname]:
+                    records.__views[varname] = self.__views[varname]
+            else:
+                records.__blocks[blockname] = block.copy()
+                records._attach_block(blockname, attached)
+        # make the shared arrays read-only in both objects, so that
+        # changing one in place without calling writable_array raises an
+        # error instead of changing the other object
+        for name in shared:
+            self.__dict__[name].setflags(write=False)
+        for blockname in Records.READ_BLOCKS:
+            self.__blocks[blockname].setflags(write=False)
+            for varname in self.__block_vars[blockname]:
+                self.__views[varname].setflags(write=False)
+        self.__shared_vars |= shared
+        records.__shared_vars = set(self.__shared_vars)
+        self.__shared_blocks |= Records.READ_BLOCKS
+        records.__shared_blocks = set(self.__shared_blocks)
+        return records
+
+    def __getstate__(self):
+        """
+        Return dictionary used to pickle this object, which omits the
+        variables that are rows of their blocks, so that each block is
+        pickled only once, and the read variables not in the input data.
+        """
+        attached = self._attached_vars()
+        unread = self._unread_vars()
+        state = {name: value for name, value in self.__dict__.items()
+                 if name not in attached and name not in unread and
+                 name not in ('_Records__views', '_Records__zeros')}
+        state['_Records__attached'] = sorted(attached)
+        state['_Records__unread'] = sorted(unread)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore this object from the dictionary returned by __getstate__.
+        """
+        state = dict(state)
+        attached = set(state.pop('_Records__attached'))
+        unread = set(state.pop('_Records__unread'))
+        self.__dict__.update(state)
+        self.__views = dict()
+        for blockname in self.__blocks:
+            self._attach_block(blockname, attached)
+        self._attach_zeros(unread)
+
+    def row_subset(self, rows):
+        """
+        Return copy of this Records object that contains only the filing
+        units whose indexes are in the rows array, which can be used to do
+        calculations for the current_year on just those filing units, but
+        which cannot be extrapolated to later years.
+        """
+        records = Records.__new__(Records)
+        attached = self._attached_vars()
+        unread = self._unread_vars()
+        for name, value in self.__dict__.items():
+            if name in attached or name in unread or \
+                    name in ('_Records__blocks', '_Records__views',
+                             '_Records__zeros'):
+                continue
+            if isinstance(value, (np.ndarray, pd.Series)) and \
+                    len(value) == self.__dim:
+                records.__dict__[name] = np.asarray(value)[rows]
+            elif name in ('WT', 'ADJ', 'gfactors'):
+                records.__dict__[name] = value
+            else:
+                records.__dict__[name] = copy.deepcopy(value)
+        records.__dim = len(rows)
+        records.__index = self.__index[rows]
+        records.__shared_vars = set()
+        records.__shared_blocks = set()
+        records.__blocks = dict()
+        records.__views = dict()
+        for blockname, block in self.__blocks.items():
+            records.__blocks[blockname] = np.ascontiguousarray(block[:, rows])
+            records._attach_block(blockname, attached)
+        records._attach_zeros(unread)
+        return records
+
+    def writable_array(self, varname):
+        """
+        Return the array of the named variable after replacing it with a
+        copy when it is read-only, because it is shared with a copy of this
+        Records object (see the Notes in the Records class documentation)
+        or because it is the array of zeros of a read variable not in the
+        input data, so that the returned array can be changed in place
+        without changing the other object or the other variables.
+        """
+        array = getattr(self, varname)
+        if varname in self.__shared_vars or \
+                (isinstance(array, np.ndarray) and not array.flags.writeable):
+            setattr(self, varname, array.copy())
+            self.__shared_vars.discard(varname)
+        return getattr(self, varname)
+
     def increment_year(self):
         """
         Add one to current year.
@@ -237,11 +434,29 @@ class Records():
         """
         # move to next year
         self.__current_year += 1
+        # extrapolation and adjustment change floating-point read variables
+        # in place, so copy those shared with a copy of this object
+        if 'float_read' in self.__shared_blocks:
+            self._unshare_block('float_read')
+        unread = self._unread_vars() - Records.INTEGER_READ_VARS
+        for varname in self.__shared_vars - Records.INTEGER_READ_VARS - unread:
+            self.writable_array(varname)
+        # give floating-point read variables not in the input data arrays
+        # of zeros that can be changed in place, and share the read-only
+        # array of zeros again when they are still zero after extrapolation
+        # and adjustment
+        self.__shared_vars -= unread
+        for varname in unread:
+            setattr(self, varname, np.zeros(self.__dim))
         # apply variable extrapolation grow factors
         if self.gfactors is not None:
             self._extrapolate(self.__current_year)
         # apply variable adjustment ratios
         self._adjust(self.__current_year)
+        zeros = self.__zeros['float_read']
+        for varname in unread:
+            if not np.any(getattr(self, varname)):
+                setattr(self, varname, zeros)
         # specify current-year sample weights
         if self.WT.size > 0:
             wt_colname = 'WT{}'.format(self.__current_year)
@@ -254,7 +469,7 @@ class Records():
         are skipped.
         """
         self.__current_year = new_current_year
-        self.FLPDYR.fill(new_current_year)
+        self.writable_array('FLPDYR').fill(new_current_year)
 
     @staticmethod
     def read_var_info():
@@ -289,6 +504,19 @@ class Records():
                                    FIXED_CALCULATED_VARS)
         Records.CHANGING_CALCULATED_VARS = FLOAT_CALCULATED_VARS
         Records.INTEGER_VARS = Records.INTEGER_READ_VARS | INT_CALCULATED_VARS
+        # the changing calculated variables are the first rows of their
+        # block, so they can be set to zero with one fill call
+        Records.BLOCK_VARS = {
+            'float_read': sorted(FLOAT_READ_VARS),
+            'int_read': sorted(Records.INTEGER_READ_VARS),
+            'float_calc': (sorted(FLOAT_CALCULATED_VARS) +
+                           sorted(FIXED_CALCULATED_VARS)),
+            'int_calc': sorted(INT_CALCULATED_VARS)
+        }
+        Records.VAR_BLOCK = {varname: blockname
+                             for blockname, varnames
+                             in Records.BLOCK_VARS.items()
+                             for varname in varnames}
         return vardict
 
     # specify various sets of variable names
@@ -299,6 +527,14 @@ class Records():
     CHANGING_CALCULATED_VARS = set()
     INTEGER_VARS = set()
 
+    # specify names of the variables in each block, the block of each
+    # variable, and the block types
+    BLOCK_VARS = dict()
+    VAR_BLOCK = dict()
+    BLOCK_DTYPES = {'float_read': np.float64, 'int_read': np.int32,
+                    'float_calc': np.float64, 'int_calc': np.int32}
+    READ_BLOCKS = frozenset(['float_read', 'int_read'])
+
     @staticmethod
     def read_cps_data():
         """
@@ -430,57 +666,39 @@ class Records():
             # Interest income
             self.e00300 *= self.ADJ['INT{}'.format(year)][self.agi_bin].values
 
-    def _read_data(self, data, exact_calcs):
+    def _read_data(self, data, exact_calcs, cache_dir):
         """
         Read Records data from file or use specified DataFrame as data.
         Specifies exact array depending on boolean value of exact_calcs.
+        Uses the input cache in cache_dir unless cache_dir is None.
         """
         # pylint: disable=too-many-statements,too-many-branches
         if Records.INTEGER_VARS == set():
             Records.read_var_info()
-        # read specified data
-        if isinstance(data, pd.DataFrame):
-            taxdf = data
-        elif isinstance(data, str):
-            if os.path.isfile(data):
-                taxdf = pd.read_csv(data)
-            else:  # find file in conda package
-                taxdf = read_egg_csv(data)  # pragma: no cover
+        # use the read-variable blocks in the input cache when the data
+        # file has been read before
+        cache_path = None
+        cached = None
+        if cache_dir is not None and isinstance(data, str) and \
+                os.path.isfile(data):
+            cache_path = Records._input_cache_path(cache_dir, data)
+            cached = Records._read_input_cache(cache_path)
+        if cached is not None:
+            read_blocks, read_vars, self.IGNORED_VARS = cached
+            self.__index = pd.RangeIndex(read_blocks['int_read'].shape[1])
         else:
-            msg = 'data is neither a string nor a Pandas DataFrame'
-            raise ValueError(msg)
-        self.__dim = len(taxdf.index)
-        self.__index = taxdf.index
-        # create class variables using taxdf column names
-        READ_VARS = set()
-        self.IGNORED_VARS = set()
-        for varname in list(taxdf.columns.values):
-            if varname in Records.USABLE_READ_VARS:
-                READ_VARS.add(varname)
-                if varname in Records.INTEGER_READ_VARS:
-                    setattr(self, varname,
-                            taxdf[varname].astype(np.int32).values)
-                else:
-                    setattr(self, varname,
-                            taxdf[varname].astype(np.float64).values)
-            else:
-                self.IGNORED_VARS.add(varname)
-        # check that MUST_READ_VARS are all present in taxdf
-        if not Records.MUST_READ_VARS.issubset(READ_VARS):
-            msg = 'Records data missing one or more MUST_READ_VARS'
-            raise ValueError(msg)
-        # delete intermediate taxdf object
-        del taxdf
-        # create other class variables that are set to all zeros
-        UNREAD_VARS = Records.USABLE_READ_VARS - READ_VARS
-        ZEROED_VARS = Records.CALCULATED_VARS | UNREAD_VARS
-        for varname in ZEROED_VARS:
-            if varname in Records.INTEGER_VARS:
-                setattr(self, varname,
-                        np.zeros(self.array_length, dtype=np.int32))
-            else:
-                setattr(self, varname,
-                        np.zeros(self.array_length, dtype=np.float64))
+            read_blocks, read_vars = self._parse_data(data)
+        self.__dim = len(self.__index)
+        # make the read variables rows of their blocks or the read-only
+        # arrays of zeros, leaving the calculated-variable blocks to be
+        # allocated when first used
+        self.__blocks = dict(read_blocks)
+        self.__block_vars = dict(Records.BLOCK_VARS)
+        self.__block_vars.update(read_vars)
+        self.__views = dict()
+        for blockname in Records.READ_BLOCKS:
+            self._attach_block(blockname)
+        self._attach_zeros()
         # check for valid MARS values
         if not np.all(np.logical_and(np.greater_equal(self.MARS, 1),
                                      np.less_equal(self.MARS, 5))):
@@ -494,19 +712,387 @@ class Records():
             raise ValueError('not all EIC values in [0,3] range')
         # specify value of exact array
         self.exact[:] = np.where(exact_calcs is True, 1, 0)
+        # store the read-variable blocks in the input cache
+        if cache_path is not None and cached is None:
+            Records._write_input_cache(cache_path, read_blocks, read_vars,
+                                       self.IGNORED_VARS)
+
+    def _parse_data(self, data):
+        """
+        Read Records data from file or use specified DataFrame as data,
+        returning tuple containing dictionary of the read-variable blocks,
+        whose rows are the read variables in the data, and dictionary of
+        lists of the names of those variables.
+        """
+        # CSV files are read straight into the blocks
+        if isinstance(data, str) and os.path.isfile(data) and \
+                not data.endswith(Records.COLUMNAR_FILE_SUFFIXES):
+            read_blocks, read_vars, self.IGNORED_VARS = \
+                Records._read_csv_data(data)
+            self.__index = pd.RangeIndex(read_blocks['int_read'].shape[1])
+            Records._check_must_read_vars(read_vars)
+            return read_blocks, read_vars
+        # read specified data
+        ignored_vars = set()
+        if isinstance(data, pd.DataFrame):
+            taxdf = data
+        elif isinstance(data, str):
+            if data.endswith(Records.COLUMNAR_FILE_SUFFIXES):
+                taxdf, ignored_vars = Records._read_columnar_data(data)
+            else:  # find file in conda package
+                taxdf = read_egg_csv(data)  # pragma: no cover
+        else:
+            msg = 'data is neither a string nor a Pandas DataFrame'
+            raise ValueError(msg)
+        self.__index = taxdf.index
+        # find read variables using taxdf column names
+        columns = list(taxdf.columns.values)
+        read_vars = Records._read_block_vars(columns)
+        self.IGNORED_VARS = ((set(columns) - Records.USABLE_READ_VARS) |
+                             ignored_vars)
+        Records._check_must_read_vars(read_vars)
+        # create blocks whose rows are the read variables
+        read_blocks = Records._empty_read_blocks(read_vars,
+                                                 len(taxdf.index))
+        Records._fill_read_blocks(read_blocks, read_vars, taxdf, 0)
         # delete intermediate variables
-        del READ_VARS
-        del UNREAD_VARS
-        del ZEROED_VARS
+        del taxdf
+        return read_blocks, read_vars
+
+    @staticmethod
+    def _read_block_vars(columns):
+        """
+        Return dictionary of lists of the names of the variables in the
+        columns list that are the rows of each read-variable block.
+        """
+        return {blockname: [varname
+                            for varname in Records.BLOCK_VARS[blockname]
+                            if varname in columns]
+                for blockname in Records.READ_BLOCKS}
+
+    @staticmethod
+    def _check_must_read_vars(read_vars):
+        """
+        Raise ValueError if the read_vars dictionary (see _read_block_vars)
+        does not include all the MUST_READ_VARS.
+        """
+        found = set()
+        for varnames in read_vars.values():
+            found.update(varnames)
+        if not Records.MUST_READ_VARS.issubset(found):
+            msg = 'Records data missing one or more MUST_READ_VARS'
+            raise ValueError(msg)
+
+    @staticmethod
+    def _empty_read_blocks(read_vars, num_rows):
+        """
+        Return dictionary of uninitialized read-variable blocks with the
+        rows specified in the read_vars dictionary and num_rows columns.
+        """
+        return {blockname: np.empty((len(varnames), num_rows),
+                                    dtype=Records.BLOCK_DTYPES[blockname])
+                for blockname, varnames in read_vars.items()}
+
+    @staticmethod
+    def _fill_read_blocks(read_blocks, read_vars, taxdf, start):
+        """
+        Copy the values of the read variables in the taxdf DataFrame into
+        the read_blocks columns beginning at the start column, raising
+        ValueError if a value of an integer variable is missing or is not
+        a whole number in the int32 range.
+        """
+        stop = start + len(taxdf.index)
+        int32 = np.iinfo(np.int32)
+        for blockname, varnames in read_vars.items():
+            block = read_blocks[blockname]
+            for idx, varname in enumerate(varnames):
+                values = taxdf[varname].values
+                if block.dtype.kind == 'i' and values.dtype.kind == 'f':
+                    with np.errstate(invalid='ignore'):
+                        valid = np.logical_and(
+                            np.logical_and(values >= int32.min,
+                                           values <= int32.max),
+                            np.equal(np.floor(values), values))
+                    if not np.all(valid):
+                        msg = ('integer variable {} has missing, non-integer '
+                               'or out-of-range values')
+                        raise ValueError(msg.format(varname))
+                elif block.dtype.kind == 'i' and \
+                        (values.min(initial=0) < int32.min or
+                         values.max(initial=0) > int32.max):
+                    msg = 'integer variable {} has out-of-range values'
+                    raise ValueError(msg.format(varname))
+                block[idx, start:stop] = values
+
+    @staticmethod
+    def _input_cache_path(cache_dir, path):
+        """
+        Return name of the directory in cache_dir that holds the
+        read-variable blocks for the data in the path file.  The name
+        begins with a hash of the absolute path of the file (see the
+        _write_input_cache method) followed by a hash of the file size and
+        modification time and of the block layout, so a changed file or a
+        changed set of Records variables never uses an old cache directory.
+        """
+        fstat = os.stat(path)
+        path_key = hashlib.sha256(os.path.abspath(path).encode('utf-8'))
+        layout = [Records.INPUT_CACHE_VERSION, fstat.st_size,
+                  fstat.st_mtime_ns,
+                  sorted(Records.BLOCK_VARS.items()),
+                  sorted((blockname, np.dtype(dtype).str) for blockname, dtype
+                         in Records.BLOCK_DTYPES.items())]
+        key = hashlib.sha256(repr(layout).encode('utf-8'))
+        return os.path.join(cache_dir, '{}-{}'.format(
+            path_key.hexdigest()[:16], key.hexdigest()[:16]))
+
+    @staticmethod
+    def _read_input_cache(cache_path):
+        """
+        Return tuple containing dictionary of the read-variable blocks in
+        the cache_path directory, which are memory-mapped copy-on-write so
+        that processes reading the same data share the unchanged memory,
+        dictionary of lists of the names of the variables that are the
+        rows of the blocks, and set of names of ignored variables, or
+        return None when the directory does not contain them.
+        """
+        if not os.path.isdir(cache_path):
+            return None
+        try:
+            blocks = dict()
+            for blockname in Records.READ_BLOCKS:
+                blocks[blockname] = np.asarray(np.load(
+                    os.path.join(cache_path, blockname + '.npy'),
+                    mmap_mode='c'))
+            with open(os.path.join(cache_path, 'variables.json')) as vfile:
+                variables = json.load(vfile)
+        except (OSError, ValueError):
+            return None
+        ignored_vars = set(variables.pop('ignored'))
+        return blocks, variables, ignored_vars
+
+    @staticmethod
+    def _write_input_cache(cache_path, blocks, block_vars, ignored_vars):
+        """
+        Write the blocks, the block_vars dictionary, and the ignored_vars
+        set to the cache_path directory, doing nothing if another process
+        has already done so, and remove the other cache directories for
+        the same data file, which hold the data of earlier versions of it.
+        """
+        # write to a temporary directory and rename it so that concurrent
+        # processes never see a partially written cache directory
+        tmppath = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            os.makedirs(tmppath, exist_ok=True)
+            for blockname, block in blocks.items():
+                np.save(os.path.join(tmppath, blockname + '.npy'), block)
+            variables = dict(block_vars)
+            variables['ignored'] = sorted(ignored_vars)
+            with open(os.path.join(tmppath, 'variables.json'), 'w') as vfile:
+                json.dump(variables, vfile)
+            os.rename(tmppath, cache_path)
+        except OSError:
+            shutil.rmtree(tmppath, ignore_errors=True)
+            return
+        cache_dir, dirname = os.path.split(cache_path)
+        path_prefix = dirname.split('-')[0] + '-'
+        for name in os.listdir(cache_dir):
+            if name.startswith(path_prefix) and name != dirname and \
+                    not name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(cache_dir, name),
+                              ignore_errors=True)
+
+    @staticmethod
+    def _read_csv_data(path):
+        """
+        Return tuple containing dictionary of the read-variable blocks
+        whose rows are the columns of the CSV file (which may be
+        compressed) that are USABLE_READ_VARS, dictionary of lists of the
+        names of those variables (see _read_block_vars), and the set of
+        names of the other columns, which are not parsed.  The columns are
+        parsed as float64 values, CSV_CHUNK_ROWS rows at a time, and each
+        chunk is copied into the blocks (see _fill_read_blocks), so the
+        parsed values of the whole file are never held in addition to the
+        blocks.
+        """
+        names = pd.read_csv(path, nrows=0).columns
+        usable = [name for name in names if name in Records.USABLE_READ_VARS]
+        ignored = set(names) - set(usable)
+        read_vars = Records._read_block_vars(usable)
+        num_rows = Records._count_csv_rows(path)
+        if num_rows is None:
+            chunks = [pd.read_csv(path, usecols=usable, dtype=np.float64)]
+            num_rows = len(chunks[0].index)
+        else:
+            chunks = pd.read_csv(path, usecols=usable, dtype=np.float64,
+                                 chunksize=Records.CSV_CHUNK_ROWS)
+        read_blocks = Records._empty_read_blocks(read_vars, num_rows)
+        start = 0
+        for chunk in chunks:
+            if start + len(chunk.index) > num_rows:
+                msg = 'CSV file {} has more rows than lines'
+                raise ValueError(msg.format(path))
+            Records._fill_read_blocks(read_blocks, read_vars, chunk, start)
+            start += len(chunk.index)
+        if start < num_rows:  # because the file contains blank lines
+            read_blocks = {blockname: np.ascontiguousarray(block[:, :start])
+                           for blockname, block in read_blocks.items()}
+        return read_blocks, read_vars, ignored
+
+    @staticmethod
+    def _count_csv_rows(path):
+        """
+        Return number of lines after the header line in the CSV file,
+        which may be uncompressed or compressed by gzip, bz2, or xz, or
+        return None for a file compressed in another way.
+        """
+        openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+        suffix = os.path.splitext(path)[1].lower()
+        if suffix in ('.zip', '.zst', '.tar'):
+            return None
+        num_lines = 0
+        last = b'\n'
+        with openers.get(suffix, open)(path, 'rb') as cfile:
+            for chunk in iter(lambda: cfile.read(1 << 20), b''):
+                num_lines += chunk.count(b'\n')
+                last = chunk[-1:]
+        if last != b'\n':
+            num_lines += 1
+        return max(num_lines - 1, 0)
+
+    @staticmethod
+    def _read_columnar_data(path):
+        """
+        Return Pandas DataFrame containing the columns of the Parquet,
+        Feather, or Arrow IPC file that are USABLE_READ_VARS, and the set
+        of names of the other columns, which are not read from the file.
+        The columns are converted to the int32 or float64 type of their
+        Records variables while they are read.  Reading these files
+        requires the pyarrow package.
+        """
+        # pylint: disable=import-outside-toplevel
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+            import pyarrow.feather
+        except ImportError:
+            msg = 'reading {} requires the pyarrow package'
+            raise ValueError(msg.format(path))
+        if not os.path.isfile(path):
+            raise ValueError('file {} could not be found'.format(path))
+        if path.endswith('.parquet'):
+            names = pyarrow.parquet.read_schema(path).names
+        else:
+            with pyarrow.memory_map(path, 'r') as source:
+                names = pyarrow.ipc.open_file(source).schema.names
+        usable = [name for name in names if name in Records.USABLE_READ_VARS]
+        if path.endswith('.parquet'):
+            table = pyarrow.parquet.read_table(path, columns=usable)
+        else:
+            table = pyarrow.feather.read_table(path, columns=usable)
+        schema = pyarrow.schema(
+            [(name, pyarrow.int32() if name in Records.INTEGER_READ_VARS
+              else pyarrow.float64()) for name in usable]
+        )
+        taxdf = table.cast(schema, safe=False).to_pandas()
+        return taxdf, set(names) - set(usable)
 
     def zero_out_changing_calculated_vars(self):
         """
         Set to zero all variables in the Records.CHANGING_CALCULATED_VARS set.
         """
-        for varname in Records.CHANGING_CALCULATED_VARS:
-            var = getattr(self, varname)
-            var.fill(0.)
-        del var
+        num_changing = len(Records.CHANGING_CALCULATED_VARS)
+        if 'float_calc' in self.__blocks:
+            self.__blocks['float_calc'][:num_changing].fill(0.)
+        attached = self._attached_vars()
+        for varname in Records.CHANGING_CALCULATED_VARS - attached:
+            if varname in self.__dict__:
+                getattr(self, varname).fill(0.)
+
+    def __getattr__(self, name):
+        """
+        Return the array of the named calculated variable after allocating
+        the block of calculated variables that contains it, which is done
+        only when one of the variables in the block is first used.  (This
+        method is called only when this object has no name attribute.)
+        """
+        blocks = self.__dict__.get('_Records__blocks')
+        blockname = Records.VAR_BLOCK.get(name)
+        if blocks is None or blockname is None or blockname in blocks:
+            msg = "'Records' object has no attribute '{}'"
+            raise AttributeError(msg.format(name))
+        varnames = self.__block_vars[blockname]
+        blocks[blockname] = np.zeros((len(varnames), self.__dim),
+                                     dtype=Records.BLOCK_DTYPES[blockname])
+        # variables that were set before the block was allocated are not
+        # rows of the block
+        self._attach_block(blockname, set(varnames) - set(self.__dict__))
+        return self.__dict__[name]
+
+    def _attach_block(self, blockname, attached=None):
+        """
+        Make each row of the named block the array of its variable, or
+        only of the variables in the attached set when it is not None.
+        """
+        block = self.__blocks[blockname]
+        for idx, varname in enumerate(self.__block_vars[blockname]):
+            view = block[idx]
+            self.__views[varname] = view
+            if attached is None or varname in attached:
+                setattr(self, varname, view)
+
+    def _attach_zeros(self, unread=None):
+        """
+        Make a read-only array of zeros the array of each read variable
+        that is not a row of its block, or only of the variables in the
+        unread set when it is not None.
+        """
+        self.__zeros = dict()
+        for blockname in Records.READ_BLOCKS:
+            zeros = np.zeros(self.__dim, dtype=Records.BLOCK_DTYPES[blockname])
+            zeros.setflags(write=False)
+            self.__zeros[blockname] = zeros
+            for varname in Records.BLOCK_VARS[blockname]:
+                if varname in self.__views:
+                    continue
+                if unread is None or varname in unread:
+                    setattr(self, varname, zeros)
+
+    def _is_unread(self, varname):
+        """
+        Return True when the array of the named variable is the read-only
+        array of zeros of a read variable not in the input data.
+        """
+        zeros = self.__zeros.get(Records.VAR_BLOCK.get(varname))
+        return zeros is not None and self.__dict__.get(varname) is zeros
+
+    def _unread_vars(self):
+        """
+        Return set of names of the variables whose arrays are read-only
+        arrays of zeros.
+        """
+        return set(varname for varname in Records.USABLE_READ_VARS
+                   if self._is_unread(varname))
+
+    def _attached_vars(self):
+        """
+        Return set of names of the variables whose arrays are rows of
+        their blocks.
+        """
+        return set(varname for varname, view in self.__views.items()
+                   if self.__dict__.get(varname) is view)
+
+    def _unshare_block(self, blockname):
+        """
+        Replace the named block, which is shared with a copy of this
+        object, with a copy of it, so that the variables that are rows of
+        the block can be changed in place without changing the other object.
+        """
+        attached = self._attached_vars()
+        self.__blocks[blockname] = self.__blocks[blockname].copy()
+        self._attach_block(blockname, attached)
+        self.__shared_vars -= attached & set(self.__block_vars[blockname])
+        self.__shared_blocks.discard(blockname)
 
     def _read_weights(self, weights):
         """
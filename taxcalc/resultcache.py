@@ -0,0 +1,174 @@
+"""
+Tax-Calculator ResultCache class that stores Calculator.calc_all results.
+"""
+# CODING-STYLE CHECKS:
+# pycodestyle resultcache.py
+# pylint --disable=locally-disabled resultcache.py
+
+import os
+import hashlib
+import threading
+import collections
+import numpy as np
+from taxcalc.records import Records
+
+
+def calc_all_fingerprint(policy, records, consumption):
+    """
+    Return hexadecimal string that is a hash of everything the results of
+    the Calculator.calc_all method depend on: the current_year, the values
+    of the Records read variables (which include the current-year weights
+    and the data extrapolated to the current_year), the values of the
+    Records calculated variables that calc_all reads but does not change
+    (such as exact, which is specified by the exact_calculations argument
+    of the Calculator class constructor), the current-year values of the
+    Policy parameters, and the current-year values of the Consumption
+    parameters.  The values of the other Records calculated variables are
+    not hashed because calc_all overwrites all of them.
+    """
+    key = hashlib.sha256()
+    key.update('{}:{}'.format(records.current_year,
+                              records.array_length).encode('utf-8'))
+    unchanged_vars = (Records.USABLE_READ_VARS |
+                      (Records.CALCULATED_VARS -
+                       Records.CHANGING_CALCULATED_VARS))
+    for varname in sorted(unchanged_vars):
+        arr = np.ascontiguousarray(getattr(records, varname))
+        key.update('{}:{}'.format(varname, arr.dtype.str).encode('utf-8'))
+        key.update(arr.view(np.uint8))
+    for params in (policy, consumption):
+        key.update(type(params).__name__.encode('utf-8'))
+        for name in sorted(params._vals):  # pylint: disable=protected-access
+            value = np.asarray(getattr(params, name[1:])).tolist()
+            key.update('{}={!r}'.format(name, value).encode('utf-8'))
+    return key.hexdigest()
+
+
+class ResultCache():
+    """
+    Constructor for the ResultCache class, which stores the values of the
+    Records calculated variables produced by Calculator.calc_all calls,
+    keyed by the calc_all_fingerprint of the calc_all inputs, so that a
+    later calc_all call with the same inputs (for example, the current-law
+    baseline of every reform comparison) copies the stored values instead
+    of doing the tax calculations.  A ResultCache object is used by a
+    Calculator object constructed with it as the cache argument, and can
+    be used by many Calculator objects, including ones in different
+    threads.
+
+    Parameters
+    ----------
+    max_entries: integer
+        maximum number of results held in memory, where the least recently
+        used result is discarded when the maximum is exceeded; default
+        value is four.
+
+    cache_dir: string or None
+        name of a directory in which each result is also written to a
+        compressed NumPy file named by its fingerprint, so results are
+        available to later processes; default value is None, which implies
+        results are held only in memory.
+
+    Raises
+    ------
+    ValueError:
+        if max_entries is not a positive integer or cache_dir is not None
+        or the name of an existing directory.
+
+    Returns
+    -------
+    class instance: ResultCache
+    """
+
+    FILE_SUFFIX = '.npz'
+
+    def __init__(self, max_entries=4, cache_dir=None):
+        if not isinstance(max_entries, int) or max_entries < 1:
+            raise ValueError('max_entries must be a positive integer')
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            msg = 'cache_dir {} is not an existing directory'
+            raise ValueError(msg.format(cache_dir))
+        self.__max_entries = max_entries
+        self.__cache_dir = cache_dir
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __deepcopy__(self, memo):
+        """
+        Return this object, so that a deep copy of a Calculator object
+        uses the same ResultCache object as the original.
+        """
+        return self
+
+    def __len__(self):
+        """
+        Return number of results held in memory.
+        """
+        return len(self.__entries)
+
+    def get(self, fingerprint):
+        """
+        Return dictionary of calculated variable arrays stored under the
+        fingerprint, or None if there is no such result.  The returned
+        arrays must not be changed.
+        """
+        with self.__lock:
+            result = self.__entries.get(fingerprint)
+            if result is not None:
+                self.__entries.move_to_end(fingerprint)
+        if result is None and self.__cache_dir is not None:
+            path = self._path(fingerprint)
+            if os.path.isfile(path):
+                with np.load(path) as npz:
+                    result = {name: npz[name] for name in npz.files}
+                self._remember(fingerprint, result)
+        with self.__lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, fingerprint, arrays):
+        """
+        Store copies of the arrays in the arrays dictionary, which maps
+        calculated variable names to their values, under the fingerprint.
+        """
+        result = {name: np.array(arr) for name, arr in arrays.items()}
+        self._remember(fingerprint, result)
+        if self.__cache_dir is not None:
+            path = self._path(fingerprint)
+            # write to a temporary file and rename it so that concurrent
+            # processes never see a partially written result file
+            tmppath = '{}.{}.{}.tmp{}'.format(path, os.getpid(),
+                                              threading.get_ident(),
+                                              ResultCache.FILE_SUFFIX)
+            np.savez_compressed(tmppath, **result)
+            os.replace(tmppath, path)
+
+    def clear(self):
+        """
+        Discard all results held in memory (but not those in cache_dir).
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def _remember(self, fingerprint, result):
+        """
+        Hold the result in memory, discarding the least recently used
+        results when there are more than max_entries results.
+        """
+        with self.__lock:
+            self.__entries[fingerprint] = result
+            self.__entries.move_to_end(fingerprint)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+    def _path(self, fingerprint):
+        """
+        Return name of the file in cache_dir holding the result.
+        """
+        return os.path.join(self.__cache_dir,
+                            fingerprint + ResultCache.FILE_SUFFIX)
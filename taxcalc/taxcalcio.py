@@ -7,7 +7,6 @@ Tax-Calculator Input-Output class.
 
 import os
 import gc
-import copy
 import sqlite3
 import numpy as np
 import pandas as pd
@@ -16,7 +15,7 @@ from taxcalc.records import Records
 from taxcalc.consumption import Consumption
 from taxcalc.growdiff import GrowDiff
 from taxcalc.growfactors import GrowFactors
-from taxcalc.calculator import Calculator
+from taxcalc.calculator import Calculator, CalculatorPair
 from taxcalc.utils import (delete_file, write_graph_file,
                            add_quantile_table_row_variable,
                            unweighted_sum, weighted_sum)
@@ -63,6 +62,9 @@ class TaxCalcIO():
     """
     # pylint: disable=too-many-instance-attributes
 
+    # calculated variables written by the minimal_output method
+    MINIMAL_OUTPUT_VARIABLES = ['iitax', 'lumpsum_tax', 'payrolltax']
+
     def __init__(self, input_data, tax_year, baseline, reform, assump,
                  outdir=None):
         # pylint: disable=too-many-arguments,too-many-locals
@@ -75,14 +77,16 @@ class TaxCalcIO():
         if isinstance(input_data, str):
             # remove any leading directory path from INPUT filename
             fname = os.path.basename(input_data)
-            # check if fname ends with ".csv"
-            if fname.endswith('.csv'):
-                inp = '{}-{}'.format(fname[:-4], str(tax_year)[2:])
+            # check if fname ends with ".csv" or a columnar file suffix
+            froot, fext = os.path.splitext(fname)
+            if fext in ('.csv',) + Records.COLUMNAR_FILE_SUFFIXES:
+                inp = '{}-{}'.format(froot, str(tax_year)[2:])
             else:
-                msg = 'INPUT file name does not end in .csv'
+                msg = 'INPUT file name does not end in .csv, {}'.format(
+                    ', '.join(Records.COLUMNAR_FILE_SUFFIXES))
                 self.errmsg += 'ERROR: {}\n'.format(msg)
             # check existence of INPUT file
-            self.puf_input_data = input_data.endswith('puf.csv')
+            self.puf_input_data = froot.endswith('puf')
             self.cps_input_data = input_data.endswith('cps.csv')
             if not self.cps_input_data and not os.path.isfile(input_data):
                 msg = 'INPUT file could not be found'
@@ -304,28 +308,34 @@ class TaxCalcIO():
         # set policy to tax_year
         pol.set_year(tax_year)
         base.set_year(tax_year)
-        # read input file contents into Records objects
+        # read input file contents into Records objects, where the
+        # baseline and reform Calculator objects share one Records object
+        # (see the CalculatorPair class) unless the growdiff_response
+        # assumptions make the reform data differ from the baseline data
+        share_records = not gdiff_response.has_any_response()
         if aging_input_data:
             if self.cps_input_data:
                 recs = Records.cps_constructor(
                     gfactors=gfactors_ref,
                     exact_calculations=exact_calculations
                 )
-                recs_base = Records.cps_constructor(
-                    gfactors=gfactors_base,
-                    exact_calculations=exact_calculations
-                )
+                if not share_records:
+                    recs_base = Records.cps_constructor(
+                        gfactors=gfactors_base,
+                        exact_calculations=exact_calculations
+                    )
             else:  # if not cps_input_data but aging_input_data
                 recs = Records(
                     data=input_data,
                     gfactors=gfactors_ref,
                     exact_calculations=exact_calculations
                 )
-                recs_base = Records(
-                    data=input_data,
-                    gfactors=gfactors_base,
-                    exact_calculations=exact_calculations
-                )
+                if not share_records:
+                    recs_base = Records(
+                        data=input_data,
+                        gfactors=gfactors_base,
+                        exact_calculations=exact_calculations
+                    )
         else:  # input_data are raw data that are not being aged
             recs = Records(data=input_data,
                            gfactors=None,
@@ -333,20 +343,29 @@ class TaxCalcIO():
                            weights=None,
                            adjust_ratios=None,
                            start_year=tax_year)
-            recs_base = copy.deepcopy(recs)
+            share_records = True
         if tax_year < recs.data_year:
             msg = 'tax_year {} less than records.data_year {}'
             msg = msg.format(tax_year, recs.data_year)
             self.errmsg += 'ERROR: {}\n'.format(msg)
         # create Calculator objects
-        self.calc = Calculator(policy=pol, records=recs,
-                               verbose=True,
-                               consumption=con,
-                               sync_years=aging_input_data)
-        self.calc_base = Calculator(policy=base, records=recs_base,
-                                    verbose=False,
-                                    consumption=con,
-                                    sync_years=aging_input_data)
+        if share_records:
+            pair = CalculatorPair(baseline_policy=base, reform_policy=pol,
+                                  records=recs,
+                                  verbose=True,
+                                  consumption=con,
+                                  sync_years=aging_input_data)
+            self.calc = pair.reform
+            self.calc_base = pair.baseline
+        else:
+            self.calc = Calculator(policy=pol, records=recs,
+                                   verbose=True,
+                                   consumption=con,
+                                   sync_years=aging_input_data)
+            self.calc_base = Calculator(policy=base, records=recs_base,
+                                        verbose=False,
+                                        consumption=con,
+                                        sync_years=aging_input_data)
 
     def custom_dump_variables(self, tcdumpvars_str):
         """
@@ -437,7 +456,12 @@ class TaxCalcIO():
                             'CONTINUING WITH CALCULATIONS...')
             )
         calc_base_calculated = False
-        self.calc.calc_all()
+        if writing_output_file and not (output_dump or output_sqldb or
+                                        output_tables or output_graphs):
+            # only the minimal output variables are needed
+            self.calc.calc_all(outputs=TaxCalcIO.MINIMAL_OUTPUT_VARIABLES)
+        else:
+            self.calc.calc_all()
         if output_dump or output_sqldb:
             # might need marginal tax rates
             (mtr_paytax, mtr_inctax,
@@ -161,3 +161,18 @@ def test_function_args_usage(tests_path):
                 msg += 'FUNCTION,ARGUMENT= {} {}\n'.format(fname, arg)
     if found_error:
         raise ValueError(msg)
+
+
+def test_typed_signatures():
+    """
+    Test that the argument types of every function decorated by iterate_jit
+    are specified in the records_variables.json and policy_current_law.json
+    files, so that each function is compiled by the precompile function.
+    """
+    # pylint: disable=import-error
+    from taxcalc import calcfunctions
+    from taxcalc.decorators import argument_signature
+    for name, obj in vars(calcfunctions).items():
+        if hasattr(obj, 'compile_typed'):
+            args = obj.out_args + obj.in_args
+            assert argument_signature(args) is not None, name
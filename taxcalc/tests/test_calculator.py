@@ -13,7 +13,9 @@ import copy
 import pytest
 import numpy as np
 import pandas as pd
-from taxcalc import Policy, Records, Calculator, Consumption
+from taxcalc import Policy, Records, Calculator, Consumption, precompile
+from taxcalc import sweep, CalculatorPair
+from taxcalc.calculator import CALC_ALL_STAGES, recalc_stages, output_stages
 
 
 def test_make_calculator(cps_subsample):
@@ -174,6 +176,37 @@ def test_calculator_mtr(cps_subsample):
     assert np.allclose(calc.array('c00100'), c00100x)
 
 
+def test_calculator_mtrs(cps_subsample):
+    """
+    Test Calculator mtrs method gives the same results as mtr method.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    consump = Consumption()
+    consump.update_consumption({2013: {'_MPC_e17500': [0.2]}})
+    calc1 = Calculator(policy=Policy(), records=rec, consumption=consump)
+    calc2 = Calculator(policy=Policy(), records=rec, consumption=consump)
+    variables = ['e00200p', 'e00200s', 'e00650', 'p23250', 'e19800']
+    expect = dict()
+    for variable_str in variables:
+        expect[variable_str] = calc1.mtr(variable_str=variable_str)
+    for num_workers in [1, 2]:
+        mtrs = calc2.mtrs(variables, num_workers=num_workers)
+        assert sorted(mtrs.keys()) == sorted(variables)
+        for variable_str in variables:
+            for ans, exp in zip(mtrs[variable_str], expect[variable_str]):
+                assert np.allclose(ans, exp, equal_nan=True)
+        for varname in Records.CALCULATED_VARS:
+            assert np.array_equal(calc2.array(varname),
+                                  calc1.array(varname))
+        assert np.array_equal(calc2.array('e17500'), calc1.array('e17500'))
+    with pytest.raises(ValueError):
+        calc2.mtrs('e00200p')
+    with pytest.raises(ValueError):
+        calc2.mtrs(['bad_income_type'])
+    with pytest.raises(ValueError):
+        calc2.mtrs(variables, num_workers=0)
+
+
 def test_calculator_mtr_when_PT_rates_differ():
     """
     Test Calculator mtr method in special case.
@@ -835,6 +868,12 @@ def test_diagnostic_table(cps_subsample):
     calc = Calculator(policy=Policy(), records=recs)
     adt = calc.diagnostic_table(3)
     assert isinstance(adt, pd.DataFrame)
+    assert list(adt.columns) == [2014, 2015, 2016]
+    assert calc.current_year == 2014
+    adt2 = calc.diagnostic_table(3, num_workers=2)
+    assert adt2.equals(adt)
+    with pytest.raises(ValueError):
+        calc.diagnostic_table(3, num_workers=0)
 
 
 def test_mtr_graph(cps_subsample):
@@ -991,3 +1030,300 @@ def test_itemded_component_amounts(year, cvname, hcname, puf_fullsample):
         txt = '\n{}={:.3f}  !=  {:.3f}=difference_in_total_itemized_deductions'
         msg = txt.format(cvname, component_amt, difference_in_total_itmded)
         raise ValueError(msg)
+
+
+def test_precompile():
+    """
+    Test precompile function in both foreground and background modes.
+    """
+    assert precompile() is None
+    thread = precompile(background=True)
+    thread.join()
+    assert not thread.is_alive()
+
+
+def test_calc_all_outputs(cps_subsample):
+    """
+    Test that calc_all with outputs gives those outputs their full values.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    pol = Policy()
+    pol.implement_reform({2018: {'_ID_BenefitSurtax_crt': [0.1]}})
+    full = Calculator(policy=pol, records=rec)
+    full.advance_to_year(2018)
+    full.calc_all()
+    names = [stage[0] for stage in CALC_ALL_STAGES]
+    payroll_stages = output_stages(['payrolltax'])
+    assert names.index('EI_PayrollTax') in payroll_stages
+    assert names.index('IITAX') not in payroll_stages
+    for outputs in (['payrolltax'], ['iitax', 'lumpsum_tax', 'payrolltax']):
+        calc = Calculator(policy=pol, records=rec)
+        calc.advance_to_year(2018)
+        calc.calc_all(outputs=outputs)
+        for vname in outputs:
+            assert np.array_equal(calc.array(vname), full.array(vname))
+    assert np.all(calc.array('aftertax_income') == 0.)
+    with pytest.raises(ValueError):
+        calc.calc_all(outputs=['unknown_variable'])
+
+
+def test_calculator_pair(cps_subsample):
+    """
+    Test that CalculatorPair gives the results of separate Calculators.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    base = Policy()
+    pol = Policy()
+    pol.implement_reform({2018: {'_II_em': [1000]}})
+    pair = CalculatorPair(baseline_policy=base, reform_policy=pol,
+                          records=rec)
+    pair.advance_to_year(2018)
+    pair.calc_all()
+    calc1 = Calculator(policy=base, records=rec)
+    calc2 = Calculator(policy=pol, records=rec)
+    for calc in (calc1, calc2):
+        calc.advance_to_year(2018)
+        calc.calc_all()
+    assert pair.current_year == 2018
+    assert pair.reform.current_year == 2018
+    assert pair.baseline.array('e00200') is pair.reform.array('e00200')
+    assert pair.baseline.array('iitax') is not pair.reform.array('iitax')
+    assert np.allclose(pair.baseline.array('iitax'), calc1.array('iitax'))
+    assert np.allclose(pair.reform.array('iitax'), calc2.array('iitax'))
+    with pytest.raises(ValueError):
+        pair.advance_to_year(2017)
+    pol.set_year(2019)
+    with pytest.raises(ValueError):
+        CalculatorPair(baseline_policy=base, reform_policy=pol, records=rec)
+
+
+def test_shared_read_variables_are_read_only(cps_subsample):
+    """
+    Test that changing a read variable in place through one Calculator
+    object does not change it in another or in the Records object.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    e00200 = rec.e00200.copy()
+    calc1 = Calculator(policy=Policy(), records=rec)
+    calc2 = Calculator(policy=Policy(), records=rec)
+    with pytest.raises(ValueError):
+        calc1.array('e00200')[:] *= 2.
+    with pytest.raises(ValueError):
+        rec.e00200[:] *= 2.
+    calc1.array('e00200', calc1.array('e00200') * 2.)
+    rec.writable_array('e00200')[:] *= 3.
+    assert np.allclose(calc1.array('e00200'), e00200 * 2.)
+    assert np.allclose(calc2.array('e00200'), e00200)
+    assert np.allclose(rec.e00200, e00200 * 3.)
+
+
+def test_sweep(cps_subsample):
+    """
+    Test sweep function against separate Calculator objects.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    reforms = [dict(), {2018: {'_II_em': [1000]}}]
+    years = [2018, 2019]
+    outputs = ['iitax', 'combined']
+    expect = list()
+    for reform in reforms:
+        for year in years:
+            pol = Policy()
+            pol.implement_reform(reform)
+            calc = Calculator(policy=pol, records=rec)
+            calc.advance_to_year(year)
+            calc.calc_all()
+            expect.append([calc.weighted_total(v) for v in outputs])
+    for num_workers in (1, 2):
+        sdf = sweep(reforms, rec, years, outputs, num_workers=num_workers)
+        assert list(sdf.index) == [(0, 2018), (0, 2019),
+                                   (1, 2018), (1, 2019)]
+        assert list(sdf.columns) == outputs
+        assert np.allclose(sdf.values, np.array(expect))
+    assert rec.current_year == 2014
+    with pytest.raises(ValueError):
+        sweep(dict(), rec, years, outputs)
+    with pytest.raises(ValueError):
+        sweep(reforms, rec, [2013], outputs)
+
+
+def test_fused_calc_one_year(cps_subsample):
+    """
+    Test that fused and unfused tax calculations give identical results.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    pol = Policy()
+    pol.implement_reform({2018: {'_II_em': [1000],
+                                 '_ID_Medical_frt': [0.05],
+                                 '_ID_Charity_c': [[1000, 2000, 1000,
+                                                    1000, 2000]]}})
+    calc1 = Calculator(policy=pol, records=rec)
+    calc2 = Calculator(policy=pol, records=rec, fused=True)
+    for calc in (calc1, calc2):
+        calc.advance_to_year(2018)
+        calc.calc_all()
+    assert calc1.weighted_total('c04470') > 0.
+    for varname in Records.CALCULATED_VARS:
+        assert np.array_equal(calc1.array(varname), calc2.array(varname))
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_num_threads(fused, cps_subsample):
+    """
+    Test that multi-threaded and single-threaded tax calculations give
+    identical results.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    pol = Policy()
+    calc1 = Calculator(policy=pol, records=rec, num_threads=1)
+    calc2 = Calculator(policy=pol, records=rec, fused=fused, num_threads=2)
+    for calc in (calc1, calc2):
+        calc.calc_all()
+    for varname in Records.CALCULATED_VARS:
+        assert np.array_equal(calc1.array(varname), calc2.array(varname))
+    with pytest.raises(ValueError):
+        Calculator(policy=pol, records=rec, num_threads=0)
+
+
+def test_timings(cps_subsample):
+    """
+    Test that the timings method reports calls of the tax-calculation
+    functions only when timing is enabled.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    pol = Policy()
+    pol.implement_reform({2018: {'_ID_BenefitSurtax_crt': [0.5]}})
+    calc1 = Calculator(policy=pol, records=rec)
+    calc2 = Calculator(policy=pol, records=rec, timing=True)
+    for calc in (calc1, calc2):
+        calc.advance_to_year(2018)
+        calc.calc_all()
+    assert calc1.timings().empty
+    tdf = calc2.timings()
+    assert list(tdf.columns) == ['calls', 'records', 'seconds']
+    assert tdf.index[0] == 'calc_all'
+    assert tdf.loc['calc_all', 'calls'] == 1
+    assert tdf.loc['ComputeBenefit', 'calls'] == 1
+    assert tdf.loc['BenefitPrograms', 'records'] == calc2.array_len
+    # ComputeBenefit makes the standard-vs-itemized deduction choice again
+    assert tdf.loc['deduction_choice', 'calls'] == 2
+    assert 'GainsTax' not in tdf.index
+    assert tdf['seconds'].is_monotonic_decreasing
+    calc2.calc_all()
+    assert calc2.timings().loc['calc_all', 'calls'] == 2
+    for varname in Records.CALCULATED_VARS:
+        assert np.array_equal(calc1.array(varname), calc2.array(varname))
+
+
+def test_shared_benefit_counterfactual(cps_subsample):
+    """
+    Test that BenefitSurtax and BenefitLimitation share the calculation
+    of taxes without itemized deductions when their switches match.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    reform = {2018: {'_ID_BenefitSurtax_crt': [0.5],
+                     '_ID_BenefitCap_rt': [0.3]}}
+    switch = [[False, True, True, False, False, False, False]]
+    calls = list()
+    for cap_switch in [None, switch]:
+        pol = Policy()
+        pol.implement_reform(reform)
+        if cap_switch is not None:
+            pol.implement_reform({2018: {'_ID_BenefitCap_Switch':
+                                         cap_switch}})
+        calc = Calculator(policy=pol, records=rec, timing=True)
+        calc.advance_to_year(2018)
+        calc.calc_all()
+        calls.append(calc.timings().loc['deduction_choice', 'calls'])
+        combined = calc.array('combined').copy()
+        calc.calc_all()
+        assert np.array_equal(calc.array('combined'), combined)
+    assert calls == [2, 3]
+
+
+def test_recalc(cps_subsample):
+    """
+    Test that recalc gives the same results as calc_all for a Calculator
+    object with the same policy.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    pol = Policy()
+    pol.implement_reform({2018: {'_ID_BenefitCap_rt': [0.5]}})
+    calc = Calculator(policy=pol, records=rec)
+    calc.advance_to_year(2018)
+    calc.calc_all()
+    calc.recalc([])
+    changes = [{'II_rt7': 0.45}, {'FST_AGI_trt': 0.3}, {'CTC_c': 1500.},
+               {'ID_BenefitCap_rt': 1.}, {'_AGI_surtax_trt': 0.1}]
+    reform = dict()
+    for change in changes:
+        for pname, pvalue in change.items():
+            calc.policy_param(pname.lstrip('_'), pvalue)
+            reform['_' + pname.lstrip('_')] = [pvalue]
+        calc.recalc(list(change.keys()))
+        pol = Policy()
+        pol.implement_reform({2018: {'_ID_BenefitCap_rt': [0.5]}})
+        pol.implement_reform({2018: reform})
+        full_calc = Calculator(policy=pol, records=rec)
+        full_calc.advance_to_year(2018)
+        full_calc.calc_all()
+        for varname in Records.CALCULATED_VARS:
+            assert np.array_equal(calc.array(varname),
+                                  full_calc.array(varname))
+    with pytest.raises(ValueError):
+        calc.recalc(['no_such_name'])
+
+
+def test_recalc_stages():
+    """
+    Test that recalc_stages redoes only the stages downstream of a change.
+    """
+    stages = recalc_stages({'FST_AGI_trt'})
+    names = [CALC_ALL_STAGES[idx][0] for idx, _ in stages]
+    assert names == ['FairShareTax', 'LumpSumTax', 'AfterTaxIncome']
+    restored = stages[0][1]
+    blim = [stage[0] for stage in CALC_ALL_STAGES].index('BenefitLimitation')
+    assert sorted(restored) == [('combined', blim), ('fstax', None),
+                                ('iitax', blim), ('surtax', blim)]
+    assert len(recalc_stages(None)) == len(CALC_ALL_STAGES)
+
+
+def test_calc_scenarios(cps_subsample):
+    """
+    Test that calc_scenarios gives the same results as separate Calculator
+    objects for each policy.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    policies = list()
+    for rate in [0.37, 0.45, 0.55]:
+        pol = Policy()
+        pol.implement_reform({2018: {'_II_rt7': [rate],
+                                     '_ID_Medical_frt': [rate / 5.]}})
+        policies.append(pol)
+    varlist = ['iitax', 'c04470', 'standard', 'aftertax_income']
+    calc = Calculator(policy=Policy(), records=rec)
+    calc.advance_to_year(2019)
+    results = calc.calc_scenarios(policies, varlist)
+    for idx, pol in enumerate(policies):
+        assert pol.current_year == Policy.JSON_START_YEAR
+        pcalc = Calculator(policy=pol, records=rec)
+        pcalc.advance_to_year(2019)
+        pcalc.calc_all()
+        for varname in varlist:
+            assert results[varname].shape == (len(policies), calc.array_len)
+            assert np.array_equal(results[varname][idx],
+                                  pcalc.array(varname))
+    assert not np.allclose(results['iitax'][0], results['iitax'][2])
+    # test invalid calc_scenarios arguments
+    with pytest.raises(ValueError):
+        calc.calc_scenarios([], varlist)
+    with pytest.raises(ValueError):
+        calc.calc_scenarios([rec], varlist)
+    pol = Policy()
+    pol.implement_reform({2018: {'_ID_BenefitSurtax_crt': [0.02]}})
+    with pytest.raises(ValueError):
+        calc.calc_scenarios([pol], varlist)
+    pol = Policy()
+    pol.implement_reform({2018: {'_BEN_snap_repeal': [True]}})
+    with pytest.raises(ValueError):
+        calc.calc_scenarios([pol], varlist)
@@ -5,6 +5,7 @@ import os
 import sys
 import pytest
 import importlib
+import numba
 import numpy as np
 from pandas import DataFrame
 from pandas.util.testing import assert_frame_equal
@@ -30,6 +31,16 @@ def test_create_apply_function_string_with_params():
     assert ans == exp
 
 
+def test_create_apply_function_string_parallel():
+    ans = create_apply_function_string(['a', 'b'], ['d', 'e'], ['d'],
+                                       parallel=True)
+    exp = ("def ap_func(x_0,x_1,x_2,x_3):\n"
+           "  for i in prange(len(x_0)):\n"
+           "    x_0[i],x_1[i] = jitted_f(x_2,x_3[i])\n"
+           "  return x_0,x_1\n")
+    assert ans == exp
+
+
 def test_create_toplevel_function_string_mult_outputs():
     ans = create_toplevel_function_string(['a', 'b'], ['d', 'e'],
                                           ['pm', 'pm', 'pf', 'pm'])
@@ -330,3 +341,419 @@ def test_force_no_jit():
     # restore normal JIT operation of decorators module
     del os.environ['NOTAXCALCJIT']
     importlib.reload(taxcalc.decorators)
+
+
+@iterate_jit(nopython=True)
+def Magic_calc7(x, y, z):
+    a = x + y
+    b = a + z
+    return (a, b)
+
+
+def test_argument_signature():
+    """
+    Test that argument types match the types of Records and Policy values.
+    """
+    types = argument_types()
+    assert types['MARS'] == numba.types.int32[::1]
+    assert types['e00200'] == numba.types.float64[::1]
+    assert types['II_rt1'] == numba.types.float64
+    assert types['STD'] == numba.types.float64[::1]
+    assert types['EITC_indiv'] == numba.types.boolean
+    assert types['ID_BenefitSurtax_Switch'] == numba.types.boolean[::1]
+    pol = taxcalc.Policy()
+    rec = taxcalc.Records(data=DataFrame({'RECID': [1], 'MARS': [1]}),
+                          start_year=pol.current_year,
+                          gfactors=None, weights=None)
+    # inputs are passed as read-only views, whether or not the array is
+    # writable (e00200 is not in the data, so its array is read-only), and
+    # outputs are passed unchanged
+    for name in ['MARS', 'e00200', 'iitax']:
+        value = kernel_argument(getattr(rec, name))
+        assert np.shares_memory(value, getattr(rec, name))
+        assert numba.typeof(value) == argument_signature([name])[0]
+    value = kernel_argument(rec.iitax, output=True)
+    assert value is rec.iitax
+    assert numba.typeof(value) == argument_signature(['iitax'], ['iitax'])[0]
+    for name in ['II_rt1', 'STD', 'EITC_indiv', 'ID_BenefitSurtax_Switch']:
+        value = kernel_argument(getattr(pol, name))
+        assert numba.typeof(value) == argument_signature([name])[0]
+    assert argument_signature(['MARS', 'II_rt1'], ['MARS']) == (
+        types['MARS'], types['II_rt1'])
+    assert not argument_signature(['MARS'])[0].mutable
+    assert argument_signature(['MARS', 'no_such_name']) is None
+    assert not Magic_calc3.compile_typed()
+
+
+def test_iterate_jit_read_only_arrays():
+    """
+    Test that read-only input arrays are not copied and that a read-only
+    output array is replaced by a writable copy only once.
+    """
+    pm = Foo()
+    pf = Foo()
+    pf.a = np.zeros((5,))
+    pf.b = np.zeros((5,))
+    pf.x = np.ones((5,))
+    pf.y = np.ones((5,))
+    pf.z = np.arange(5.)
+    for array in (pf.b, pf.x, pf.z):
+        array.flags.writeable = False
+    x_array = pf.x
+    Magic_calc3(pm, pf)
+    assert pf.x is x_array
+    assert pf.b.flags.writeable
+    b_array = pf.b
+    Magic_calc3(pm, pf)
+    assert pf.b is b_array
+    assert np.array_equal(pf.b, [2., 3., 4., 5., 6.])
+
+
+class Bar(object):
+    pass
+
+
+def test_iterate_jit_reuses_argument_layout():
+    """
+    Test that repeated calls with same and with different argument layouts
+    give correct results.
+    """
+    pm = Foo()
+    pf = Bar()
+    pm.a = np.zeros((5,))
+    pm.b = np.zeros((5,))
+    pf.x = np.ones((5,))
+    pf.y = np.ones((5,))
+    pf.z = np.ones((5,))
+    ans = Magic_calc7(pm, pf)
+    exp = DataFrame(data=[[2.0, 3.0]] * 5, columns=["a", "b"])
+    assert_frame_equal(ans, exp)
+    # second call with same layout sees updated argument values
+    pf.z = np.full((5,), 2.0)
+    ans = Magic_calc7(pm, pf)
+    exp = DataFrame(data=[[2.0, 4.0]] * 5, columns=["a", "b"])
+    assert_frame_equal(ans, exp)
+    # call with a different layout in which pf holds the output arguments
+    qm = Bar()
+    qf = Foo()
+    qm.x = np.ones((5,))
+    qm.y = np.ones((5,))
+    qm.z = np.ones((5,))
+    qf.a = np.zeros((5,))
+    qf.b = np.zeros((5,))
+    ans = Magic_calc7(qm, qf)
+    exp = DataFrame(data=[[2.0, 3.0]] * 5, columns=["a", "b"])
+    assert_frame_equal(ans, exp)
+    assert np.allclose(qf.b, 3.0)
+    # call with objects of same types holding arguments differently
+    rm = Foo()
+    rf = Bar()
+    rm.x = np.ones((5,))
+    rm.y = np.ones((5,))
+    rm.z = np.ones((5,))
+    rf.a = np.zeros((5,))
+    rf.b = np.zeros((5,))
+    ans = Magic_calc7(rm, rf)
+    assert_frame_equal(ans, exp)
+    assert np.allclose(rf.b, 3.0)
+
+
+def Magic_calc8(x, y, z):
+    a = x + y
+    b = a * z
+    return (a, b)
+
+
+def test_make_apply_function_uses_kernel_cache(tmpdir, monkeypatch):
+    """
+    Test that jitted apply-style functions are written to on-disk cache
+    and that a second make_apply_function call loads the cached module.
+    """
+    monkeypatch.setenv('TAXCALC_CACHE_DIR', str(tmpdir))
+    monkeypatch.delenv('NOTAXCALCCACHE', raising=False)
+    cache_dir = kernel_cache_dir()
+    assert cache_dir == os.path.join(str(tmpdir), 'kernels')
+    assert cacheable(Magic_calc8)
+    ap_func = make_apply_function(Magic_calc8, ['a', 'b'], ['x', 'y', 'z'],
+                                  [], do_jit=True, nopython=True)
+    modfiles = [fname for fname in os.listdir(cache_dir)
+                if fname.endswith('.py')]
+    assert len(modfiles) == 1
+    assert modfiles[0].startswith('taxcalc_ap_Magic_calc8_')
+    a_out = np.zeros((3,))
+    b_out = np.zeros((3,))
+    ones = np.ones((3,))
+    ap_func(a_out, b_out, ones, ones, np.full((3,), 2.0))
+    assert np.allclose(a_out, 2.0)
+    assert np.allclose(b_out, 4.0)
+    # second call generates the same module, so no new file is written
+    ap_func2 = make_apply_function(Magic_calc8, ['a', 'b'], ['x', 'y', 'z'],
+                                   [], do_jit=True, nopython=True)
+    assert len([fname for fname in os.listdir(cache_dir)
+                if fname.endswith('.py')]) == 1
+    ap_func2(a_out, b_out, ones, ones, ones)
+    assert np.allclose(b_out, 2.0)
+    # caching is turned off by the NOTAXCALCCACHE environment variable
+    monkeypatch.setenv('NOTAXCALCCACHE', 'NOCACHE')
+    assert kernel_cache_dir() is None
+
+
+def test_kernel_cache_key_covers_called_functions(tmpdir, monkeypatch):
+    """
+    Test that the cached module is not used after a change to a jitted
+    function called by the calc-style function or to the taxcalc version.
+    """
+    monkeypatch.setenv('TAXCALC_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.delenv('NOTAXCALCCACHE', raising=False)
+    cache_dir = kernel_cache_dir()
+    source = ('from taxcalc.decorators import JIT\n'
+              '@JIT(nopython=True)\n'
+              'def helper(x):\n'
+              '    return x * {}\n'
+              'def calc(x):\n'
+              '    y = helper(x)\n'
+              '    return y\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    results = list()
+    for factor, version in [(2., '1.0'), (3., '1.0'), (3., '2.0')]:
+        tmpdir.join('kcachemod.py').write(source.format(factor))
+        sys.modules.pop('kcachemod', None)
+        importlib.invalidate_caches()
+        calc = importlib.import_module('kcachemod').calc
+        monkeypatch.setattr(taxcalc, '__version__', version)
+        ap_func = make_apply_function(calc, ['y'], ['x'], [],
+                                      do_jit=True, nopython=True)
+        y_out = np.zeros((2,))
+        ap_func(y_out, np.ones((2,)))
+        results.append(y_out[0])
+    sys.modules.pop('kcachemod', None)
+    assert results == [2., 3., 3.]
+    assert len([fname for fname in os.listdir(cache_dir)
+                if fname.endswith('.py')]) == 3
+
+
+def test_cacheable_rejects_function_without_source_file():
+    fakeglobals = {}
+    exec('def calc(x):\n    return x\n', fakeglobals)
+    assert not cacheable(fakeglobals['calc'])
+    assert cacheable(Magic_calc8)
+
+
+def test_create_fused_function_string():
+    ans = create_fused_function_string(
+        ['a', 'x', 'b', 'w'],
+        [('f1', ['a'], ['x', 'w']), 'x[i] = 0.', ('f2', ['b'], ['a'])],
+        ['w'])
+    exp = ("def fused_func(a,x,b,w):\n"
+           "  for i in range(len(a)):\n"
+           "    a[i] = f1(x[i],w)\n"
+           "    x[i] = 0.\n"
+           "    b[i] = f2(a[i])\n"
+           "  return\n")
+    assert ans == exp
+
+
+def test_make_fused_function():
+    """
+    Test that a fused function gives the same results as calling each
+    of its calc-style functions in turn.
+    """
+    fused = make_fused_function([Magic_calc3, 'a_save = a[i]',
+                                 Magic_calc5, 'b[i] = b[i] + a_save',
+                                 'c[i] = a_save'])
+    pm = Foo()
+    pf = Foo()
+    pm.w = np.full((5,), 2.0)
+    pf.a = np.zeros((5,))
+    pf.b = np.zeros((5,))
+    pf.c = np.zeros((5,))
+    pf.x = np.ones((5,))
+    pf.y = np.ones((5,))
+    pf.z = np.arange(5.)
+    assert fused(pm, pf) is None
+    assert np.allclose(pf.a, 2.0)
+    assert np.allclose(pf.b, 6.0 + np.arange(5.))
+    # variables used only in lines of code are arguments too
+    assert np.allclose(pf.c, 2.0)
+
+
+def test_kernel_threads(monkeypatch):
+    """
+    Test that functions decorated by iterate_jit give the same results
+    inside and outside a kernel_threads context.
+    """
+    monkeypatch.delenv('TAXCALC_NUM_THREADS', raising=False)
+    assert default_num_threads() == 1
+    monkeypatch.setenv('TAXCALC_NUM_THREADS', '3')
+    assert default_num_threads() == 3
+    for bad_value in ['0', 'two']:
+        monkeypatch.setenv('TAXCALC_NUM_THREADS', bad_value)
+        with pytest.raises(ValueError):
+            default_num_threads()
+    with pytest.raises(ValueError):
+        with kernel_threads(0):
+            pass
+    pm = Foo()
+    pf = Foo()
+    pf.a = np.zeros((100,))
+    pf.b = np.zeros((100,))
+    pf.x = np.arange(100.)
+    pf.y = np.ones((100,))
+    pf.z = np.arange(100.)
+    Magic_calc3(pm, pf)
+    serial_b = pf.b.copy()
+    pf.b = np.zeros((100,))
+    with kernel_threads(2):
+        assert parallel_kernels() == (numba.config.NUMBA_NUM_THREADS > 1)
+        Magic_calc3(pm, pf)
+    assert not parallel_kernels()
+    assert np.array_equal(pf.b, serial_b)
+
+
+class Bar(object):
+    array_len = 7
+
+
+@timed
+def timed_calc(bar, x):
+    return x + bar.array_len
+
+
+def test_kernel_timings():
+    """
+    Test that calls of functions decorated by iterate_jit or timed are
+    recorded only inside a kernel_timings context with a registry.
+    """
+    pm = Foo()
+    pf = Foo()
+    pf.a = np.zeros((100,))
+    pf.b = np.zeros((100,))
+    pf.x = np.arange(100.)
+    pf.y = np.ones((100,))
+    pf.z = np.arange(100.)
+    registry = dict()
+    Magic_calc3(pm, pf)
+    assert timed_calc(Bar(), 1) == 8
+    with kernel_timings(registry):
+        Magic_calc3(pm, pf)
+        Magic_calc3(pm, pf)
+        assert timed_calc(Bar(), 1) == 8
+        with kernel_timings(None):
+            Magic_calc3(pm, pf)
+    Magic_calc3(pm, pf)
+    assert sorted(registry.keys()) == ['Magic_calc3', 'timed_calc']
+    assert registry['Magic_calc3'][:2] == [2, 200]
+    assert registry['timed_calc'][:2] == [1, 7]
+    assert all(entry[2] >= 0. for entry in registry.values())
+    assert timed_calc.__name__ == 'timed_calc'
+
+
+@JIT(nopython=True)
+def branchy_helper(x, rate):
+    if x > 2.:
+        return_value = rate * x
+    else:
+        return_value = 0.
+    return return_value
+
+
+def branchy_calc(MARS, x, y, brk, rate):
+    a = min(x, brk[MARS - 1])
+    if MARS in (1, 4) and not y > 3.:
+        b = a + y
+    elif 1. < x <= 3.:
+        b = max(x, y, 2.5)
+        a += 1.
+    else:
+        b = branchy_helper(x, rate)
+        if x > 4:
+            b = round(b / 3., 2)
+    c = b if a > 1. else -b
+    return (a, b, c)
+
+
+def test_vectorized_function():
+    """
+    Test that the array-at-a-time version of a calc-style function gives
+    the same results as calling the function for one record at a time.
+    """
+    mars = np.array([1, 2, 4, 2, 2, 1])
+    x = np.array([0., 1.5, 3., 3.5, 5., 7.])
+    y = np.array([4., 1., 2., 0., 0., 1.])
+    brk = np.array([3., 2., 3., 3.])
+    rate = 0.25
+    vfunc = vectorized_function(branchy_calc)
+    ans = vfunc(mars, x, y, brk, rate)
+    for i in range(len(x)):
+        exp = branchy_calc(mars[i], x[i], y[i], brk, rate)
+        for ans_var, exp_var in zip(ans, exp):
+            assert ans_var[i] == exp_var
+    # functions with statements that cannot be translated are rejected
+    # (using module attribute because test_force_no_jit reloads module)
+    with pytest.raises(taxcalc.decorators.VectorizeError):
+        vectorized_function(unjittable_function1)
+    line = Vectorizer().line_string('a[i] = 0. if b[i] > 1. else c',
+                                    ['a', 'b'])
+    assert line == '    a[:] = np.where((np.copy(b) > 1.0), 0.0, c)'
+
+
+def test_make_apply_function_vectorized():
+    ap_func = make_apply_function(branchy_calc, ['a', 'b', 'c'],
+                                  ['MARS', 'x', 'y', 'brk', 'rate'],
+                                  ['brk', 'rate'], do_jit=False)
+    zeros = np.zeros((3,))
+    mars = np.array([1, 2, 2])
+    x = np.array([0., 2., 5.])
+    ans = ap_func(zeros.copy(), zeros.copy(), zeros.copy(), mars, x,
+                  np.ones((3,)), np.full((4,), 3.), 0.25)
+    assert np.allclose(ans[0], [0., 3., 3.])
+    assert np.allclose(ans[1], [1., 2.5, 0.42])
+    assert np.allclose(ans[2], [-1., 2.5, 0.42])
+
+
+def test_create_batched_function_string():
+    ans = create_batched_function_string(
+        ['a', 'x', 'b', 'w'],
+        [('f1', ['a'], ['x', 'w']), 'a[i] = a[i] + x[i]',
+         ('f2', ['b'], ['a'])],
+        ['w'], ['b'])
+    exp = ("def batched_func(a,x,b,w,s_a,s_b,out_b):\n"
+           "  for i in range(len(a)):\n"
+           "    for k in range(len(s_a)):\n"
+           "      s_a[k] = a[i]\n"
+           "      s_b[k] = b[i]\n"
+           "      s_a[k] = f1(x[i],w[k])\n"
+           "      s_a[k] = s_a[k] + x[i]\n"
+           "      s_b[k] = f2(s_a[k])\n"
+           "      out_b[k, i] = s_b[k]\n"
+           "  return\n")
+    assert ans == exp
+
+
+def test_make_batched_function():
+    """
+    Test that a batched function gives the same results as a fused
+    function called separately for each scenario.
+    """
+    steps = [Magic_calc3, 'a_save = a[i]', Magic_calc5, 'b[i] = b[i] + a_save']
+    batched = make_batched_function(steps, ['a', 'b'])
+    fused = make_fused_function(steps)
+    pms = list()
+    for wval in [1.0, 2.0, 5.0]:
+        pm = Foo()
+        pm.w = np.full((5,), wval)
+        pms.append(pm)
+    pf = Foo()
+    pf.a = np.zeros((5,))
+    pf.b = np.zeros((5,))
+    pf.x = np.ones((5,))
+    pf.y = np.ones((5,))
+    pf.z = np.arange(5.)
+    ans = batched(pms, pf)
+    assert np.allclose(pf.b, 0.)
+    for idx, pm in enumerate(pms):
+        fused(pm, pf)
+        assert np.array_equal(ans['a'][idx], pf.a)
+        assert np.array_equal(ans['b'][idx], pf.b)
+    with pytest.raises(ValueError):
+        make_batched_function(steps, ['q'])
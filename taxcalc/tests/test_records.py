@@ -2,7 +2,9 @@
 # pycodestyle test_records.py
 
 import os
+import copy
 import json
+import pickle
 import numpy as np
 from numpy.testing import assert_array_equal
 import pandas as pd
@@ -50,6 +52,236 @@ def test_correct_Records_instantiation(cps_subsample):
     assert rec2.current_year == rec2.data_year
 
 
+def test_deepcopy_shares_read_variables(cps_subsample):
+    """
+    Test that a deepcopy of a Records object shares the read variables
+    with the original object until one of them changes the variables.
+    """
+    rec1 = Records.cps_constructor(data=cps_subsample)
+    rec2 = copy.deepcopy(rec1)
+    assert rec2.e00200 is rec1.e00200
+    assert rec2.MARS is rec1.MARS
+    assert rec2.WT is rec1.WT
+    assert rec2.iitax is not rec1.iitax
+    e00200 = rec1.e00200.copy()
+    rec2.increment_year()
+    assert rec2.current_year == rec1.current_year + 1
+    assert_array_equal(rec1.e00200, e00200)
+    assert not np.array_equal(rec2.e00200, e00200)
+    assert rec2.MARS is rec1.MARS
+    rec2.set_current_year(rec1.current_year + 2)
+    assert np.all(rec1.FLPDYR == rec1.current_year)
+    var = rec2.writable_array('e17500')
+    var += 1.
+    assert var is rec2.e17500
+    assert not np.array_equal(rec1.e17500, rec2.e17500)
+    assert rec2.writable_array('e17500') is var
+
+
+def test_block_storage(cps_subsample):
+    """
+    Test that Records variables are rows of blocks that are zeroed,
+    copied, and pickled as a whole.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    assert rec.e00200.base is rec.e00300.base
+    assert rec.iitax.base is rec.c00100.base
+    assert rec.iitax.flags['C_CONTIGUOUS']
+    rec.iitax.fill(1.)
+    rec.c00100 = np.ones(rec.array_length)  # no longer a row of its block
+    rec.zero_out_changing_calculated_vars()
+    assert np.all(rec.iitax == 0.)
+    assert np.all(rec.c00100 == 0.)
+    rec.iitax.fill(2.)
+    rec2 = copy.deepcopy(rec)
+    rec2.iitax += 1.
+    assert np.all(rec.iitax == 2.)
+    assert rec2.iitax.base is rec2.c04470.base
+    rec3 = pickle.loads(pickle.dumps(rec))
+    for varname in ['e00200', 'MARS', 'iitax', 'c00100', 's006']:
+        assert_array_equal(getattr(rec3, varname), getattr(rec, varname))
+    assert rec3.iitax.base is rec3.c04470.base
+    assert rec3.c00100.base is not rec3.c04470.base
+
+
+def test_lazy_variables(cps_subsample):
+    """
+    Test that calculated-variable blocks are allocated when first used and
+    that read variables not in the data share a read-only array of zeros.
+    """
+    data = cps_subsample[['RECID', 'MARS', 'e00200', 'e00200p', 'e00200s']]
+    rec = Records(data=data, start_year=2014, gfactors=GrowFactors(),
+                  weights=None)
+    blocks = rec._Records__blocks
+    assert 'float_calc' not in blocks
+    assert rec.e00300.base is None
+    assert rec.e00300 is rec.e00400
+    assert not rec.e00300.flags.writeable
+    with pytest.raises(ValueError):
+        rec.e00300[0] = 1.
+    rec.writable_array('e00300')[0] = 1.
+    assert rec.e00300[0] == 1. and rec.e00400[0] == 0.
+    rec.c00100 = np.ones(rec.array_length)  # set before block allocation
+    assert np.all(rec.iitax == 0.)
+    assert 'float_calc' in blocks
+    assert np.all(rec.c00100 == 1.)
+    assert rec.c00100.base is not rec.iitax.base
+    with pytest.raises(AttributeError):
+        rec.no_such_variable  # pylint: disable=pointless-statement
+    # unread variables remain shared zeros after copying, pickling,
+    # and extrapolation
+    for rec2 in (copy.deepcopy(rec), pickle.loads(pickle.dumps(rec))):
+        rec2.increment_year()
+        assert rec2.e00400 is rec2.e00600
+        assert not rec2.e00400.flags.writeable
+        assert np.all(rec2.e00400 == 0.)
+        assert rec2.e00300[0] != 1.
+    assert rec.e00300[0] == 1.
+    # calculations are unchanged when all read variables are in the data
+    full = Records(data=data.reindex(columns=sorted(Records.USABLE_READ_VARS),
+                                     fill_value=0),
+                   start_year=2014, gfactors=GrowFactors(), weights=None)
+    results = list()
+    for records in (Records(data=data, start_year=2014,
+                            gfactors=GrowFactors(), weights=None), full):
+        calc = Calculator(policy=Policy(), records=records)
+        calc.advance_to_year(2016)
+        calc.calc_all()
+        results.append(calc.array('iitax'))
+    assert_array_equal(results[0], results[1])
+
+
+def test_csv_input(tmpdir, monkeypatch):
+    """
+    Test reading Records data from CSV files in chunks.
+    """
+    monkeypatch.setattr(Records, 'CSV_CHUNK_ROWS', 1)
+    rawinput = ('RECID,MARS,e00200,e00200p,unused_column\n'
+                '1,2,1000.5,1000.5,x\n'
+                '2,1,2000.25,2000.25,y\n')
+    path = str(tmpdir.join('raw.csv'))
+    with open(path, 'w') as rfile:
+        rfile.write(rawinput)
+    rec = Records(data=path, start_year=2018, gfactors=None, weights=None)
+    assert rec.IGNORED_VARS == set(['unused_column'])
+    assert rec.MARS.dtype == np.int32
+    assert_array_equal(rec.MARS, [2, 1])
+    assert_array_equal(rec.e00200, [1000.5, 2000.25])
+    # an integer variable with whole-number values written as floats is
+    # read, and blank lines are skipped
+    with open(path, 'w') as rfile:
+        rfile.write(rawinput.replace(',2,1000.5', ',2.0,1000.5') + '\n\n')
+    rec = Records(data=path, start_year=2018, gfactors=None, weights=None)
+    assert_array_equal(rec.MARS, [2, 1])
+    assert rec.array_length == 2
+    # an integer variable with missing or non-integer values is not read
+    for value in ['', '2.5']:
+        with open(path, 'w') as rfile:
+            rfile.write(rawinput.replace(',2,1000.5',
+                                         ',{},1000.5'.format(value)))
+        with pytest.raises(ValueError, match='integer variable MARS'):
+            Records(data=path, start_year=2018, gfactors=None, weights=None)
+
+
+def test_missing_integer_values(cps_subsample):
+    """
+    Test that missing values of an integer variable raise an error rather
+    than being read as a very negative integer.
+    """
+    data = cps_subsample.copy()
+    data['XTOT'] = data['XTOT'].astype(np.float64)
+    data.loc[data.index[0], 'XTOT'] = np.nan
+    with pytest.raises(ValueError):
+        Records.cps_constructor(data=data)
+
+
+def test_input_cache(cps_path, tmpdir):
+    """
+    Test that Records data read from the input cache equal the parsed data.
+    """
+    with pytest.raises(ValueError):
+        Records.cps_constructor(cache_dir=str(tmpdir.join('missing')))
+    data_path = str(tmpdir.join('cps.csv.gz'))
+    with open(cps_path, 'rb') as ifile, open(data_path, 'wb') as ofile:
+        ofile.write(ifile.read())
+    cache_dir = tmpdir.mkdir('inputs')
+    expect = Records.cps_constructor(data=data_path)
+    assert cache_dir.listdir() == []
+    for _ in range(2):  # first parse and write cache, then read cache
+        rec = Records.cps_constructor(data=data_path,
+                                      cache_dir=str(cache_dir))
+        assert len(cache_dir.listdir()) == 1
+        assert rec.IGNORED_VARS == expect.IGNORED_VARS
+        assert rec.array_length == expect.array_length
+        for varname in Records.USABLE_READ_VARS | Records.CALCULATED_VARS:
+            assert_array_equal(getattr(rec, varname),
+                               getattr(expect, varname))
+    # changes to cached data stay private to the Records object
+    rec.increment_year()
+    expect.increment_year()
+    assert_array_equal(rec.e00200, expect.e00200)
+    rec = Records.cps_constructor(data=data_path, cache_dir=str(cache_dir))
+    original = Records.cps_constructor()
+    assert_array_equal(rec.e00200, original.e00200)
+    # a changed data file replaces its old cache entry
+    old_entry = cache_dir.listdir()[0]
+    mtime = os.stat(data_path).st_mtime
+    os.utime(data_path, (mtime + 10., mtime + 10.))
+    rec = Records.cps_constructor(data=data_path, cache_dir=str(cache_dir))
+    assert len(cache_dir.listdir()) == 1
+    assert cache_dir.listdir()[0] != old_entry
+    assert_array_equal(rec.e00200, original.e00200)
+
+
+def test_columnar_input(cps_subsample, tmpdir):
+    """
+    Test reading Records data from Parquet and Feather files.
+    """
+    with pytest.raises(ValueError):
+        Records(data=str(tmpdir.join('missing.parquet')))
+    pytest.importorskip('pyarrow')
+    data = cps_subsample.reset_index(drop=True)
+    data['unused_column'] = 1.
+    expect = Records.cps_constructor(data=data)
+    for suffix, writer in [('.parquet', data.to_parquet),
+                           ('.feather', data.to_feather)]:
+        path = str(tmpdir.join('cps' + suffix))
+        writer(path)
+        rec = Records(data=path,
+                      exact_calculations=False,
+                      gfactors=GrowFactors(),
+                      weights=Records.CPS_WEIGHTS_FILENAME,
+                      adjust_ratios=Records.CPS_RATIOS_FILENAME,
+                      start_year=Records.CPSCSV_YEAR)
+        assert rec.IGNORED_VARS == expect.IGNORED_VARS
+        assert 'unused_column' in rec.IGNORED_VARS
+        for varname in ['e00200', 'MARS', 'XTOT', 's006']:
+            assert_array_equal(getattr(rec, varname),
+                               getattr(expect, varname))
+        assert rec.MARS.dtype == np.int32
+
+
+def test_row_subset(cps_subsample):
+    """
+    Test that calculations for a row subset of a Records object give the
+    same results for those rows as calculations for all the rows.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    rows = np.flatnonzero(rec.MARS == 2)
+    sub = rec.row_subset(rows)
+    assert sub.array_length == len(rows)
+    assert sub.current_year == rec.current_year
+    assert_array_equal(sub.e00200, rec.e00200[rows])
+    calc1 = Calculator(policy=Policy(), records=rec)
+    calc2 = Calculator(policy=Policy(), records=sub)
+    calc1.calc_all()
+    calc2.calc_all()
+    assert calc2.array_len == len(rows)
+    assert_array_equal(calc2.array('iitax'), calc1.array('iitax')[rows])
+    assert_array_equal(calc2.array('payrolltax'),
+                       calc1.array('payrolltax')[rows])
+
+
 def test_read_cps_data(cps_fullsample):
     data = Records.read_cps_data()
     assert data.equals(cps_fullsample)
@@ -0,0 +1,79 @@
+"""
+Tests for Tax-Calculator resultcache.py logic.
+"""
+# CODING-STYLE CHECKS:
+# pycodestyle test_resultcache.py
+# pylint --disable=locally-disabled test_resultcache.py
+
+import numpy as np
+import pytest
+from taxcalc import Policy, Records, Calculator, ResultCache
+
+
+def test_incorrect_resultcache_instantiation(cps_subsample, tmpdir):
+    with pytest.raises(ValueError):
+        ResultCache(max_entries=0)
+    with pytest.raises(ValueError):
+        ResultCache(cache_dir=str(tmpdir.join('missing')))
+    rec = Records.cps_constructor(data=cps_subsample)
+    with pytest.raises(ValueError):
+        Calculator(policy=Policy(), records=rec, cache=dict())
+
+
+def test_calc_all_cache(cps_subsample, tmpdir):
+    """
+    Test that cached calc_all results equal calculated results.
+    """
+    rec = Records.cps_constructor(data=cps_subsample)
+    cache = ResultCache(max_entries=1, cache_dir=str(tmpdir))
+    reform = {2018: {'_II_em': [1000]}}
+    results = dict()
+    for cached in (False, True, True):
+        for ref in (None, reform):
+            pol = Policy()
+            if ref is not None:
+                pol.implement_reform(ref)
+            calc = Calculator(policy=pol, records=rec,
+                              cache=cache if cached else None,
+                              timing=True)
+            calc.advance_to_year(2018)
+            calc.calc_all()
+            key = (cached, ref is None)
+            if key in results:
+                assert 'cached_calc_all' in calc.timings().index
+            results[key] = calc.dataframe(sorted(Records.CALCULATED_VARS))
+    assert cache.misses == 2
+    assert cache.hits == 2
+    assert len(cache) == 1
+    for baseline in (True, False):
+        assert results[(True, baseline)].equals(results[(False, baseline)])
+    assert not results[(False, True)].equals(results[(False, False)])
+    # a new cache finds the results written to cache_dir
+    calc = Calculator(policy=Policy(), records=rec,
+                      cache=ResultCache(cache_dir=str(tmpdir)))
+    calc.advance_to_year(2018)
+    fingerprint = calc.fingerprint()
+    calc.calc_all()
+    assert calc.fingerprint() == fingerprint
+    assert np.allclose(calc.array('iitax'), results[(False, True)]['iitax'])
+    calc.array('e00200', calc.array('e00200') + 1.)
+    assert calc.fingerprint() != fingerprint
+
+
+def test_cache_distinguishes_exact_calculations(cps_subsample):
+    """
+    Test that Calculator objects differing only in exact_calculations do
+    not share cached calc_all results.
+    """
+    cache = ResultCache()
+    iitax = dict()
+    for exact in (False, True):
+        rec = Records.cps_constructor(data=cps_subsample,
+                                      exact_calculations=exact)
+        calc = Calculator(policy=Policy(), records=rec, cache=cache)
+        calc.advance_to_year(2018)
+        calc.calc_all()
+        iitax[exact] = calc.array('iitax')
+    assert cache.misses == 2
+    assert cache.hits == 0
+    assert not np.allclose(iitax[False], iitax[True])
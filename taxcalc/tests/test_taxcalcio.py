@@ -356,6 +356,29 @@ def test_ctor_init_with_cps_files():
     assert tcio.errmsg
 
 
+def test_parquet_input(tmpdir):
+    """
+    Test use of Parquet input file.
+    """
+    pytest.importorskip('pyarrow')
+    idf = pd.read_csv(StringIO(RAWINPUT))
+    idf['unused_column'] = 1
+    infile = str(tmpdir.join('raw.parquet'))
+    idf.to_parquet(infile)
+    txyr = 2020
+    tcio = TaxCalcIO(infile, txyr, None, None, None,
+                     outdir=str(tmpdir))
+    assert not tcio.errmsg
+    tcio.init(infile, txyr, None, None, None,
+              aging_input_data=False,
+              exact_calculations=False)
+    assert not tcio.errmsg
+    assert tcio.output_filepath().endswith('raw-20-#-#-#.csv')
+    tcio.analyze(writing_output_file=True)
+    outdf = pd.read_csv(tcio.output_filepath())
+    assert list(outdf['RECID']) == [1, 2, 3, 4]
+
+
 @pytest.mark.parametrize("dumpvar_str, str_valid, num_vars", [
     ("""
     MARS;iitax	payrolltax|combined,
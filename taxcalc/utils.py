@@ -1408,6 +1408,30 @@ def read_egg_json(fname):
     return pdict  # pragma: no cover
 
 
+def cache_subdir(name):
+    """
+    Return path of the writable name subdirectory of the taxcalc cache
+    directory, creating it if necessary, or return None when on-disk
+    caching has been turned off by setting the NOTAXCALCCACHE environment
+    variable or when the subdirectory cannot be written.  The taxcalc
+    cache directory is specified by the TAXCALC_CACHE_DIR environment
+    variable, and by default is a taxcalc directory in the user's cache
+    directory.
+    """
+    if 'NOTAXCALCCACHE' in os.environ:
+        return None
+    default_dir = os.path.join(os.path.expanduser('~'), '.cache', 'taxcalc')
+    cache_dir = os.path.join(os.environ.get('TAXCALC_CACHE_DIR', default_dir),
+                             name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(cache_dir, os.W_OK):
+        return None
+    return cache_dir
+
+
 def delete_file(filename):
     """
     Remove specified file if it exists.